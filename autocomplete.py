@@ -0,0 +1,436 @@
+#! /usr/bin/env python3
+import argparse
+import bisect
+import difflib
+import heapq
+import sys
+import threading
+import time
+import unicodedata
+import pymongo
+from connection import catalogue_reads, get_client
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize text for matching, case and accents are ignored and spaces
+    are collapsed
+
+    Args:
+        text: the text
+
+    Returns: The normalized text
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.split())
+
+
+class SuggestionIndex:
+    """Sorted arrays of the normalized values of every suggested field"""
+
+    def __init__(self):
+        # per field a sorted list of normalized values and, by normalized
+        # value, the value as first written and the number of books with it
+        self.keys = {field: [] for field in FIELDS}
+        self.entries = {field: {} for field in FIELDS}
+        # per field the TOP_K keys with the most books by prefix, a value
+        # that changes drops the prefixes it starts with
+        self.top = {field: {} for field in FIELDS}
+        self.lock = threading.Lock()
+
+    def forget_prefixes(self, field: str, key: str) -> None:
+        """
+        Drop the ranked prefixes a changed value is in
+
+        Args:
+            field: name of the suggested field
+            key: normalized value
+        """
+        top = self.top[field]
+        for length in range(len(key) + 1):
+            top.pop(key[:length], None)
+
+    def add_value(self, field: str, value: str) -> None:
+        """
+        Count one more book with a value
+
+        Args:
+            field: name of the suggested field
+            value: the value
+        """
+        key = normalize(value)
+        if not key:
+            return
+        self.forget_prefixes(field, key)
+        entries = self.entries[field]
+        if key in entries:
+            entries[key][1] += 1
+        else:
+            entries[key] = [value, 1]
+            bisect.insort(self.keys[field], key)
+
+    def remove_value(self, field: str, value: str) -> None:
+        """
+        Count one less book with a value, the value is dropped at zero
+
+        Args:
+            field: name of the suggested field
+            value: the value
+        """
+        key = normalize(value)
+        entries = self.entries[field]
+        if key not in entries:
+            return
+        self.forget_prefixes(field, key)
+        entries[key][1] -= 1
+        if entries[key][1] <= 0:
+            del entries[key]
+            keys = self.keys[field]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def add_book(self, book: dict) -> None:
+        """
+        Add the values of a book
+
+        Args:
+            book: the book
+        """
+        with self.lock:
+            for field, values in FIELDS.items():
+                for value in values(book):
+                    self.add_value(field, value)
+
+    def load(self, books) -> None:
+        """
+        Add many books, the arrays are sorted once at the end instead of an
+        insert per new value
+
+        Args:
+            books: iterable of books
+        """
+        with self.lock:
+            for book in books:
+                for field, values in FIELDS.items():
+                    entries = self.entries[field]
+                    for value in values(book):
+                        key = normalize(value)
+                        if not key:
+                            continue
+                        if key in entries:
+                            entries[key][1] += 1
+                        else:
+                            entries[key] = [value, 1]
+            for field, entries in self.entries.items():
+                self.keys[field] = sorted(entries)
+                self.top[field] = {}
+
+    def remove_book(self, book: dict) -> None:
+        """
+        Remove the values of a book
+
+        Args:
+            book: the book as it was added
+        """
+        with self.lock:
+            for field, values in FIELDS.items():
+                for value in values(book):
+                    self.remove_value(field, value)
+
+    def complete(self, field: str, prefix: str, limit: int = 10) -> list:
+        """
+        Get the most common values that start with a prefix. Every value
+        with the prefix is ranked, with a heap over its range of the sorted
+        keys, and the top TOP_K of a prefix are kept until a value with the
+        prefix changes, so the short prefixes with the most values are
+        ranked once
+
+        Args:
+            field: name of the suggested field
+            prefix: what the user typed
+            limit: number of suggestions
+
+        Returns: list of values, most books first
+        """
+        prefix = normalize(prefix)
+        with self.lock:
+            entries = self.entries[field]
+            top = self.top[field]
+            ranked = top.get(prefix)
+            if ranked is None or limit > TOP_K:
+                keys = self.keys[field]
+                start = bisect.bisect_left(keys, prefix)
+                end = bisect.bisect_left(keys, prefix + chr(0x10FFFF), lo=start)
+                # ties keep the order of the keys
+                ranked = heapq.nlargest(
+                    max(limit, TOP_K),
+                    keys[start:end],
+                    key=lambda key: entries[key][1],
+                )
+                if limit <= TOP_K:
+                    if len(top) >= TOP_PREFIXES:
+                        top.clear()
+                    top[prefix] = ranked
+            return [entries[key][0] for key in ranked[:limit]]
+
+    def did_you_mean(self, field: str, text: str, limit: int = 3) -> list:
+        """
+        Get values close to a search that found nothing, the candidates are
+        the values that share its first letters
+
+        Args:
+            field: name of the suggested field
+            text: the search
+            limit: number of suggestions
+
+        Returns: list of values
+        """
+        key = normalize(text)
+        if not key:
+            return []
+        with self.lock:
+            keys = self.keys[field]
+            entries = self.entries[field]
+            for length in [2, 1]:
+                start = bisect.bisect_left(keys, key[:length])
+                end = bisect.bisect_left(keys, key[:length] + "\uffff")
+                if end > start:
+                    break
+            candidates = keys[start : min(end, start + DID_YOU_MEAN_LIMIT)]
+            close = difflib.get_close_matches(key, candidates, n=limit, cutoff=0.6)
+            return [entries[match][0] for match in close]
+
+
+def title_values(book: dict) -> list:
+    """
+    Get the suggested titles of a book
+
+    Args:
+        book: the book
+
+    Returns: list with the title
+    """
+    return [book["title"]] if book.get("title") else []
+
+
+def author_values(book: dict) -> list:
+    """
+    Get the suggested author names of a book
+
+    Args:
+        book: the book
+
+    Returns: names of the authors
+    """
+    return [author["name"] for author in book.get("author", []) if "name" in author]
+
+
+def pseudonym_values(book: dict) -> list:
+    """
+    Get the suggested pseudonyms of a book
+
+    Args:
+        book: the book
+
+    Returns: pseudonyms of the authors
+    """
+    authors = book.get("author", [])
+    return [author["pseudonym"] for author in authors if "pseudonym" in author]
+
+
+def list_values(list_field: str):
+    """
+    Make the function that gets the suggested values of a list field
+
+    Args:
+        list_field: genres, sub_genres or main_characters
+
+    Returns: function(book) returning the values of the field
+    """
+    return lambda book: book.get(list_field, [])
+
+
+def build_index(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> SuggestionIndex:
+    """
+    Build the suggestion index with one streamed pass over the books
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: The index
+    """
+    index = SuggestionIndex()
+    cursor = catalogue_reads(db).books.find(
+        {}, PROJECTION, batch_size=BUILD_BATCH_SIZE, session=session
+    )
+    with cursor:
+        index.load(cursor)
+    return index
+
+
+def get_index(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> SuggestionIndex:
+    """
+    Get the suggestion index of this process, it is built on first use
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: The index
+    """
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = build_index(session=session, db=db)
+    return _INDEX
+
+
+def book_added(book: dict) -> None:
+    """
+    Add a new book to the index if it is built, called by the write paths
+
+    Args:
+        book: the book
+
+    Returns: None
+    """
+    if _INDEX is not None:
+        _INDEX.add_book(book)
+    return
+
+
+def book_changed(old_book: dict, new_book: dict) -> None:
+    """
+    Update the index after a book was edited, called by the write paths
+
+    Args:
+        old_book: the book before the edit
+        new_book: the book after the edit, None if it was deleted
+
+    Returns: None
+    """
+    if _INDEX is None:
+        return
+    _INDEX.remove_book(old_book)
+    if new_book is not None:
+        _INDEX.add_book(new_book)
+    return
+
+
+def prompt(
+    text: str,
+    field: str,
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> str:
+    """
+    Read a search term, Tab completes it from the index where readline is
+    available
+
+    Args:
+        text: Text to display to the user
+        field: name of the suggested field
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: what the user typed
+    """
+    if readline is None:
+        return input(text)
+    index = get_index(session=session, db=db)
+    matches = []
+
+    def complete(typed, state):
+        if state == 0:
+            matches[:] = index.complete(field, typed)
+        return matches[state] if state < len(matches) else None
+
+    old_completer = readline.get_completer()
+    old_delims = readline.get_completer_delims()
+    readline.set_completer(complete)
+    # complete the whole line, titles have spaces
+    readline.set_completer_delims("")
+    readline.parse_and_bind("tab: complete")
+    try:
+        return input(text)
+    finally:
+        readline.set_completer(old_completer)
+        readline.set_completer_delims(old_delims)
+
+
+def main():
+    """
+    Main function to print suggestions for a prefix
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Suggest search terms")
+    parser.add_argument("field", choices=list(FIELDS))
+    parser.add_argument("prefix")
+    parser.add_argument("-k", "--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    with (
+        get_client("search") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books")
+        start = time.perf_counter()
+        index = get_index(session=session, db=db)
+        build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    suggestions = index.complete(args.field, args.prefix, args.limit)
+    complete_us = (time.perf_counter() - start) * 1e6
+    if not suggestions:
+        suggestions = index.did_you_mean(args.field, args.prefix)
+        if suggestions:
+            print("Did you mean:")
+    for suggestion in suggestions:
+        print(suggestion)
+    values = sum(len(keys) for keys in index.keys.values())
+    print(
+        f"index of {values} values built in {build_seconds:.2f}s, "
+        f"completed in {complete_us:.0f}us"
+    )
+    return EXIT_SUCCESS
+
+
+FIELDS = {
+    "title": title_values,
+    "author": author_values,
+    "pseudonym": pseudonym_values,
+    "genre": list_values("genres"),
+    "sub_genre": list_values("sub_genres"),
+    "character": list_values("main_characters"),
+}
+PROJECTION = {
+    "title": 1,
+    "author": 1,
+    "genres": 1,
+    "sub_genres": 1,
+    "main_characters": 1,
+}
+# suggestions kept per prefix and prefixes kept per field
+TOP_K = 10
+TOP_PREFIXES = 10000
+DID_YOU_MEAN_LIMIT = 5000
+BUILD_BATCH_SIZE = 5000
+_INDEX = None
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
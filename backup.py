@@ -0,0 +1,632 @@
+#! /usr/bin/env python3
+import argparse
+import datetime
+import hashlib
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import pymongo
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+import book_storage
+import history
+import summary
+from catalogue import batched
+from connection import get_client
+
+
+def raw_collection(db: pymongo.mongo_client.database.Database, name: str):
+    """
+    Get a collection that reads documents as raw BSON, a backup copies the
+    bytes without decoding them
+
+    Args:
+        db: use in which database
+        name: name of the collection
+
+    Returns: The collection
+    """
+    return db.get_collection(
+        name, codec_options=CodecOptions(document_class=RawBSONDocument)
+    )
+
+
+def collection_info(db: pymongo.mongo_client.database.Database, name: str) -> dict:
+    """
+    Get the options and index specs of a collection, a restore creates the
+    collection with them and builds the indexes after the data is loaded
+
+    Args:
+        db: use in which database
+        name: name of the collection
+
+    Returns: options (validator of books) and indexes
+    """
+    options = {}
+    for collection in db.list_collections(filter={"name": name}):
+        options = collection.get("options", {})
+    indexes = []
+    for index in db.get_collection(name).list_indexes():
+        if index["name"] == "_id_":
+            continue
+        indexes.append({key: value for key, value in index.items() if key != "ns"})
+    return {"options": options, "indexes": indexes}
+
+
+def last_id(db: pymongo.mongo_client.database.Database, name: str):
+    """
+    Get the largest _id of a collection
+
+    Args:
+        db: use in which database
+        name: name of the collection
+
+    Returns: The _id or None if the collection is empty
+    """
+    newest = db.get_collection(name).find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return newest["_id"] if newest is not None else None
+
+
+def split_ranges(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    name: str,
+    lower,
+    upper,
+    parts: int,
+) -> list:
+    """
+    Split (lower, upper] into _id ranges of about the same size from a
+    sample of _id, like the export
+
+    Args:
+        db: use in which database
+        name: name of the collection
+        lower: _id after which to start, None for the first document
+        upper: last _id
+        parts: number of ranges
+
+    Returns: list of (lower, upper] bounds
+    """
+    if parts <= 1:
+        return [(lower, upper)]
+    id_range = {"$lte": upper}
+    if lower is not None:
+        id_range["$gt"] = lower
+    sample = db.get_collection(name).aggregate(
+        [
+            {"$match": {"_id": id_range}},
+            {"$sample": {"size": parts * SAMPLES_PER_PART}},
+            {"$project": {"_id": 1}},
+            {"$sort": {"_id": 1}},
+        ]
+    )
+    ids = [document["_id"] for document in sample]
+    if len(ids) < parts:
+        return [(lower, upper)]
+    bounds = sorted(set(ids[len(ids) * i // parts] for i in range(1, parts)))
+    return list(zip([lower] + bounds, bounds + [upper]))
+
+
+def id_filter(lower, upper) -> dict:
+    """
+    Get the filter of the documents in (lower, upper]
+
+    Args:
+        lower: _id after which to start, None for the first document
+        upper: last _id
+
+    Returns: The filter
+    """
+    id_range = {"$lte": upper}
+    if lower is not None:
+        id_range["$gt"] = lower
+    return {"_id": id_range}
+
+
+def backup_part(task: dict) -> dict:
+    """
+    Stream the documents of one filter into a compressed file of raw BSON,
+    run in a worker process with its own client
+
+    Args:
+        task: collection, filter, path, codec and batch_size
+
+    Returns: file name, number of documents, bytes and sha256 of the file
+    """
+    with get_client("bulk_load") as client:
+        collection = raw_collection(client.get_database("books"), task["collection"])
+        compressor = book_storage.new_compressor(task["codec"])
+        checksum = hashlib.sha256()
+        count = 0
+        size = 0
+        with open(task["path"], "wb") as outfile:
+            cursor = collection.find(task["filter"], batch_size=task["batch_size"])
+            for document in cursor:
+                block = compressor.compress(document.raw)
+                count += 1
+                if block:
+                    outfile.write(block)
+                    checksum.update(block)
+                    size += len(block)
+            block = compressor.flush()
+            outfile.write(block)
+            checksum.update(block)
+            size += len(block)
+    return {
+        "file": os.path.basename(task["path"]),
+        "count": count,
+        "bytes": size,
+        "sha256": checksum.hexdigest(),
+    }
+
+
+def iter_part(path: str, codec: str):
+    """
+    Read the documents of a backup file
+
+    Args:
+        path: path of the file
+        codec: codec the file is compressed with
+
+    Returns: Generator of RawBSONDocument
+    """
+    decompressor = book_storage.new_decompressor(codec)
+    buffer = b""
+    with open(path, "rb") as infile:
+        while True:
+            block = infile.read(book_storage.READ_SIZE)
+            if not block:
+                break
+            buffer += decompressor.decompress(block)
+            start = 0
+            # a BSON document starts with its length
+            while len(buffer) - start >= 4:
+                length = struct.unpack_from("<i", buffer, start)[0]
+                if length < MIN_DOCUMENT_SIZE:
+                    # a corrupt length would never move start forward
+                    raise ValueError(f"{path} has a document of length {length}")
+                if len(buffer) - start < length:
+                    break
+                yield RawBSONDocument(buffer[start : start + length])
+                start += length
+            buffer = buffer[start:]
+    if buffer:
+        raise ValueError(f"{path} ends with a partial document")
+
+
+def file_checksum(path: str) -> str:
+    """
+    Get the sha256 of a file
+
+    Args:
+        path: path of the file
+
+    Returns: hex digest
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as infile:
+        while True:
+            block = infile.read(book_storage.READ_SIZE)
+            if not block:
+                break
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def read_manifest(backup_dir: str) -> dict:
+    """
+    Read the manifest of a backup
+
+    Args:
+        backup_dir: directory of the backup
+
+    Returns: The manifest
+    """
+    with open(os.path.join(backup_dir, MANIFEST_NAME), encoding="utf-8") as infile:
+        return json_util.loads(infile.read())
+
+
+def verify(backup_dir: str) -> list:
+    """
+    Check the files of a backup against the checksums of its manifest
+
+    Args:
+        backup_dir: directory of the backup
+
+    Returns: list of the files that are missing or changed
+    """
+    manifest = read_manifest(backup_dir)
+    bad_files = []
+    for info in manifest["collections"].values():
+        for part in info["parts"]:
+            path = os.path.join(backup_dir, part["file"])
+            if not os.path.isfile(path) or file_checksum(path) != part["sha256"]:
+                bad_files.append(part["file"])
+    return bad_files
+
+
+def run_tasks(function, tasks: list, workers: int) -> list:
+    """
+    Run tasks in worker processes, or in this process for one worker
+
+    Args:
+        function: function of a task
+        tasks: list of tasks
+        workers: number of worker processes
+
+    Returns: results in the order of the tasks
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    # spawn so the workers do not inherit the client of this process
+    with multiprocessing.get_context("spawn").Pool(min(workers, len(tasks))) as pool:
+        return pool.map(function, tasks)
+
+
+def backup(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    backup_dir: str,
+    previous_dir: str = None,
+    workers: int = 4,
+    batch_size: int = 1000,
+) -> dict:
+    """
+    Back up books, fs.files and fs.chunks with parallel streams. Only the
+    documents up to the largest _id at the start are copied and only the
+    files whose upload ended before the start, so a file uploaded during
+    the backup is in the next one with its chunks. The parts are read
+    without a snapshot read concern, so the backup is not a point in time
+    copy: a book edited while it runs is copied before or after the edit
+    and the next incremental backup copies it again. An incremental backup
+    copies the books after the largest _id of the previous backup and the
+    books the history shows as added, edited or deleted. The _id of an
+    fs.files document is taken when its upload starts and the document is
+    written when it ends, so an incremental backup copies the files by
+    uploadDate and their chunks by files_id. Both times are compared with
+    CLOCK_SKEW_SECONDS of overlap, a document copied twice is replaced
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        backup_dir: directory to write, it must not exist
+        previous_dir: previous backup for an incremental backup, None for a
+            full backup
+        workers: number of worker processes
+        batch_size: number of documents per round trip
+
+    Returns: The manifest
+    """
+    previous = read_manifest(previous_dir) if previous_dir is not None else None
+    os.makedirs(backup_dir)
+    codec = book_storage.get_codec(BACKUP_CONTENT_TYPE)
+    manifest = {
+        "created": datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+        "database": db.name,
+        "codec": codec,
+        "previous": os.path.abspath(previous_dir) if previous is not None else None,
+        "collections": {},
+        "deleted": [],
+    }
+    edited = set()
+    new_files = []
+    if previous is not None:
+        # the times are taken by the clocks of the writers
+        since = previous["created"] - datetime.timedelta(seconds=CLOCK_SKEW_SECONDS)
+        edited, deleted = history.changed_since(session=session, db=db, since=since)
+        manifest["deleted"] = [
+            {"book_id": book_id, "file_id": file_id}
+            for book_id, file_id in deleted.items()
+        ]
+        new_files = [
+            grid_file["_id"]
+            for grid_file in db.fs.files.find(
+                {"uploadDate": {"$gt": since, "$lte": manifest["created"]}},
+                {"_id": 1},
+                session=session,
+            ).sort("_id", 1)
+        ]
+
+    tasks = []
+    for name in BACKUP_COLLECTIONS:
+        info = collection_info(db, name)
+        info["last_id"] = last_id(db, name)
+        info["parts"] = []
+        manifest["collections"][name] = info
+        filters = []
+        lower = None
+        if name != "books" and previous is not None:
+            field = "files_id" if name == "fs.chunks" else "_id"
+            filters = [
+                {field: {"$in": ids}} for ids in batched(new_files, EDITED_PER_PART)
+            ]
+        else:
+            if previous is not None:
+                lower = previous["collections"][name]["last_id"]
+                if info["last_id"] is None:
+                    info["last_id"] = lower
+            if info["last_id"] is not None and info["last_id"] != lower:
+                ranges = split_ranges(
+                    db=db, name=name, lower=lower, upper=info["last_id"], parts=workers
+                )
+                filters = [id_filter(*id_range) for id_range in ranges]
+            if name == "fs.files":
+                # an upload that ends during the backup is in the next one
+                filters = [
+                    {**part_filter, "uploadDate": {"$lte": manifest["created"]}}
+                    for part_filter in filters
+                ]
+        if name == "books" and edited:
+            # books added, edited or loaded since the previous backup
+            old_ids = [
+                book_id for book_id in edited if lower is None or book_id <= lower
+            ]
+            for ids in batched(sorted(old_ids), EDITED_PER_PART):
+                filters.append({"_id": {"$in": ids}})
+        for part, part_filter in enumerate(filters):
+            tasks.append(
+                {
+                    "collection": name,
+                    "filter": part_filter,
+                    "path": os.path.join(
+                        backup_dir, f"{name}.part{part}.bson.{codec}"
+                    ),
+                    "codec": codec,
+                    "batch_size": batch_size,
+                }
+            )
+    for task, result in zip(tasks, run_tasks(backup_part, tasks, workers)):
+        manifest["collections"][task["collection"]]["parts"].append(result)
+    with open(
+        os.path.join(backup_dir, MANIFEST_NAME), "w", encoding="utf-8"
+    ) as outfile:
+        outfile.write(json_util.dumps(manifest, indent=2))
+    return manifest
+
+
+def restore_part(task: dict) -> int:
+    """
+    Load one backup file, run in a worker process with its own client. A
+    full backup is inserted, an incremental one replaces the documents it
+    has a newer version of
+
+    Args:
+        task: collection, path, codec, upsert and batch_size
+
+    Returns: number of documents loaded
+    """
+    count = 0
+    with get_client("bulk_load") as client:
+        collection = raw_collection(client.get_database("books"), task["collection"])
+        documents = iter_part(task["path"], task["codec"])
+        for batch in batched(documents, task["batch_size"]):
+            if task["upsert"]:
+                collection.bulk_write(
+                    [
+                        pymongo.ReplaceOne(
+                            {"_id": document["_id"]}, document, upsert=True
+                        )
+                        for document in batch
+                    ],
+                    ordered=False,
+                    bypass_document_validation=True,
+                )
+            else:
+                # the documents were valid when they were backed up
+                collection.insert_many(
+                    batch, ordered=False, bypass_document_validation=True
+                )
+            count += len(batch)
+    return count
+
+
+def backup_chain(backup_dir: str) -> list:
+    """
+    Get the backups a restore needs, the full backup first
+
+    Args:
+        backup_dir: directory of the last backup
+
+    Returns: list of (directory, manifest)
+    """
+    chain = []
+    while backup_dir is not None:
+        manifest = read_manifest(backup_dir)
+        chain.append((backup_dir, manifest))
+        backup_dir = manifest["previous"]
+    chain.reverse()
+    return chain
+
+
+def restore(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    backup_dir: str,
+    workers: int = 4,
+    batch_size: int = 1000,
+) -> dict:
+    """
+    Restore a backup and the backups before it, the collections are
+    replaced. The data is loaded in parallel without secondary indexes and
+    the indexes of the last backup are built once at the end, then the
+    collections made from the books are reset by clear_derived
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        backup_dir: directory of the backup
+        workers: number of worker processes
+        batch_size: number of documents per insert_many
+
+    Returns: loaded documents by collection and the seconds of the load and
+        of the index builds
+    """
+    chain = backup_chain(backup_dir)
+    for chain_dir, _ in chain:
+        bad_files = verify(chain_dir)
+        if bad_files:
+            raise RuntimeError(f"{chain_dir} has bad files: {', '.join(bad_files)}")
+
+    start = time.perf_counter()
+    _, full_manifest = chain[0]
+    for name, info in full_manifest["collections"].items():
+        db.drop_collection(name, session=session)
+        db.create_collection(name, session=session, **info["options"])
+    loaded = {name: 0 for name in BACKUP_COLLECTIONS}
+    for position, (chain_dir, manifest) in enumerate(chain):
+        tasks = [
+            {
+                "collection": name,
+                "path": os.path.join(chain_dir, part["file"]),
+                "codec": manifest["codec"],
+                "upsert": position > 0,
+                "batch_size": batch_size,
+            }
+            for name, info in manifest["collections"].items()
+            for part in info["parts"]
+        ]
+        for task, count in zip(tasks, run_tasks(restore_part, tasks, workers)):
+            loaded[task["collection"]] += count
+        for deleted in manifest["deleted"]:
+            db.books.delete_one({"_id": deleted["book_id"]}, session=session)
+            if deleted["file_id"] is not None:
+                db.fs.files.delete_one({"_id": deleted["file_id"]}, session=session)
+                db.fs.chunks.delete_many(
+                    {"files_id": deleted["file_id"]}, session=session
+                )
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, last_manifest = chain[-1]
+    for name, info in last_manifest["collections"].items():
+        if info["indexes"]:
+            db.command("createIndexes", name, indexes=info["indexes"], session=session)
+    index_seconds = time.perf_counter() - start
+    clear_derived(session=session, db=db)
+    return {
+        "loaded": loaded,
+        "load_seconds": load_seconds,
+        "index_seconds": index_seconds,
+    }
+
+
+def clear_derived(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Reset the collections made from the books after a restore replaced
+    them. books_summary is rebuilt from the restored books, the text and
+    covers of the books before the restore are dropped, the bulk load
+    checkpoint is dropped so the next load does not skip a file that was
+    not restored, and the history partitions are dropped
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    for name in DERIVED_COLLECTIONS:
+        db.drop_collection(name, session=session)
+    history.drop_partitions(session=session, db=db)
+    summary.backfill(session=session, db=db)
+    return
+
+
+def main():
+    """
+    Main function to back up, verify or restore the books database
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Back up and restore books")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backup_parser = subparsers.add_parser("backup", help="write a backup")
+    backup_parser.add_argument("backup_dir", help="directory to create")
+    backup_parser.add_argument(
+        "--since", help="previous backup, for an incremental backup"
+    )
+    verify_parser = subparsers.add_parser("verify", help="check the checksums")
+    verify_parser.add_argument("backup_dir")
+    restore_parser = subparsers.add_parser(
+        "restore", help="replace the collections with a backup"
+    )
+    restore_parser.add_argument("backup_dir", help="last backup of the chain")
+    for command_parser in [backup_parser, restore_parser]:
+        command_parser.add_argument("--workers", type=int, default=4)
+        command_parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        bad_files = verify(args.backup_dir)
+        for bad_file in bad_files:
+            print(f"bad file {bad_file}")
+        return EXIT_FAILURE if bad_files else EXIT_SUCCESS
+
+    with (
+        get_client("bulk_load") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books")
+        start = time.perf_counter()
+        try:
+            if args.command == "backup":
+                manifest = backup(
+                    session=session,
+                    db=db,
+                    backup_dir=args.backup_dir,
+                    previous_dir=args.since,
+                    workers=args.workers,
+                    batch_size=args.batch_size,
+                )
+                for name, info in manifest["collections"].items():
+                    count = sum(part["count"] for part in info["parts"])
+                    size = sum(part["bytes"] for part in info["parts"]) / MB
+                    print(f"{name}: {count} documents, {size:.1f} MB")
+                print(f"{len(manifest['deleted'])} deleted books")
+                print(f"Backed up in {time.perf_counter() - start:.1f}s")
+            else:
+                result = restore(
+                    session=session,
+                    db=db,
+                    backup_dir=args.backup_dir,
+                    workers=args.workers,
+                    batch_size=args.batch_size,
+                )
+                for name, count in result["loaded"].items():
+                    print(f"{name}: {count} documents")
+                print(
+                    f"Loaded in {result['load_seconds']:.1f}s, "
+                    f"indexes built in {result['index_seconds']:.1f}s"
+                )
+        except (OSError, RuntimeError, ValueError) as error_message:
+            print(error_message)
+            return EXIT_FAILURE
+    return EXIT_SUCCESS
+
+
+BACKUP_COLLECTIONS = ["books", "fs.files", "fs.chunks"]
+# made from the books, dropped by a restore
+DERIVED_COLLECTIONS = ["book_text", "covers", "bulk_load_checkpoint"]
+# compressed like a file without a content type, zstd or zlib
+BACKUP_CONTENT_TYPE = "application/octet-stream"
+MANIFEST_NAME = "manifest.json"
+# overlap of the incremental backups for the clocks of the writers
+CLOCK_SKEW_SECONDS = 300
+# the length and the end byte of an empty BSON document
+MIN_DOCUMENT_SIZE = 5
+SAMPLES_PER_PART = 100
+EDITED_PER_PART = 10000
+MB = 1024 * 1024
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
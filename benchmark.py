@@ -0,0 +1,752 @@
+#! /usr/bin/env python3
+import argparse
+import datetime
+import glob
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import bson
+import gridfs
+import pymongo
+import blob_storage
+import book_storage
+import book_text
+import bulk_loader
+import pipeline
+import query
+import summary
+from connection import catalogue_reads, get_client, load_config
+from schema import BOOKS_SCHEMA, book_violations
+
+
+def compress_file(file_path: str, codec: str) -> dict:
+    """
+    Compress a file with the same streaming code used for GridFS uploads
+
+    Args:
+        file_path: path to the file
+        codec: "zstd" or "zlib"
+
+    Returns: sizes and cpu time of compressing and decompressing the file
+    """
+    compressor = book_storage.new_compressor(codec)
+    blocks = []
+    raw_length = 0
+    start = time.process_time()
+    with open(file_path, "rb") as infile:
+        while True:
+            block = infile.read(book_storage.READ_SIZE)
+            if not block:
+                break
+            raw_length += len(block)
+            blocks.append(compressor.compress(block))
+    blocks.append(compressor.flush())
+    compress_time = time.process_time() - start
+
+    decompressor = book_storage.new_decompressor(codec)
+    start = time.process_time()
+    for block in blocks:
+        decompressor.decompress(block)
+    decompress_time = time.process_time() - start
+
+    return {
+        "raw_length": raw_length,
+        "stored_length": sum(len(block) for block in blocks),
+        "compress_time": compress_time,
+        "decompress_time": decompress_time,
+    }
+
+
+def benchmark_compression(paths: list) -> None:
+    """
+    Print storage saved versus cpu cost per MB for every codec
+
+    Args:
+        paths: files to compress
+
+    Returns: None
+    """
+    codecs = ["zlib"]
+    if book_storage.zstandard is not None:
+        codecs.insert(0, "zstd")
+    print("-" * 79)
+    print(
+        f"{'file':<24} {'codec':<5} {'MB':>8} {'saved %':>8} "
+        f"{'comp s/MB':>10} {'decomp s/MB':>12} {'stored':>7}"
+    )
+    print("-" * 79)
+    for file_path in paths:
+        for codec in codecs:
+            result = compress_file(file_path, codec)
+            mb = max(result["raw_length"] / MB, 1 / MB)
+            saved = 1 - result["stored_length"] / max(result["raw_length"], 1)
+            # the codec save_file_gridfs picks from the first SAMPLE_SIZE bytes
+            with open(file_path, "rb") as infile:
+                stored = book_storage.sample_codec(infile, codec) or "none"
+            print(
+                f"{os.path.basename(file_path)[:24]:<24} {codec:<5} {mb:>8.2f} "
+                f"{saved * 100:>8.1f} {result['compress_time'] / mb:>10.4f} "
+                f"{result['decompress_time'] / mb:>12.4f} {stored:>7}"
+            )
+    print("-" * 79)
+
+
+def synthetic_books(count: int, seed: int = 0):
+    """
+    Generate a synthetic catalogue of books that pass BOOKS_SCHEMA
+
+    Args:
+        count: number of books
+        seed: random seed so runs are comparable
+
+    Returns: Generator of book documents
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+            "author": [{"name": f"{rng.choice(WORDS).title()} Author{i % 5000}"}],
+            "language": rng.choice(LANGUAGES),
+            "published_date": datetime.datetime(1800 + rng.randrange(224), 1, 1),
+            "genres": rng.sample(GENRES, 2),
+            "sub_genres": [rng.choice(WORDS).title()],
+            "main_characters": [rng.choice(WORDS).title() for _ in range(3)],
+            "copy_right": "Public domain in the USA.",
+            "file_name": f"synthetic{i}.epub",
+            "file_type": rng.choice(["EPUB", "PDF"]),
+            "file_id": bson.ObjectId(),
+            "ISBN": f"978-{rng.randrange(10**9):09d}",
+        }
+
+
+def benchmark_profiles(count: int, searches: int, file_mb: int) -> None:
+    """
+    Print insert, search and GridFS throughput for every connection profile
+
+    Args:
+        count: number of synthetic books to insert
+        searches: number of paginated searches to run
+        file_mb: size of the file to upload and download in MB
+
+    Returns: None
+    """
+    payload = os.urandom(file_mb * MB // 2) + b"horror " * (file_mb * MB // 14)
+    print("-" * 79)
+    print(
+        f"{'profile':<12} {'insert doc/s':>12} {'search q/s':>11} "
+        f"{'upload MB/s':>12} {'download MB/s':>14}"
+    )
+    print("-" * 79)
+    for profile in sorted(load_config()["profiles"]):
+        with get_client(profile) as client:
+            db = client.get_database("books_benchmark")
+            db.drop_collection("books")
+            books = list(synthetic_books(count))
+
+            start = time.perf_counter()
+            for i in range(0, len(books), 1000):
+                db.books.insert_many(books[i : i + 1000], ordered=False)
+            insert_rate = count / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for i in range(searches):
+                list(
+                    db.books.aggregate(
+                        [
+                            {"$match": {"title": {"$regex": WORDS[i % len(WORDS)]}}},
+                            {
+                                "$facet": {
+                                    "metadata": [{"$count": "total_count"}],
+                                    "data": [{"$skip": 0}, {"$limit": 5}],
+                                }
+                            },
+                        ]
+                    )
+                )
+            search_rate = searches / (time.perf_counter() - start)
+
+            fs = gridfs.GridFS(db)
+            start = time.perf_counter()
+            file_id = fs.put(io.BytesIO(payload), filename="benchmark.bin")
+            upload_rate = len(payload) / MB / (time.perf_counter() - start)
+            start = time.perf_counter()
+            fs.get(file_id).read()
+            download_rate = len(payload) / MB / (time.perf_counter() - start)
+            fs.delete(file_id)
+
+            client.drop_database("books_benchmark")
+        print(
+            f"{profile:<12} {insert_rate:>12.0f} {search_rate:>11.1f} "
+            f"{upload_rate:>12.1f} {download_rate:>14.1f}"
+        )
+    print("-" * 79)
+
+
+def benchmark_validation(count: int) -> None:
+    """
+    Print the cost of rejecting an invalid book on the client versus on the
+    server with the $jsonSchema validator
+
+    Args:
+        count: number of books
+
+    Returns: None
+    """
+    books = list(synthetic_books(count))
+    invalid_books = [dict(book, title=None) for book in books]
+
+    start = time.perf_counter()
+    for book in books:
+        book_violations(book)
+    client_valid = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for book in invalid_books:
+        book_violations(book)
+    client_invalid = (time.perf_counter() - start) / count
+
+    with get_client("bulk_load") as client:
+        db = client.get_database("books_benchmark")
+        db.drop_collection("books")
+        db.create_collection("books", validator=BOOKS_SCHEMA)
+        start = time.perf_counter()
+        for book in invalid_books:
+            try:
+                db.books.insert_one(book)
+            except pymongo.errors.WriteError:
+                pass
+        server_invalid = (time.perf_counter() - start) / count
+
+        # one bad book at the end of a batch fails the batch after the
+        # good books were already written
+        batch = books[: min(count, 1000)] + invalid_books[:1]
+        start = time.perf_counter()
+        try:
+            db.books.insert_many(batch)
+        except pymongo.errors.BulkWriteError:
+            pass
+        server_batch = time.perf_counter() - start
+        client.drop_database("books_benchmark")
+
+    print("-" * 79)
+    print(f"client validate valid book    {client_valid * 1e6:>12.1f} us/book")
+    print(f"client reject invalid book    {client_invalid * 1e6:>12.1f} us/book")
+    print(f"server reject invalid book    {server_invalid * 1e6:>12.1f} us/book")
+    print(
+        f"server reject batch of {len(batch):<6} {server_batch * 1e3:>12.1f} ms "
+        "(not counting the wasted GridFS uploads)"
+    )
+    print("-" * 79)
+
+
+def load_until_stopped(stop: threading.Event, batch_size: int) -> None:
+    """
+    Insert synthetic books into books_benchmark.books_load until stopped,
+    the write traffic of a bulk load
+
+    Args:
+        stop: set to stop loading
+        batch_size: books per insert_many
+
+    Returns: None
+    """
+    with get_client("bulk_load") as client:
+        db = client.get_database("books_benchmark")
+        books = synthetic_books(10**9, seed=1)
+        while not stop.is_set():
+            db.books_load.insert_many(
+                [next(books) for _ in range(batch_size)], ordered=False
+            )
+
+
+def primary_aggregates(client: pymongo.MongoClient) -> int:
+    """
+    Get the number of aggregate commands the primary has run
+
+    Args:
+        client: client of the replica set or mongos
+
+    Returns: The counter from serverStatus
+    """
+    status = client.admin.command("serverStatus")
+    return status["metrics"]["commands"]["aggregate"]["total"]
+
+
+def benchmark_routing(count: int, searches: int) -> None:
+    """
+    Print search latency and the searches the primary served during a
+    concurrent bulk load, with every read on the primary and with catalogue
+    reads routed by connection.catalogue_reads
+
+    Args:
+        count: number of synthetic books to search
+        searches: number of paginated searches per routing
+
+    Returns: None
+    """
+    with (
+        get_client("interactive") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books_benchmark")
+        db.drop_collection("books")
+        books = list(synthetic_books(count))
+        for i in range(0, len(books), 1000):
+            db.books.insert_many(books[i : i + 1000], ordered=False)
+        if not client.secondaries:
+            print("No secondaries, catalogue reads fall back to the primary")
+        print("-" * 79)
+        print(
+            f"{'routing':<12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+            f"{'primary aggregates':>19}"
+        )
+        print("-" * 79)
+        for routing, reads_db in [("primary", db), ("catalogue", catalogue_reads(db))]:
+            stop = threading.Event()
+            loader = threading.Thread(target=load_until_stopped, args=(stop, 1000))
+            loader.start()
+            before = primary_aggregates(client)
+            latencies = []
+            for i in range(searches):
+                start = time.perf_counter()
+                list(
+                    reads_db.books.aggregate(
+                        [
+                            {"$match": {"title": {"$regex": WORDS[i % len(WORDS)]}}},
+                            {
+                                "$facet": {
+                                    "metadata": [{"$count": "total_count"}],
+                                    "data": [{"$skip": 0}, {"$limit": 5}],
+                                }
+                            },
+                        ],
+                        session=session,
+                    )
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+            # the serverStatus calls are not aggregates
+            primary_searches = primary_aggregates(client) - before
+            stop.set()
+            loader.join()
+            latencies.sort()
+            print(
+                f"{routing:<12} {statistics.median(latencies):>8.1f} "
+                f"{latencies[int(len(latencies) * 0.95) - 1]:>8.1f} "
+                f"{latencies[-1]:>8.1f} {primary_searches:>19}"
+            )
+        print("-" * 79)
+        client.drop_database("books_benchmark")
+
+
+def benchmark_summary(count: int, pages: int) -> None:
+    """
+    Print the time per page and the documents and index keys a page reads
+    when the EPUB books sorted by title are listed from the full books
+    documents and from books_summary
+
+    Args:
+        count: number of synthetic books
+        pages: number of pages to turn
+
+    Returns: None
+    """
+    with get_client("interactive") as client:
+        db = client.get_database("books_benchmark")
+        db.drop_collection("books")
+        books = list(synthetic_books(count))
+        for i in range(0, len(books), 1000):
+            db.books.insert_many(books[i : i + 1000], ordered=False)
+        query.ensure_indexes(session=None, db=db)
+        start = time.perf_counter()
+        summary.backfill(session=None, db=db)
+        backfill_seconds = time.perf_counter() - start
+
+        sort_keys = query.SORT_ORDERS["title"]
+        hint = query.sort_index(sort_keys, ["file_type"])[0]
+        print("-" * 79)
+        print(
+            f"{'source':<14} {'size MB':>8} {'ms/page':>8} {'docs read':>10} "
+            f"{'keys read':>10}"
+        )
+        print("-" * 79)
+        sources = [
+            ("books", db.books, None, hint),
+            (
+                "books_summary",
+                db.books_summary,
+                summary.list_projection(sort_keys),
+                summary.covering_index(hint),
+            ),
+        ]
+        for name, collection, projection, source_hint in sources:
+            after = None
+            start = time.perf_counter()
+            for _ in range(pages):
+                page_filter = {"file_type": "EPUB"}
+                if after is not None:
+                    page_filter = {
+                        "$and": [page_filter, query.keyset_filter(sort_keys, after)]
+                    }
+                cursor = (
+                    collection.find(page_filter, projection)
+                    .sort(sort_keys)
+                    .limit(5)
+                    .hint(source_hint)
+                )
+                data = list(cursor)
+                if not data:
+                    break
+                after = query.sort_values(data[-1], sort_keys)
+            page_ms = (time.perf_counter() - start) * 1000 / pages
+            stats = cursor.explain()["executionStats"]
+            size = db.command("collStats", collection.name)["size"] / MB
+            print(
+                f"{name:<14} {size:>8.1f} {page_ms:>8.2f} "
+                f"{stats['totalDocsExamined']:>10} {stats['totalKeysExamined']:>10}"
+            )
+        print("-" * 79)
+        print(f"books_summary backfilled with $merge in {backfill_seconds:.2f}s")
+        client.drop_database("books_benchmark")
+
+
+def benchmark_pipeline(count: int, file_kb: int, uploaders: int) -> None:
+    """
+    Print the throughput of loading a manifest of synthetic books and files
+    one batch at a time and with the staged pipeline, with the utilization
+    of every stage of the pipeline
+
+    Args:
+        count: number of synthetic books
+        file_kb: size of the file of every book in KB
+        uploaders: number of upload threads of the pipeline
+
+    Returns: None
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        books = []
+        for i, book in enumerate(synthetic_books(count)):
+            for field in bulk_loader.DERIVED_FIELDS:
+                book.pop(field, None)
+            book["file_name"] = f"synthetic{i}.pdf"
+            book["file_path"] = os.path.join(directory, book["file_name"])
+            with open(book["file_path"], "wb") as outfile:
+                outfile.write(os.urandom(file_kb * 1024))
+            books.append(book)
+        total_mb = count * file_kb / 1024
+
+        print("-" * 79)
+        print(f"{'loader':<10} {'seconds':>8} {'books/s':>8} {'MB/s':>8}")
+        print("-" * 79)
+        with (
+            get_client("bulk_load") as client,
+            client.start_session(causal_consistency=True) as session,
+        ):
+            for name in ["batches", "pipeline"]:
+                client.drop_database("books_benchmark")
+                db = client.get_database("books_benchmark")
+                bulk_loader.initialize_database(session=session, db=db)
+                # the loaders add the derived fields to the books
+                run_books = [dict(book) for book in books]
+                start = time.perf_counter()
+                if name == "pipeline":
+                    pipeline_stats = pipeline.load_pipeline(
+                        session=session, db=db, books=run_books, uploaders=uploaders
+                    )
+                else:
+                    bulk_loader.add_books_incremental(
+                        session=session, db=db, books=run_books
+                    )
+                seconds = time.perf_counter() - start
+                # the extraction of the previous run must not write to the
+                # next one
+                book_text.shutdown(wait=True)
+                print(
+                    f"{name:<10} {seconds:>8.2f} {count / seconds:>8.0f} "
+                    f"{total_mb / seconds:>8.1f}"
+                )
+            client.drop_database("books_benchmark")
+    pipeline.print_stages(pipeline_stats)
+
+
+def benchmark_fast_load(count: int) -> None:
+    """
+    Print the time to insert synthetic books into an indexed books
+    collection versus inserting them without the secondary indexes and
+    building the indexes after
+
+    Args:
+        count: number of synthetic books
+
+    Returns: None
+    """
+    print("-" * 79)
+    print(f"{'load':<14} {'insert s':>9} {'index s':>9} {'total s':>9} {'doc/s':>9}")
+    print("-" * 79)
+    with get_client("bulk_load") as client:
+        for name in ["indexed", "fast load"]:
+            client.drop_database("books_benchmark")
+            db = client.get_database("books_benchmark")
+            bulk_loader.initialize_database(session=None, db=db)
+            if name == "fast load":
+                bulk_loader.drop_deferred_indexes(session=None, db=db)
+            books = list(synthetic_books(count))
+            start = time.perf_counter()
+            for i in range(0, len(books), 1000):
+                db.books.insert_many(books[i : i + 1000], ordered=False)
+                db.books_summary.insert_many(
+                    [summary.summarize(book) for book in books[i : i + 1000]],
+                    ordered=False,
+                )
+            insert_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            if name == "fast load":
+                bulk_loader.build_deferred_indexes(session=None, db=db)
+            index_seconds = time.perf_counter() - start
+            total = insert_seconds + index_seconds
+            print(
+                f"{name:<14} {insert_seconds:>9.2f} {index_seconds:>9.2f} "
+                f"{total:>9.2f} {count / total:>9.0f}"
+            )
+            problems = bulk_loader.verify_deferred_indexes(session=None, db=db)
+            for problem in problems:
+                print(problem)
+        client.drop_database("books_benchmark")
+    print("-" * 79)
+
+
+def benchmark_chunk_sizes(sizes_mb: list, chunk_kbs: list, total_mb: int) -> None:
+    """
+    Print a matrix of GridFS upload and download MB/s, fs.chunks documents
+    and fs.chunks index size for every file size class and chunk size
+
+    Args:
+        sizes_mb: file sizes in MB, one per size class
+        chunk_kbs: chunk sizes in KB
+        total_mb: MB uploaded per cell, at least one file
+
+    Returns: None
+    """
+    print("-" * 79)
+    print(
+        f"{'file MB':>8} {'chunk KB':>9} {'files':>6} {'up MB/s':>8} "
+        f"{'down MB/s':>10} {'chunks':>8} {'index KB':>9}"
+    )
+    print("-" * 79)
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        get_client("bulk_load") as client,
+    ):
+        for size_mb in sizes_mb:
+            # random bytes, so the size of the stored file is the size class
+            file_path = os.path.join(directory, f"size{size_mb}.pdf")
+            with open(file_path, "wb") as outfile:
+                outfile.write(os.urandom(int(size_mb * MB)))
+            files = max(1, int(total_mb / size_mb))
+            for chunk_kb in chunk_kbs:
+                client.drop_database("books_benchmark")
+                db = client.get_database("books_benchmark")
+                start = time.perf_counter()
+                file_ids = [
+                    book_storage.save_file_gridfs(
+                        session=None,
+                        db=db,
+                        file_name=f"size{size_mb}_{i}.pdf",
+                        file_path=file_path,
+                        compression="none",
+                        chunk_size=chunk_kb * 1024,
+                    )
+                    for i in range(files)
+                ]
+                upload_rate = files * size_mb / (time.perf_counter() - start)
+                start = time.perf_counter()
+                for file_id in file_ids:
+                    for _ in book_storage.iter_file_gridfs(
+                        session=None, db=db, file_id=file_id
+                    ):
+                        pass
+                download_rate = files * size_mb / (time.perf_counter() - start)
+                chunks = db.fs.chunks.count_documents({})
+                index_size = db.command("collStats", "fs.chunks")["totalIndexSize"]
+                print(
+                    f"{size_mb:>8} {chunk_kb:>9} {files:>6} {upload_rate:>8.1f} "
+                    f"{download_rate:>10.1f} {chunks:>8} {index_size / 1024:>9.0f}"
+                )
+        client.drop_database("books_benchmark")
+    print("-" * 79)
+
+
+def benchmark_blob_storage(count: int, file_mb: float) -> None:
+    """
+    Print the write, read and download MB/s of the GridFS and filesystem
+    storage backends and the space the files take in MongoDB and on disk
+
+    Args:
+        count: number of files
+        file_mb: size of every file in MB
+
+    Returns: None
+    """
+    print("-" * 79)
+    print(
+        f"{'backend':<11} {'write MB/s':>11} {'read MB/s':>10} "
+        f"{'download MB/s':>14} {'mongo MB':>9} {'disk MB':>8}"
+    )
+    print("-" * 79)
+    total_mb = count * file_mb
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        get_client("bulk_load") as client,
+    ):
+        paths = []
+        for i in range(count):
+            # half text and half random bytes, like a PDF with images
+            size = int(file_mb * MB)
+            payload = os.urandom(size // 2) + f"book {i:06d} ".encode() * (size // 24)
+            paths.append(os.path.join(directory, f"book{i}.pdf"))
+            with open(paths[-1], "wb") as outfile:
+                outfile.write(payload)
+        backends = [
+            blob_storage.GridFSBackend(),
+            blob_storage.FileSystemBackend(os.path.join(directory, "blobs")),
+        ]
+        for backend in backends:
+            client.drop_database("books_benchmark")
+            db = client.get_database("books_benchmark")
+            start = time.perf_counter()
+            books = []
+            for i, path in enumerate(paths):
+                fields = backend.save_file(
+                    session=None, db=db, file_name=f"book{i}.pdf", file_path=path
+                )
+                books.append({"_id": i, **fields})
+            write_rate = total_mb / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for book in books:
+                for _ in backend.iter_file(session=None, db=db, book=book):
+                    pass
+            read_rate = total_mb / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for book in books:
+                with open(os.path.join(directory, "download"), "wb") as output_file:
+                    backend.copy_to_file(
+                        session=None, db=db, book=book, output_file=output_file
+                    )
+            download_rate = total_mb / (time.perf_counter() - start)
+            mongo_size = db.command("dbStats")["storageSize"] / MB
+            disk_size = 0
+            for root, _, files in os.walk(os.path.join(directory, "blobs")):
+                for file_name in files:
+                    disk_size += os.path.getsize(os.path.join(root, file_name))
+            print(
+                f"{backend.name:<11} {write_rate:>11.1f} {read_rate:>10.1f} "
+                f"{download_rate:>14.1f} {mongo_size:>9.1f} {disk_size / MB:>8.1f}"
+            )
+        client.drop_database("books_benchmark")
+    print("-" * 79)
+
+
+def main():
+    """
+    Main function to run the benchmarks
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks for the books database")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    compression = subparsers.add_parser(
+        "compression", help="storage saved versus cpu cost per MB"
+    )
+    compression.add_argument("paths", nargs="*", default=glob.glob("./books/*"))
+
+    profiles = subparsers.add_parser(
+        "profiles", help="throughput of every connection profile"
+    )
+    profiles.add_argument("--count", type=int, default=20000)
+    profiles.add_argument("--searches", type=int, default=200)
+    profiles.add_argument("--file-mb", type=int, default=32)
+
+    validation = subparsers.add_parser(
+        "validation", help="client side versus server side schema rejection"
+    )
+    validation.add_argument("--count", type=int, default=5000)
+
+    routing = subparsers.add_parser(
+        "routing", help="search latency on primary or secondaries during a bulk load"
+    )
+    routing.add_argument("--count", type=int, default=20000)
+    routing.add_argument("--searches", type=int, default=500)
+
+    summary_parser = subparsers.add_parser(
+        "summary", help="list pages from books or from books_summary"
+    )
+    summary_parser.add_argument("--count", type=int, default=100000)
+    summary_parser.add_argument("--pages", type=int, default=200)
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline", help="load books one batch at a time or with the pipeline"
+    )
+    pipeline_parser.add_argument("--count", type=int, default=2000)
+    pipeline_parser.add_argument("--file-kb", type=int, default=512)
+    pipeline_parser.add_argument(
+        "--uploaders", type=int, default=pipeline.PIPELINE_UPLOADERS
+    )
+
+    fast_load = subparsers.add_parser(
+        "fast-load", help="insert with the indexes or build them after the load"
+    )
+    fast_load.add_argument("--count", type=int, default=200000)
+
+    chunks = subparsers.add_parser(
+        "chunks", help="GridFS chunk sizes for every file size class"
+    )
+    chunks.add_argument("--sizes-mb", type=float, nargs="+", default=[0.3, 4, 64])
+    chunks.add_argument(
+        "--chunk-kb", type=int, nargs="+", default=[64, 255, 1024, 4096, 8192]
+    )
+    chunks.add_argument("--total-mb", type=int, default=256)
+
+    blobs = subparsers.add_parser(
+        "blobs", help="GridFS versus the filesystem storage backend"
+    )
+    blobs.add_argument("--count", type=int, default=50)
+    blobs.add_argument("--file-mb", type=float, default=8)
+
+    args = parser.parse_args()
+    match args.benchmark:
+        case "compression":
+            benchmark_compression(args.paths)
+        case "profiles":
+            benchmark_profiles(args.count, args.searches, args.file_mb)
+        case "validation":
+            benchmark_validation(args.count)
+        case "routing":
+            benchmark_routing(args.count, args.searches)
+        case "summary":
+            benchmark_summary(args.count, args.pages)
+        case "pipeline":
+            benchmark_pipeline(args.count, args.file_kb, args.uploaders)
+        case "fast-load":
+            benchmark_fast_load(args.count)
+        case "chunks":
+            benchmark_chunk_sizes(args.sizes_mb, args.chunk_kb, args.total_mb)
+        case "blobs":
+            benchmark_blob_storage(args.count, args.file_mb)
+    return EXIT_SUCCESS
+
+
+WORDS = [
+    "dark", "night", "house", "ghost", "blood", "shadow", "whale", "sea",
+    "monster", "castle", "storm", "grave", "mirror", "forest", "moon", "raven",
+]
+LANGUAGES = ["English", "French", "German", "Spanish", "Thai", "Japanese"]
+GENRES = ["Horror", "Gothic", "Adventure", "Mystery", "Romance", "Fantasy", "Sci-Fi"]
+MB = 1024 * 1024
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,834 @@
+#! /usr/bin/env python3
+import abc
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+import pymongo
+import history
+from book_storage import (
+    BadEpub,
+    delete_file_gridfs,
+    get_content_type,
+    iter_file_gridfs,
+    save_file_gridfs,
+)
+from connection import get_client, load_config
+from schema import BOOKS_SCHEMA
+
+
+class BlobBackend(abc.ABC):
+    """Where the files of the books are stored, see get_backend"""
+
+    name = None
+
+    @abc.abstractmethod
+    def save_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        file_name: str,
+        file_path: str,
+    ) -> dict:
+        """
+        Store a file
+
+        Args:
+            session: session to connect to the database
+            db: use in which database
+            file_name: name of the file
+            file_path: path to the file
+
+        Returns: the fields of the book that point to the file
+        """
+
+    @abc.abstractmethod
+    def iter_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ):
+        """
+        Stream the original content of the file of a book
+
+        Args:
+            session: session to connect to the database
+            db: use in which database
+            book: book with the fields of file_fields
+
+        Returns: Generator of bytes blocks
+        """
+
+    def copy_to_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+        output_file,
+    ) -> int:
+        """
+        Write the file of a book to an opened binary file
+
+        Args:
+            session: session to connect to the database
+            db: use in which database
+            book: book with the fields of file_fields
+            output_file: opened binary file
+
+        Returns: number of bytes written
+        """
+        written = 0
+        for block in self.iter_file(session=session, db=db, book=book):
+            output_file.write(block)
+            written += len(block)
+        return written
+
+    @abc.abstractmethod
+    def file_info(
+        self,
+        *,
+        db: pymongo.mongo_client.database.Database,
+        books: list,
+    ) -> dict:
+        """
+        Get the stored files of many books at once
+
+        Args:
+            db: use in which database
+            books: books with the fields of file_fields
+
+        Returns: documents with the length and the md5 or sha256 of every
+            file by file_key, like fs.files documents, the books whose file
+            is missing are not in it
+        """
+
+    @abc.abstractmethod
+    def delete_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ) -> None:
+        """
+        Delete the file of a book
+
+        Args:
+            session: session to connect to the database
+            db: use in which database
+            book: book with _id, the fields of file_fields and natural_key
+                if it was loaded by bulk_loader.py
+
+        Returns: None
+        """
+
+
+class GridFSBackend(BlobBackend):
+    """Book files in GridFS, compressed by content type, the book has file_id"""
+
+    name = "gridfs"
+
+    def save_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        file_name: str,
+        file_path: str,
+    ) -> dict:
+        file_id = save_file_gridfs(
+            session=session, db=db, file_name=file_name, file_path=file_path
+        )
+        return {"file_id": file_id}
+
+    def iter_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ):
+        return iter_file_gridfs(session=session, db=db, file_id=book["file_id"])
+
+    def file_info(
+        self,
+        *,
+        db: pymongo.mongo_client.database.Database,
+        books: list,
+    ) -> dict:
+        return {
+            grid_file["_id"]: grid_file
+            for grid_file in db.fs.files.find(
+                {"_id": {"$in": [book["file_id"] for book in books]}}
+            )
+        }
+
+    def delete_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ) -> None:
+        delete_file_gridfs(session=session, db=db, file_id=book["file_id"])
+        return
+
+
+class FileSystemBackend(BlobBackend):
+    """
+    Book files in a local directory named by the sha256 of their content,
+    the book has storage_uri. Files are stored as is so they can be sent
+    with os.sendfile, a file added twice is stored once
+    """
+
+    name = "filesystem"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, storage_uri: str) -> str:
+        """
+        Get the path of a stored file, two levels of directories from the
+        start of the hash keep every directory small
+
+        Args:
+            storage_uri: cas://sha256/<hash><extension>
+
+        Returns: The path under root
+        """
+        if not storage_uri.startswith(CAS_PREFIX):
+            raise BadEpub(f"Unknown storage uri {storage_uri}")
+        blob_name = storage_uri[len(CAS_PREFIX) :]
+        return os.path.join(self.root, blob_name[:2], blob_name[2:4], blob_name)
+
+    def save_blocks(self, blocks, extension: str) -> dict:
+        """
+        Store a stream of bytes blocks, hashed while it is written to a
+        temporary file that is renamed to its hash
+
+        Args:
+            blocks: iterable of bytes
+            extension: extension of the file, .epub or .pdf
+
+        Returns: the fields of the book that point to the file
+        """
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.join(self.root, "tmp"), delete=False
+        ) as outfile:
+            try:
+                for block in blocks:
+                    digest.update(block)
+                    outfile.write(block)
+            except BaseException:
+                outfile.close()
+                os.remove(outfile.name)
+                raise
+        storage_uri = f"{CAS_PREFIX}{digest.hexdigest()}{extension}"
+        blob_path = self.blob_path(storage_uri)
+        if os.path.exists(blob_path):
+            os.remove(outfile.name)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(outfile.name, blob_path)
+        return {"storage_uri": storage_uri}
+
+    def save_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        file_name: str,
+        file_path: str,
+    ) -> dict:
+        get_content_type(file_path)
+        if os.path.isdir(file_path):
+            raise BadEpub(f'specified file "{file_path}" is a directory, not a file.')
+        try:
+            with open(file_path, "rb") as infile:
+                return self.save_blocks(
+                    iter(lambda: infile.read(READ_SIZE), b""),
+                    os.path.splitext(file_path)[1].lower(),
+                )
+        except FileNotFoundError:
+            raise BadEpub(f'specified file "{file_path}" does not exist.')
+
+    def iter_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ):
+        with open(self.blob_path(book["storage_uri"]), "rb") as infile:
+            yield from iter(lambda: infile.read(READ_SIZE), b"")
+
+    def copy_to_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+        output_file,
+    ) -> int:
+        # a SpooledTemporaryFile would be written to disk by fileno()
+        if not hasattr(os, "sendfile") or not isinstance(
+            output_file, (io.BufferedWriter, io.FileIO)
+        ):
+            return super().copy_to_file(
+                session=session, db=db, book=book, output_file=output_file
+            )
+        output_file.flush()
+        written = 0
+        with open(self.blob_path(book["storage_uri"]), "rb") as infile:
+            # the kernel copies the file, it never goes through python
+            while True:
+                sent = os.sendfile(
+                    output_file.fileno(), infile.fileno(), written, SENDFILE_SIZE
+                )
+                if sent == 0:
+                    break
+                written += sent
+        # sendfile moved the position of the file descriptor, not the one
+        # output_file keeps
+        output_file.seek(os.lseek(output_file.fileno(), 0, os.SEEK_CUR))
+        return written
+
+    def file_info(
+        self,
+        *,
+        db: pymongo.mongo_client.database.Database,
+        books: list,
+    ) -> dict:
+        files = {}
+        for book in books:
+            try:
+                length = os.path.getsize(self.blob_path(book["storage_uri"]))
+            except FileNotFoundError:
+                continue
+            files[book["storage_uri"]] = {
+                "_id": book["storage_uri"],
+                "length": length,
+                "sha256": os.path.splitext(book["storage_uri"][len(CAS_PREFIX) :])[0],
+            }
+        return files
+
+    def delete_file(
+        self,
+        *,
+        session: pymongo.mongo_client.client_session,
+        db: pymongo.mongo_client.database.Database,
+        book: dict,
+    ) -> None:
+        # another book with the same content has the same file, and the
+        # bulk load checkpoint of another book can reuse it
+        shared = db.books.find_one(
+            {"storage_uri": book["storage_uri"], "_id": {"$ne": book["_id"]}},
+            {"_id": 1},
+            session=session,
+        ) or db.bulk_load_checkpoint.find_one(
+            {
+                "storage_uri": book["storage_uri"],
+                "_id": {"$ne": book.get("natural_key")},
+            },
+            {"_id": 1},
+            session=session,
+        )
+        if shared is not None:
+            return
+        try:
+            os.remove(self.blob_path(book["storage_uri"]))
+        except FileNotFoundError:
+            pass
+        return
+
+
+def get_backend(name: str = None) -> BlobBackend:
+    """
+    Get a storage backend
+
+    Args:
+        name: "gridfs" or "filesystem", the backend of the config if None
+
+    Returns: The backend
+    """
+    global _SETTINGS
+    if _SETTINGS is None:
+        _SETTINGS = load_config()["blob_storage"]
+    name = name or _SETTINGS["backend"]
+    if name == GridFSBackend.name:
+        return GridFSBackend()
+    if name == FileSystemBackend.name:
+        return FileSystemBackend(_SETTINGS["root"])
+    raise ValueError(f"Unknown blob storage backend {name}")
+
+
+def backend_of(book: dict) -> BlobBackend:
+    """
+    Get the backend the file of a book is stored in
+
+    Args:
+        book: book with the fields of file_fields
+
+    Returns: The backend
+    """
+    if "storage_uri" in book:
+        return get_backend(FileSystemBackend.name)
+    return get_backend(GridFSBackend.name)
+
+
+def file_fields(document: dict) -> dict:
+    """
+    Get the fields that point to a stored file, a book keeps file_id for a
+    file in GridFS and storage_uri for a file in another backend
+
+    Args:
+        document: a book or a bulk_load_checkpoint entry
+
+    Returns: {"file_id": id} or {"storage_uri": uri}
+    """
+    if "storage_uri" in document:
+        return {"storage_uri": document["storage_uri"]}
+    return {"file_id": document["file_id"]}
+
+
+def file_key(book: dict):
+    """
+    Get the key of the stored file of a book in file_info
+
+    Args:
+        book: book with the fields of file_fields
+
+    Returns: The file id or the storage uri
+    """
+    return book["storage_uri"] if "storage_uri" in book else book["file_id"]
+
+
+def existing_files(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    documents: list,
+) -> set:
+    """
+    Check which of the stored files of many documents still exist, one
+    file_info call per backend
+
+    Args:
+        db: use in which database
+        documents: books or bulk_load_checkpoint entries with the fields of
+            file_fields
+
+    Returns: set of the file_key of the files that exist
+    """
+    by_backend = {}
+    for document in documents:
+        by_backend.setdefault(backend_of(document).name, []).append(document)
+    found = set()
+    for name, group in by_backend.items():
+        found.update(get_backend(name).file_info(db=db, books=group))
+    return found
+
+
+def save_file(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    file_name: str,
+    file_path: str,
+) -> dict:
+    """
+    Store a file with the backend of the config
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        file_name: name of the file
+        file_path: path to the file
+
+    Returns: the fields to set on the book, see file_fields
+    """
+    return get_backend().save_file(
+        session=session, db=db, file_name=file_name, file_path=file_path
+    )
+
+
+def iter_file(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+):
+    """
+    Stream the original content of the file of a book from its backend
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: book with the fields of file_fields
+
+    Returns: Generator of bytes blocks
+    """
+    return backend_of(book).iter_file(session=session, db=db, book=book)
+
+
+def copy_to_file(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+    output_file,
+) -> int:
+    """
+    Write the file of a book to an opened binary file
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: book with the fields of file_fields
+        output_file: opened binary file
+
+    Returns: number of bytes written
+    """
+    return backend_of(book).copy_to_file(
+        session=session, db=db, book=book, output_file=output_file
+    )
+
+
+def delete_file(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+) -> None:
+    """
+    Delete the file of a book from its backend
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: book with _id and the fields of file_fields
+
+    Returns: None
+    """
+    backend_of(book).delete_file(session=session, db=db, book=book)
+    return
+
+
+def ensure_storage(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Install BOOKS_SCHEMA on a books collection created before books could
+    have a storage_uri instead of a file_id, and create the indexes
+    delete_file uses to find the other books and checkpoints of a file, only
+    the documents with a storage_uri are in them
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    if "books" not in db.list_collection_names(session=session):
+        return
+    db.command(
+        "collMod",
+        "books",
+        validator=BOOKS_SCHEMA,
+        validationLevel="strict",
+        validationAction="error",
+        session=session,
+    )
+    for collection in [db.books, db.bulk_load_checkpoint]:
+        collection.create_index(
+            "storage_uri",
+            partialFilterExpression={"storage_uri": {"$exists": True}},
+            session=session,
+        )
+    return
+
+
+def migrate(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    target: str,
+    batch_size: int = 100,
+) -> int:
+    """
+    Move the files of every book to another backend, one file at a time so
+    a file is never held in memory. The file is stored in the target, then
+    the book is pointed to it, then the old file is deleted, a migration
+    that stops part way can be run again
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        target: "gridfs" or "filesystem"
+        batch_size: number of books read per query
+
+    Returns: number of moved files
+    """
+    target_backend = get_backend(target)
+    if target == FileSystemBackend.name:
+        book_filter = {"storage_uri": {"$exists": False}}
+        old_field = "file_id"
+    else:
+        book_filter = {"storage_uri": {"$exists": True}}
+        old_field = "storage_uri"
+    moved = 0
+    last_id = None
+    while True:
+        page_filter = dict(book_filter)
+        if last_id is not None:
+            page_filter["_id"] = {"$gt": last_id}
+        books = list(
+            db.books.find(
+                page_filter,
+                {
+                    "file_id": 1,
+                    "storage_uri": 1,
+                    "file_name": 1,
+                    "file_type": 1,
+                    "natural_key": 1,
+                },
+                session=session,
+            )
+            .sort("_id", 1)
+            .limit(batch_size)
+        )
+        if not books:
+            break
+        last_id = books[-1]["_id"]
+        for book in books:
+            source_backend = backend_of(book)
+            blocks = source_backend.iter_file(session=session, db=db, book=book)
+            if target == FileSystemBackend.name:
+                fields = target_backend.save_blocks(
+                    blocks, os.path.splitext(book["file_name"])[1].lower()
+                )
+            else:
+                # GridFS picks the codec and chunk size from the file
+                fields = target_backend.save_file(
+                    session=session,
+                    db=db,
+                    file_name=book["file_name"],
+                    file_path=source_backend.blob_path(book["storage_uri"]),
+                )
+            history.update_book(
+                session=session,
+                db=db,
+                book_filter={"_id": book["_id"], "file_type": book.get("file_type")},
+                update={"$set": fields, "$unset": {old_field: ""}},
+            )
+            if "natural_key" in book:
+                # the next incremental load reuses the file of the checkpoint
+                db.bulk_load_checkpoint.update_one(
+                    {"_id": book["natural_key"], old_field: book[old_field]},
+                    {"$set": fields, "$unset": {old_field: ""}},
+                    session=session,
+                )
+            source_backend.delete_file(session=session, db=db, book=book)
+            moved += 1
+    return moved
+
+
+def referenced(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    field: str,
+    values: list,
+) -> set:
+    """
+    Get the stored files a book or a bulk load checkpoint still points to,
+    the checkpoint reuses the file of an unchanged book
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        field: "file_id" or "storage_uri"
+        values: the file ids or storage uris to check
+
+    Returns: set of the values that are referenced
+    """
+    found = set()
+    for collection in [db.books, db.bulk_load_checkpoint]:
+        for document in collection.find(
+            {field: {"$in": values}}, {field: 1}, session=session
+        ):
+            found.add(document[field])
+    return found
+
+
+def collect_garbage(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    grace_seconds: int = None,
+    batch_size: int = 500,
+    progress=None,
+) -> dict:
+    """
+    Delete the stored files no book points to anymore, left by uploads that
+    failed before their book was written. Only the files older than the
+    grace period are deleted so the file of an upload in progress is kept
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        grace_seconds: age of the files that can be deleted,
+            GARBAGE_GRACE_SECONDS if None
+        batch_size: number of files checked per query
+        progress: function(done, total=None, message=None) called after
+            every batch
+
+    Returns: number of files checked and deleted
+    """
+    grace_seconds = GARBAGE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    cutoff = now - datetime.timedelta(seconds=grace_seconds)
+    stats = {"checked": 0, "deleted": 0}
+
+    def collect(field, batch, delete):
+        keep = referenced(session=session, db=db, field=field, values=batch)
+        for value in batch:
+            if value not in keep:
+                delete(value)
+                stats["deleted"] += 1
+        stats["checked"] += len(batch)
+        if progress is not None:
+            progress(stats["checked"], None, f"{stats['deleted']} deleted")
+
+    gridfs_backend = get_backend(GridFSBackend.name)
+    last_id = None
+    while True:
+        files_filter = {"uploadDate": {"$lt": cutoff}}
+        if last_id is not None:
+            files_filter["_id"] = {"$gt": last_id}
+        batch = [
+            grid_file["_id"]
+            for grid_file in db.fs.files.find(files_filter, {"_id": 1}, session=session)
+            .sort("_id", 1)
+            .limit(batch_size)
+        ]
+        if not batch:
+            break
+        last_id = batch[-1]
+        collect(
+            "file_id",
+            batch,
+            lambda file_id: gridfs_backend.delete_file(
+                session=session, db=db, book={"file_id": file_id}
+            ),
+        )
+
+    root = get_backend(FileSystemBackend.name).root
+    if not os.path.isdir(root):
+        return stats
+    cutoff_time = time.time() - grace_seconds
+    batch = []
+    for directory, directories, names in os.walk(root):
+        if os.path.abspath(directory) == os.path.abspath(os.path.join(root, "tmp")):
+            # temporary files of uploads that were interrupted
+            for name in names:
+                path = os.path.join(directory, name)
+                if os.path.getmtime(path) < cutoff_time:
+                    os.remove(path)
+            continue
+        for name in names:
+            if os.path.getmtime(os.path.join(directory, name)) < cutoff_time:
+                batch.append(f"{CAS_PREFIX}{name}")
+            if len(batch) >= batch_size:
+                collect("storage_uri", batch, _remove_blob)
+                batch = []
+    if batch:
+        collect("storage_uri", batch, _remove_blob)
+    return stats
+
+
+def _remove_blob(storage_uri: str) -> None:
+    """
+    Remove a file of the filesystem backend
+
+    Args:
+        storage_uri: cas://sha256/<hash><extension>
+
+    Returns: None
+    """
+    try:
+        os.remove(get_backend(FileSystemBackend.name).blob_path(storage_uri))
+    except FileNotFoundError:
+        pass
+    return
+
+
+def main():
+    """
+    Main function to move the book files between storage backends
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Storage of the book files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="move every book file to a backend"
+    )
+    migrate_parser.add_argument(
+        "target", choices=[GridFSBackend.name, FileSystemBackend.name]
+    )
+    migrate_parser.add_argument("--batch-size", type=int, default=100)
+    gc_parser = subparsers.add_parser(
+        "gc", help="delete the stored files no book points to"
+    )
+    gc_parser.add_argument(
+        "--grace-seconds", type=int, default=GARBAGE_GRACE_SECONDS
+    )
+    args = parser.parse_args()
+
+    with (
+        get_client("bulk_load") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books")
+        if args.command == "gc":
+            stats = collect_garbage(
+                session=session, db=db, grace_seconds=args.grace_seconds
+            )
+            print(f"{stats['deleted']} of {stats['checked']} files deleted")
+            return EXIT_SUCCESS
+        ensure_storage(session=session, db=db)
+        try:
+            moved = migrate(
+                session=session, db=db, target=args.target, batch_size=args.batch_size
+            )
+        except BadEpub as error_message:
+            print(error_message)
+            return EXIT_FAILURE
+        print(f"{moved} files moved to {args.target}")
+    return EXIT_SUCCESS
+
+
+CAS_PREFIX = "cas://sha256/"
+READ_SIZE = 1024 * 1024
+SENDFILE_SIZE = 16 * 1024 * 1024
+# a file no book points to is deleted only once it is this old, an upload
+# stores its file before the book is written
+GARBAGE_GRACE_SECONDS = 24 * 60 * 60
+# blob_storage of the config, loaded on first use
+_SETTINGS = None
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
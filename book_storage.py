@@ -0,0 +1,324 @@
+import hashlib
+import os
+import zlib
+import gridfs
+import pymongo
+from gridfs import GridFS
+from connection import load_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BadEpub(Exception):
+    """File is invalid"""
+
+
+def get_content_type(file_path: str) -> str:
+    """
+    Get the GridFS content type of a book file from its extension
+
+    Args:
+        file_path: path to the file
+
+    Returns: The content type stored in fs.files
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in CONTENT_TYPES:
+        print("-" * 79)
+        raise BadEpub(f"File {file_path} is not an epub or pdf file.")
+    return CONTENT_TYPES[extension]
+
+
+def get_codec(content_type: str, compression: str = "auto") -> str | None:
+    """
+    Pick the compression codec for a file
+
+    Args:
+        content_type: content type of the file
+        compression: "auto" to pick by content type, "none", "zstd" or "zlib"
+
+    Returns: The codec name or None to store the file as is
+    """
+    if compression == "none":
+        return None
+    if compression == "auto":
+        codec = COMPRESSION_BY_CONTENT_TYPE.get(content_type, "zstd")
+    else:
+        codec = compression
+    if codec not in [None, "zstd", "zlib"]:
+        raise ValueError(f"Unknown compression codec {codec}")
+    # zstandard is optional, zlib is always available
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+    return codec
+
+
+def chunk_size_for(file_size: int, chunk_sizes: list = None) -> int:
+    """
+    Pick the GridFS chunk size of a file by its size class
+
+    Args:
+        file_size: size of the file in bytes
+        chunk_sizes: size classes like DEFAULT_GRIDFS_CHUNK_SIZES of the
+            connection module, the gridfs_chunk_sizes of the config if None
+
+    Returns: The chunk size in bytes
+    """
+    global _CHUNK_SIZES
+    if chunk_sizes is None:
+        if _CHUNK_SIZES is None:
+            _CHUNK_SIZES = load_config()["gridfs_chunk_sizes"]
+        chunk_sizes = _CHUNK_SIZES
+    chunk_size = DEFAULT_CHUNK_SIZE
+    for size_class in chunk_sizes:
+        if size_class["max_mb"] is None or file_size <= size_class["max_mb"] * MB:
+            chunk_size = size_class["chunk_kb"] * 1024
+            break
+    # a chunk is one document, it has to fit in 16 MB with its fields
+    return min(chunk_size, MAX_CHUNK_SIZE)
+
+
+def new_compressor(codec: str):
+    """
+    Create a streaming compressor
+
+    Args:
+        codec: "zstd" or "zlib"
+
+    Returns: object with compress() and flush()
+    """
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(ZLIB_LEVEL)
+
+
+def new_decompressor(codec: str):
+    """
+    Create a streaming decompressor
+
+    Args:
+        codec: "zstd" or "zlib"
+
+    Returns: object with decompress()
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise BadEpub(
+                "File is compressed with zstd but zstandard is not installed."
+            )
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj()
+
+
+def sample_codec(infile, codec: str | None) -> str | None:
+    """
+    Check on the start of a file that a codec makes it smaller, so a file
+    that does not compress (a PDF of scanned pages) is uploaded once as is
+    instead of being compressed, uploaded and uploaded again
+
+    Args:
+        infile: opened binary file at its start, it is put back there
+        codec: codec picked by content type, None to store as is
+
+    Returns: The codec or None to store the file as is
+    """
+    if codec is None:
+        return None
+    sample = infile.read(SAMPLE_SIZE)
+    infile.seek(0)
+    compressor = new_compressor(codec)
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    if compressed >= len(sample):
+        return None
+    return codec
+
+
+def _upload_stream(
+    *,
+    session: pymongo.mongo_client.client_session,
+    fs: GridFS,
+    infile,
+    file_name: str,
+    content_type: str,
+    codec: str | None,
+    chunk_size: int,
+):
+    """
+    Stream a file into GridFS, compressing it on the way
+
+    Args:
+        session: session to connect to the database
+        fs: GridFS to upload to
+        infile: opened binary file
+        file_name: name of the file
+        content_type: content type of the file
+        codec: codec to compress with, None to store as is
+        chunk_size: bytes per chunk, recorded as chunkSize in fs.files
+
+    Returns: The id of the file in GridFS
+    """
+    compressor = new_compressor(codec) if codec is not None else None
+    raw_length = 0
+    raw_md5 = hashlib.md5()
+    grid_in = fs.new_file(
+        filename=file_name,
+        content_type=content_type,
+        chunk_size=chunk_size,
+        session=session,
+    )
+    try:
+        while True:
+            block = infile.read(READ_SIZE)
+            if not block:
+                break
+            raw_length += len(block)
+            raw_md5.update(block)
+            if compressor is not None:
+                block = compressor.compress(block)
+            grid_in.write(block)
+        if compressor is not None:
+            block = compressor.flush()
+            grid_in.write(block)
+    except BaseException:
+        grid_in.abort()
+        raise
+
+    grid_in.metadata = {
+        "codec": codec if codec is not None else "none",
+        "raw_length": raw_length,
+        "raw_md5": raw_md5.hexdigest(),
+    }
+    grid_in.close()
+    return grid_in._id
+
+
+def save_file_gridfs(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    file_name: str,
+    file_path: str,
+    compression: str = "auto",
+    chunk_size: int = None,
+) -> str:
+    """
+    Save a file to GridFS
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        file_name: name of the file
+        file_path: path to the file
+        compression: "auto" to pick a codec by content type, "none", "zstd" or "zlib"
+        chunk_size: bytes per GridFS chunk, picked by the size of the file
+            with chunk_size_for if None
+
+    Returns: The id of the file in GridFS
+    """
+    content_type = get_content_type(file_path)
+    codec = get_codec(content_type, compression)
+
+    # every upload is a new file, a file of another book with the same name
+    # is kept and the file a book no longer points to is left to
+    # blob_storage.collect_garbage
+    fs: GridFS = gridfs.GridFS(db)
+    if os.path.isdir(file_path):
+        raise BadEpub(f'specified file "{file_path}" is a directory, not a file.')
+    try:
+        with open(file_path, "rb") as infile:
+            if chunk_size is None:
+                chunk_size = chunk_size_for(os.fstat(infile.fileno()).st_size)
+            the_id = _upload_stream(
+                session=session,
+                fs=fs,
+                infile=infile,
+                file_name=file_name,
+                content_type=content_type,
+                codec=sample_codec(infile, codec),
+                chunk_size=chunk_size,
+            )
+    except FileNotFoundError:
+        raise BadEpub(f'specified file "{file_path}" does not exist.')
+
+    return the_id
+
+
+def iter_file_gridfs(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    file_id: str,
+):
+    """
+    Stream the original content of a file from GridFS, decompressing it
+    with the codec recorded in fs.files metadata
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        file_id: id of the file in GridFS
+
+    Returns: Generator of bytes blocks
+    """
+    grid_out = gridfs.GridFS(db).get(file_id, session=session)
+    metadata = grid_out.metadata or {}
+    codec = metadata.get("codec", "none")
+    decompressor = new_decompressor(codec) if codec != "none" else None
+    while True:
+        chunk = grid_out.readchunk()
+        if not chunk:
+            break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decompressor is not None and hasattr(decompressor, "flush"):
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+
+def delete_file_gridfs(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    file_id: str,
+) -> None:
+    """
+    Delete a file from GridFS
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        file_id: id of the file to delete
+
+    Returns: None
+    """
+    fs = gridfs.GridFS(db)
+    fs.delete(file_id, session=session)
+    return
+
+
+CONTENT_TYPES = {
+    ".epub": "EPUB Document",
+    ".pdf": "PDF Document",
+}
+# EPUB is already a zip archive so it is stored as is
+COMPRESSION_BY_CONTENT_TYPE = {
+    "EPUB Document": None,
+    "PDF Document": "zstd",
+}
+READ_SIZE = 1024 * 1024
+MB = 1024 * 1024
+# start of a file compressed to pick between the codec and no compression
+SAMPLE_SIZE = 4 * MB
+# the GridFS default, used when no size class fits a file
+DEFAULT_CHUNK_SIZE = 255 * 1024
+MAX_CHUNK_SIZE = 15 * MB
+# size classes of the config, loaded on the first upload
+_CHUNK_SIZES = None
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
@@ -0,0 +1,282 @@
+import concurrent.futures
+import multiprocessing
+import re
+import pymongo
+import epub
+from connection import catalogue_reads
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+
+def iter_pdf_text(pdf_path: str):
+    """
+    Read the text of a PDF one page at a time, needs pypdf
+
+    Args:
+        pdf_path: path to the PDF
+
+    Returns: Generator of (page location, text)
+    """
+    if pypdf is None:
+        return
+    reader = pypdf.PdfReader(pdf_path)
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield f"page {number}", text
+
+
+def split_passages(text: str, passage_size: int) -> list:
+    """
+    Split the text of a chapter or page into passages at line breaks
+
+    Args:
+        text: the text
+        passage_size: about how many characters per passage
+
+    Returns: list of passages
+    """
+    passages = []
+    current = []
+    length = 0
+    for line in text.split("\n"):
+        current.append(line)
+        length += len(line) + 1
+        if length >= passage_size:
+            passages.append("\n".join(current))
+            current = []
+            length = 0
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+def extract_text(file_path: str) -> list:
+    """
+    Extract the text of a book file, run in a worker process
+
+    Args:
+        file_path: path to the EPUB or PDF
+
+    Returns: list of (location, passage number, text)
+    """
+    if file_path[-5:] == ".epub":
+        sections = epub.iter_epub_text(file_path)
+    elif file_path[-4:] == ".pdf":
+        sections = iter_pdf_text(file_path)
+    else:
+        return []
+    passages = []
+    for location, text in sections:
+        for number, passage in enumerate(split_passages(text, PASSAGE_SIZE)):
+            passages.append((location, number, passage))
+    return passages
+
+
+def ensure_text_index(*, db: pymongo.mongo_client.database.Database) -> None:
+    """
+    Create the indexes of the book_text collection
+
+    Args:
+        db: use in which database
+
+    Returns: None
+    """
+    db.book_text.create_index([("text", pymongo.TEXT)], default_language="none")
+    db.book_text.create_index("book_id")
+    return
+
+
+def store_text(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    passages: list,
+) -> None:
+    """
+    Replace the stored text of a book
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+        passages: list of (location, passage number, text)
+
+    Returns: None
+    """
+    db.book_text.delete_many({"book_id": book_id})
+    for i in range(0, len(passages), INSERT_BATCH_SIZE):
+        db.book_text.insert_many(
+            [
+                {
+                    "book_id": book_id,
+                    "location": location,
+                    "passage": number,
+                    "text": text,
+                }
+                for location, number, text in passages[i : i + INSERT_BATCH_SIZE]
+            ],
+            ordered=False,
+        )
+    return
+
+
+def get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Get the process pool that extracts text, it is created on first use
+
+    Returns: The process pool
+    """
+    global _POOL
+    if _POOL is None:
+        # spawn so the workers do not inherit the MongoClient of this process
+        _POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _POOL
+
+
+def schedule_extraction(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    file_path: str,
+) -> concurrent.futures.Future:
+    """
+    Extract the text of an uploaded book in the process pool and store it
+    when it is done, the caller does not wait
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+        file_path: path to the uploaded file
+
+    Returns: Future of the extraction
+    """
+
+    def store_when_done(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        store_text(db=db, book_id=book_id, passages=future.result())
+
+    future = get_pool().submit(extract_text, file_path)
+    future.add_done_callback(store_when_done)
+    return future
+
+
+def delete_text(*, db: pymongo.mongo_client.database.Database, book_id) -> None:
+    """
+    Delete the stored text of a book
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+
+    Returns: None
+    """
+    db.book_text.delete_many({"book_id": book_id})
+    return
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Stop the process pool
+
+    Args:
+        wait: wait for the scheduled extractions to be stored
+
+    Returns: None
+    """
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=wait, cancel_futures=not wait)
+        _POOL = None
+    return
+
+
+def snippet(text: str, phrase: str, width: int = 60) -> str:
+    """
+    Get the part of a passage around the first match of a phrase
+
+    Args:
+        text: the passage
+        phrase: searched phrase
+        width: characters to show on each side
+
+    Returns: one line snippet
+    """
+    match = re.search(re.escape(phrase), text, re.IGNORECASE)
+    position = match.start() if match else 0
+    start = max(position - width, 0)
+    end = min(position + len(phrase) + width, len(text))
+    result = " ".join(text[start:end].split())
+    if start > 0:
+        result = "..." + result
+    if end < len(text):
+        result = result + "..."
+    return result
+
+
+def search_text(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    phrase: str,
+    limit: int = 20,
+) -> list:
+    """
+    Search a phrase in the content of every book with the text index
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        phrase: phrase to search
+        limit: maximum number of hits
+
+    Returns: list of hits with book_id, title, location and snippet
+    """
+    escaped = phrase.replace('"', " ")
+    hits = catalogue_reads(db).book_text.aggregate(
+        [
+            {"$match": {"$text": {"$search": f'"{escaped}"'}}},
+            {"$sort": {"score": {"$meta": "textScore"}}},
+            {
+                "$lookup": {
+                    "from": "books",
+                    "localField": "book_id",
+                    "foreignField": "_id",
+                    "as": "book",
+                }
+            },
+            # passages of deleted books do not take the place of real hits
+            {"$match": {"book": {"$ne": []}}},
+            {"$limit": limit},
+            {
+                "$project": {
+                    "book_id": 1,
+                    "location": 1,
+                    "text": 1,
+                    "title": {"$arrayElemAt": ["$book.title", 0]},
+                }
+            },
+        ],
+        session=session,
+    )
+    return [
+        {
+            "book_id": hit["book_id"],
+            "title": hit["title"],
+            "location": hit["location"],
+            "snippet": snippet(hit["text"], phrase),
+        }
+        for hit in hits
+    ]
+
+
+PASSAGE_SIZE = 2000
+INSERT_BATCH_SIZE = 500
+EXTRACT_WORKERS = 2
+_POOL = None
@@ -0,0 +1,368 @@
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+import pymongo
+import blob_storage
+
+
+def file_matches(
+    file_path: str, length: int, checksum: str, algorithm: str = "md5"
+) -> bool:
+    """
+    Check if a downloaded file already has the content of the stored file,
+    the length is checked first so most changed files are not read
+
+    Args:
+        file_path: path to the local file
+        length: original length of the stored file
+        checksum: original hex digest of the stored file, None to only check
+            the length
+        algorithm: hashlib name of the checksum, md5 or sha256
+
+    Returns: True if the file does not need to be downloaded again
+    """
+    try:
+        if os.path.getsize(file_path) != length:
+            return False
+    except FileNotFoundError:
+        return False
+    if checksum is None:
+        return True
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as infile:
+        while True:
+            block = infile.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest() == checksum
+
+
+def safe_file_name(book: dict) -> str:
+    """
+    Get the name a book file is written to, a directory or an archive
+    member, without the directories of the stored file name so it never
+    leaves the output directory, the id of the book if nothing is left
+
+    Args:
+        book: book with _id and file_name
+
+    Returns: The file name
+    """
+    file_name = os.path.basename(book["file_name"].replace("\\", "/"))
+    if file_name in ["", ".", ".."]:
+        return str(book["_id"])
+    return file_name
+
+
+def stored_file_info(grid_file: dict) -> tuple:
+    """
+    Get the original length and checksum of a file from its fs.files
+    document, the filesystem backend names its files by their sha256
+
+    Args:
+        grid_file: fs.files document or the document of file_info of the
+            other storage backends
+
+    Returns: (length, checksum, algorithm), checksum is None for files
+        stored without metadata
+    """
+    metadata = grid_file.get("metadata") or {}
+    if "raw_length" in metadata:
+        return metadata["raw_length"], metadata.get("raw_md5"), "md5"
+    if "sha256" in grid_file:
+        return grid_file["length"], grid_file["sha256"], "sha256"
+    return grid_file["length"], grid_file.get("md5"), "md5"
+
+
+def download_to_file(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+    output_file,
+) -> int:
+    """
+    Stream the file of a book from its storage backend into an opened file
+
+    Args:
+        db: use in which database
+        book: book with file_id or storage_uri
+        output_file: opened binary file
+
+    Returns: number of bytes written
+    """
+    return blob_storage.copy_to_file(
+        session=None, db=db, book=book, output_file=output_file
+    )
+
+
+def download_to_directory(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+    output_dir: str,
+) -> int:
+    """
+    Download the file of a book unless it is already there, the file is
+    written next to its final name and renamed so a failed download never
+    leaves a partial file
+
+    Args:
+        db: use in which database
+        book: book with file_id or storage_uri, file_name and grid_file
+        output_dir: directory to download to
+
+    Returns: number of bytes downloaded, None if the file was skipped
+    """
+    output_file_name = os.path.join(output_dir, safe_file_name(book))
+    length, checksum, algorithm = stored_file_info(book["grid_file"])
+    if file_matches(output_file_name, length, checksum, algorithm):
+        return None
+    # two books with the same file name never write the same temporary file
+    with tempfile.NamedTemporaryFile(
+        dir=output_dir, prefix=".", suffix=".part", delete=False
+    ) as output_file:
+        try:
+            written = download_to_file(db=db, book=book, output_file=output_file)
+        except BaseException:
+            output_file.close()
+            os.remove(output_file.name)
+            raise
+    os.replace(output_file.name, output_file_name)
+    return written
+
+
+def download_to_spool(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+):
+    """
+    Download the file of a book to a spooled temporary file, small files
+    stay in memory and big ones go to disk
+
+    Args:
+        db: use in which database
+        book: book with file_id or storage_uri and file_name
+
+    Returns: (book, spooled file, number of bytes)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    written = download_to_file(db=db, book=book, output_file=spool)
+    spool.seek(0)
+    return book, spool, written
+
+
+def iter_books_with_files(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict,
+    batch_size: int = 500,
+):
+    """
+    Stream the books that match a filter with their fs.files document, the
+    fs.files documents are fetched with one query per batch, a book in
+    another storage backend gets the document of its file_info
+
+    Args:
+        db: use in which database
+        filter_dict: filter of the books
+        batch_size: number of books per fs.files query
+
+    Returns: Generator of books with a grid_file field
+    """
+    cursor = db.books.find(
+        filter_dict,
+        {"file_id": 1, "storage_uri": 1, "file_name": 1},
+        batch_size=batch_size,
+    )
+    batch = []
+    for book in cursor:
+        batch.append(book)
+        if len(batch) >= batch_size:
+            yield from _attach_grid_files(db=db, books=batch)
+            batch = []
+    if batch:
+        yield from _attach_grid_files(db=db, books=batch)
+
+
+def _attach_grid_files(*, db: pymongo.mongo_client.database.Database, books: list):
+    """
+    Add the fs.files document to a batch of books
+
+    Args:
+        db: use in which database
+        books: books with file_id or storage_uri
+
+    Returns: Generator of books that have a stored file
+    """
+    books_by_backend = {}
+    for book in books:
+        name = blob_storage.backend_of(book).name
+        books_by_backend.setdefault(name, []).append(book)
+    grid_files = {}
+    for name, backend_books in books_by_backend.items():
+        backend = blob_storage.get_backend(name)
+        grid_files.update(backend.file_info(db=db, books=backend_books))
+    for book in books:
+        if blob_storage.file_key(book) in grid_files:
+            book["grid_file"] = grid_files[blob_storage.file_key(book)]
+            yield book
+
+
+def run_bounded(executor, function, items, max_pending: int):
+    """
+    Run function over items in the executor with at most max_pending
+    items in flight, so a filter that matches millions of books does not
+    queue millions of futures
+
+    Args:
+        executor: concurrent.futures executor
+        function: function(item)
+        items: iterable of items
+        max_pending: maximum number of submitted but not finished items
+
+    Returns: Generator of results in completion order
+    """
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                yield future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
+
+
+def download_books(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict,
+    output_dir: str = "./books_download/",
+    archive_path: str = None,
+    workers: int = 4,
+) -> dict:
+    """
+    Download the files of every book that matches a filter with a pool of
+    concurrent GridFS readers, into a directory or a tar/zip archive
+
+    Args:
+        db: use in which database
+        filter_dict: filter of the books
+        output_dir: directory to download to when there is no archive
+        archive_path: .tar, .tar.gz or .zip to stream into, "-.tar" or
+            "-.zip" writes the archive to stdout
+        workers: number of concurrent GridFS readers
+
+    Returns: number of files downloaded and skipped, bytes and seconds
+    """
+    stats = {"downloaded": 0, "skipped": 0, "bytes": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    books = iter_books_with_files(db=db, filter_dict=filter_dict)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        if archive_path is None:
+            os.makedirs(output_dir, exist_ok=True)
+            results = run_bounded(
+                executor,
+                lambda book: download_to_directory(
+                    db=db, book=book, output_dir=output_dir
+                ),
+                books,
+                workers * 2,
+            )
+            for written in results:
+                if written is None:
+                    stats["skipped"] += 1
+                else:
+                    stats["downloaded"] += 1
+                    stats["bytes"] += written
+        else:
+            results = run_bounded(
+                executor,
+                lambda book: download_to_spool(db=db, book=book),
+                books,
+                workers * 2,
+            )
+            with ArchiveWriter(archive_path) as add_to_archive:
+                for book, spool, written in results:
+                    with spool:
+                        add_to_archive(safe_file_name(book), spool, written)
+                    stats["downloaded"] += 1
+                    stats["bytes"] += written
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+class ArchiveWriter:
+    """Tar or zip archive that files are streamed into"""
+
+    def __init__(self, archive_path: str):
+        """
+        Args:
+            archive_path: .tar, .tar.gz or .zip, starting with "-" for stdout
+        """
+        self.archive_path = archive_path
+        self.archive = None
+
+    def __enter__(self):
+        """
+        Open the archive
+
+        Returns: function(file_name, infile, length) to add a file
+        """
+        name = self.archive_path
+        output = sys.stdout.buffer if name.startswith("-") else name
+        if name.endswith(".zip"):
+            self.archive = zipfile.ZipFile(output, "w", zipfile.ZIP_STORED)
+            return self.add_zip
+        if name.endswith(".tar.gz") or name.endswith(".tgz"):
+            mode = "w|gz"
+        else:
+            mode = "w|"
+        if isinstance(output, str):
+            self.archive = tarfile.open(output, mode)
+        else:
+            self.archive = tarfile.open(fileobj=output, mode=mode)
+        return self.add_tar
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.archive.close()
+        return False
+
+    def add_zip(self, file_name: str, infile, length: int) -> None:
+        """
+        Add a file to a zip archive, epub and pdf do not compress so it is stored
+
+        Args:
+            file_name: name in the archive
+            infile: opened binary file
+            length: size of the file
+        """
+        with self.archive.open(file_name, "w", force_zip64=True) as outfile:
+            shutil.copyfileobj(infile, outfile, 1024 * 1024)
+
+    def add_tar(self, file_name: str, infile, length: int) -> None:
+        """
+        Add a file to a tar archive
+
+        Args:
+            file_name: name in the archive
+            infile: opened binary file
+            length: size of the file
+        """
+        info = tarfile.TarInfo(file_name)
+        info.size = length
+        info.mtime = int(time.time())
+        self.archive.addfile(info, infile)
+
+
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
@@ -1,13 +1,25 @@
 #! /usr/bin/env python3
+import argparse
 import datetime
+import hashlib
 import os
-import gridfs
+import sys
+import time
+import bson
 import pymongo
-from gridfs import GridFS
-
-
-class BadEpub(Exception):
-    """File is invalid"""
+import blob_storage
+import book_text
+import catalogue
+import counts
+import covers
+import history
+import pipeline
+import query
+import summary
+from book_storage import BadEpub
+from catalogue import batched
+from schema import BOOKS_INDEXES, BOOKS_SCHEMA, BadBook, book_violations, validate_book
+from connection import get_client
 
 
 def initialize_database(
@@ -25,6 +37,7 @@ def initialize_database(
     Returns: None
     """
     if "books" in db.list_collection_names(session=session):
+        blob_storage.ensure_storage(session=session, db=db)
         return
     db.create_collection(
         "books",
@@ -35,55 +48,520 @@ def initialize_database(
     )
     if "books" not in db.list_collection_names(session=session):
         raise RuntimeError("Failed to create books collection")
+    ensure_natural_key_index(session=session, db=db)
+    blob_storage.ensure_storage(session=session, db=db)
+    query.ensure_indexes(session=session, db=db)
+    summary.ensure_indexes(session=session, db=db)
+    book_text.ensure_text_index(db=db)
     return
 
 
-def save_file_gridfs(
+def ensure_natural_key_index(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
-    file_name: str,
-    file_path: str,
-) -> str:
+) -> None:
     """
-    Save a file to GridFS
+    Create the natural_key index if there is none, it is unique unless the
+    books collection is sharded, where a unique index has to start with the
+    shard key and sharding.py replaces it with a plain one. Only the books
+    of the loader have a natural_key, the index is partial so the books
+    added from main.py do not all share a null key
 
     Args:
         session: session to connect to the database
         db: use in which database
-        file_name: name of the file
+
+    Returns: None
+    """
+    info = db.books.index_information(session=session).get("natural_key_1")
+    if info is not None:
+        if not info.get("unique") or "partialFilterExpression" in info:
+            return
+        # made by a version of the loader that indexed every book
+        db.books.drop_index("natural_key_1", session=session)
+    db.books.create_index(
+        "natural_key",
+        unique=True,
+        partialFilterExpression={"natural_key": {"$exists": True}},
+        session=session,
+    )
+    return
+
+
+def deferred_indexes() -> dict:
+    """
+    Get the secondary indexes a fast load builds after the books are loaded,
+    the _id and natural_key indexes of books stay because the loader looks
+    books up by them
+
+    Returns: key patterns by collection name
+    """
+    return {"books": BOOKS_INDEXES, "books_summary": summary.summary_indexes()}
+
+
+def drop_deferred_indexes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> list:
+    """
+    Drop the indexes of deferred_indexes before a fast load, every book
+    inserted after that only updates the _id and natural_key indexes. The
+    validator of the books collection is not changed
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: names of the dropped indexes, collection.index
+    """
+    dropped = []
+    for collection_name, indexes in deferred_indexes().items():
+        collection = db.get_collection(collection_name)
+        for name, info in collection.index_information(session=session).items():
+            if list(info["key"]) not in indexes:
+                continue
+            try:
+                collection.drop_index(name, session=session)
+            except pymongo.errors.OperationFailure:
+                # the index of the shard key of a sharded collection stays
+                continue
+            dropped.append(f"{collection_name}.{name}")
+    return dropped
+
+
+def build_deferred_indexes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Build the indexes of deferred_indexes after a fast load, one
+    createIndexes per collection so the server builds them in one scan of
+    the collection
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    query.ensure_indexes(session=session, db=db)
+    summary.ensure_indexes(session=session, db=db)
+    return
+
+
+def verify_deferred_indexes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> list:
+    """
+    Check that every index of deferred_indexes exists and has an entry for
+    every document, counting through the index reads only the index
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: problems found, empty if the indexes are complete
+    """
+    problems = []
+    for collection_name, indexes in deferred_indexes().items():
+        collection = db.get_collection(collection_name)
+        documents = collection.count_documents({}, session=session)
+        built = [
+            list(info["key"])
+            for info in collection.index_information(session=session).values()
+        ]
+        for index in indexes:
+            if index not in built:
+                problems.append(f"{collection_name} {index} is missing")
+                continue
+            indexed = collection.count_documents({}, hint=index, session=session)
+            if indexed != documents:
+                problems.append(
+                    f"{collection_name} {index} has {indexed} of {documents} "
+                    "documents"
+                )
+    return problems
+
+
+def natural_key(book: dict) -> str:
+    """
+    Get the stable key of a book that does not change between loads
+
+    Args:
+        book: book from the catalogue
+
+    Returns: ISBN and title of the book
+    """
+    return f"{book['ISBN']}|{book['title']}"
+
+
+def last_by_natural_key(items: list, book=lambda item: item) -> list:
+    """
+    Keep only the last item of every natural key, two inserts of the same
+    key in one batch fail on the unique natural_key index
+
+    Args:
+        items: items with a book that has natural_key
+        book: function(item) that returns the book of an item
+
+    Returns: items in the order of the first item of every key
+    """
+    last = {}
+    for item in items:
+        last[book(item)["natural_key"]] = item
+    return list(last.values())
+
+
+def metadata_hash(book: dict) -> str:
+    """
+    Hash the catalogue metadata of a book to detect changed entries
+
+    Args:
+        book: book from the catalogue
+
+    Returns: sha256 of the metadata without the GridFS file
+    """
+    metadata = {k: v for k, v in book.items() if k not in DERIVED_FIELDS}
+    return hashlib.sha256(bson.encode(metadata)).hexdigest()
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Hash the content of a file without reading it all to memory
+
+    Args:
         file_path: path to the file
 
-    Returns: The id of the file in GridFS
-    """
-    if file_path[-5:] != ".epub" and file_path[-5:] != ".pdf":
-        print("-" * 79)
-        raise BadEpub(f"File {file_path} is not an epub or pdf file.")
-
-    file_name_filter = {"filename": file_name}
-    fs: GridFS = gridfs.GridFS(db)
-    if fs.exists(file_name_filter, session=session):
-        the_id = fs.find_one(
-            file_name_filter, no_cursor_timeout=True, session=session
-        )._id
-        fs.delete(the_id, session=session)
-        del the_id
-    if os.path.isdir(file_path):
-        raise BadEpub(f'specified file "{file_path}" is a directory, not a file.')
-    try:
-        with open(file_path, "rb") as infile:
-            the_id = fs.put(
-                infile.read(),
-                filename=file_name,
-                content_type="EPUB Document",
-                session=session,
+    Returns: sha256 of the file
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as infile:
+        while True:
+            block = infile.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def checkpoint_entry(book: dict, stat: os.stat_result) -> dict:
+    """
+    Make the checkpoint entry of a stored book
+
+    Args:
+        book: book with natural_key, file_hash and file_id or storage_uri
+        stat: stat of the book file when it was read
+
+    Returns: The checkpoint entry
+    """
+    return {
+        "_id": book["natural_key"],
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "metadata_hash": metadata_hash(book),
+        "file_hash": book["file_hash"],
+        **blob_storage.file_fields(book),
+    }
+
+
+def load_checkpoint(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    keys: list,
+) -> dict:
+    """
+    Load what the previous loads already stored for a batch of books
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        keys: natural keys of the books
+
+    Returns: checkpoint entries by natural key
+    """
+    return {
+        entry["_id"]: entry
+        for entry in db.bulk_load_checkpoint.find(
+            {"_id": {"$in": keys}}, session=session
+        )
+    }
+
+
+def delete_checkpoint(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+) -> None:
+    """
+    Forget the checkpoint of a deleted book so the next incremental load
+    adds it again instead of skipping it
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: the deleted book, books without natural_key were not loaded
+
+    Returns: None
+    """
+    if "natural_key" in book:
+        db.bulk_load_checkpoint.delete_one(
+            {"_id": book["natural_key"]}, session=session
+        )
+    return
+
+
+def write_batch(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    batch: list,
+) -> None:
+    """
+    Upsert a batch of books by natural key then checkpoint them. The writes
+    are keyed on file_type and _id, the shard key of a sharded books
+    collection, so every write goes to one shard. The changes are appended
+    to the history so incremental backups find the books
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        batch: list of (book, checkpoint entry)
+
+    Returns: None
+    """
+    if not batch:
+        return
+    # the whole books, the history records the fields that changed
+    stored = {
+        book["natural_key"]: book
+        for book in db.books.find(
+            {"natural_key": {"$in": [book["natural_key"] for book, _ in batch]}},
+            session=session,
+        )
+    }
+    requests = []
+    changes = []
+    for book, _ in batch:
+        old = stored.get(book["natural_key"])
+        if old is None:
+            requests.append(pymongo.InsertOne(book))
+            changes.append(("add", None, book))
+            continue
+        book["_id"] = old["_id"]
+        changes.append(("edit", old, book))
+        if old.get("file_type") == book.get("file_type"):
+            requests.append(
+                pymongo.ReplaceOne(
+                    {"file_type": book.get("file_type"), "_id": book["_id"]}, book
+                )
+            )
+        else:
+            # a new file_type moves the book to another chunk
+            requests.append(
+                pymongo.DeleteOne(
+                    {"file_type": old.get("file_type"), "_id": old["_id"]}
+                )
             )
-            if the_id is None:
-                raise BadEpub(f'failed to save file "{file_path}" to GridFS.')
-    except FileNotFoundError:
-        raise BadEpub(f'specified file "{file_path}" does not exist.')
+            requests.append(pymongo.InsertOne(book))
+    db.books.bulk_write(requests, ordered=True, session=session)
+    # InsertOne set the _id of the added books
+    history.record_changes(session=session, db=db, changes=changes)
+    db.books_summary.bulk_write(
+        summary.write_requests([book for book, _ in batch]),
+        ordered=False,
+        session=session,
+    )
+    counts.invalidate()
+    # checkpoint only after the books are stored so a failed run is redone
+    db.bulk_load_checkpoint.bulk_write(
+        [
+            pymongo.ReplaceOne({"_id": entry["_id"]}, entry, upsert=True)
+            for _, entry in batch
+        ],
+        ordered=False,
+        session=session,
+    )
+    return
 
-    return the_id
+
+def add_books_incremental(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    books,
+    batch_size: int = 500,
+    on_error=None,
+) -> dict:
+    """
+    Add or update books without dropping the collection, books whose file
+    size, mtime and metadata did not change since the last checkpoint are
+    skipped and files whose hash did not change are not uploaded again.
+    Books are read from the iterable one batch at a time so memory does not
+    grow with the size of the catalogue.
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        books: iterable of books to add to the database
+        batch_size: number of books per upsert batch
+        on_error: function(book, error_message) called for books that are
+            invalid or whose file can not be stored, the error is raised if
+            not given
+
+    Returns: number of books skipped, updated, uploaded and rejected
+    """
+    ensure_natural_key_index(session=session, db=db)
+    stats = {"skipped": 0, "updated": 0, "uploaded": 0, "rejected": 0}
+    for books_batch in batched(books, batch_size):
+        # check the whole batch before any file is uploaded
+        valid_books = []
+        for i in books_batch:
+            violations = book_violations(i)
+            if violations:
+                if on_error is None:
+                    raise BadBook(violations)
+                on_error(i, BadBook(violations))
+                stats["rejected"] += 1
+                continue
+            i["natural_key"] = natural_key(i)
+            valid_books.append(i)
+        # a row repeated in the batch is loaded once, with its last values
+        books_batch = last_by_natural_key(valid_books)
+        stats["skipped"] += len(valid_books) - len(books_batch)
+        checkpoint = load_checkpoint(
+            session=session, db=db, keys=[i["natural_key"] for i in books_batch]
+        )
+        # a file is only reused if it was not deleted since the checkpoint
+        stored_files = blob_storage.existing_files(
+            db=db, documents=list(checkpoint.values())
+        )
+        batch = []
+        uploaded_keys = set()
+        for i in books_batch:
+            try:
+                try:
+                    stat = os.stat(i["file_path"])
+                except FileNotFoundError:
+                    raise BadEpub(f'specified file "{i["file_path"]}" does not exist.')
+                entry = checkpoint.get(i["natural_key"])
+                if (
+                    entry is not None
+                    and entry["size"] == stat.st_size
+                    and entry["mtime_ns"] == stat.st_mtime_ns
+                    and entry["metadata_hash"] == metadata_hash(i)
+                ):
+                    stats["skipped"] += 1
+                    continue
+
+                i["file_hash"] = file_hash(i["file_path"])
+                if (
+                    entry is not None
+                    and entry["file_hash"] == i["file_hash"]
+                    and blob_storage.file_key(entry) in stored_files
+                ):
+                    i.update(blob_storage.file_fields(entry))
+                    stats["updated"] += 1
+                else:
+                    i.update(
+                        blob_storage.save_file(
+                            db=db,
+                            session=session,
+                            file_name=i["file_name"],
+                            file_path=i["file_path"],
+                        )
+                    )
+                    stats["uploaded"] += 1
+                    uploaded_keys.add(i["natural_key"])
+            except BadEpub as error_message:
+                if on_error is None:
+                    raise
+                on_error(i, error_message)
+                stats["rejected"] += 1
+                continue
+            if i["file_path"][-5:] == ".epub":
+                i["file_type"] = "EPUB"
+            elif i["file_path"][-4:] == ".pdf":
+                i["file_type"] = "PDF"
+
+            batch.append((i, checkpoint_entry(i, stat)))
+
+        write_batch(session=session, db=db, batch=batch)
+        # write_batch sets the _id of every book in the batch
+        for book, _ in batch:
+            if book["natural_key"] in uploaded_keys:
+                book_text.schedule_extraction(
+                    db=db, book_id=book["_id"], file_path=book["file_path"]
+                )
+                covers.schedule_cover(
+                    db=db, book_id=book["_id"], file_path=book["file_path"]
+                )
+    return stats
+
+
+def load_manifest(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    manifest_path: str,
+    rejects_path: str,
+    batch_size: int = 500,
+    uploaders: int = 0,
+) -> dict:
+    """
+    Stream books from a JSON Lines, CSV or directory manifest into the
+    database, rows that can not be parsed, fail validation or whose file
+    can not be stored are written to the reject file
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        manifest_path: path to the manifest
+        rejects_path: path to the reject file
+        batch_size: number of books per upsert batch
+        uploaders: number of upload threads of pipeline.load_pipeline, 0
+            loads one batch at a time with add_books_incremental
+
+    Returns: number of books skipped, updated, uploaded and rejected
+    """
+    with open(rejects_path, "w", encoding="utf-8") as rejects:
+        rows = catalogue.read_manifest(manifest_path)
+        books = catalogue.parse_rows(rows, manifest_path, rejects)
+        books = catalogue.validate_rows(
+            books,
+            manifest_path,
+            rejects,
+            book_violations,
+        )
+
+        def reject_upload(book, error_message):
+            catalogue.write_reject(
+                rejects, manifest_path, book["file_path"], book, [str(error_message)]
+            )
+
+        if uploaders:
+            return pipeline.load_pipeline(
+                session=session,
+                db=db,
+                books=books,
+                batch_size=batch_size,
+                uploaders=uploaders,
+                on_error=reject_upload,
+            )
+        stats = add_books_incremental(
+            session=session,
+            db=db,
+            books=books,
+            batch_size=batch_size,
+            on_error=reject_upload,
+        )
+    return stats
 
 
 def add_books(
@@ -102,14 +580,20 @@ def add_books(
 
     Returns: None
     """
+    # fail fast before any file is uploaded
+    for i in books:
+        validate_book(i)
+
     books_with_file_id = []
     for i in books:
         try:
-            i["file_id"] = save_file_gridfs(
-                db=db,
-                session=session,
-                file_name=i["file_name"],
-                file_path=i["file_path"],
+            i.update(
+                blob_storage.save_file(
+                    db=db,
+                    session=session,
+                    file_name=i["file_name"],
+                    file_path=i["file_path"],
+                )
             )
 
         except BadEpub as error_message:
@@ -118,14 +602,36 @@ def add_books(
             i["file_type"] = "EPUB"
         elif i["file_path"][-4:] == ".pdf":
             i["file_type"] = "PDF"
+        i["natural_key"] = natural_key(i)
+        i["file_hash"] = file_hash(i["file_path"])
 
         books_with_file_id.append(i)
 
     db.books.insert_many(books_with_file_id)
+    db.books_summary.insert_many(
+        [summary.summarize(book) for book in books_with_file_id]
+    )
+    counts.invalidate()
+    for i in books_with_file_id:
+        book_text.schedule_extraction(db=db, book_id=i["_id"], file_path=i["file_path"])
+        covers.schedule_cover(db=db, book_id=i["_id"], file_path=i["file_path"])
 
     if db.books.count_documents({}) != len(books):
         raise RuntimeError("Number of books in db mismatch")
 
+    # so a later --incremental run can skip these books
+    db.bulk_load_checkpoint.bulk_write(
+        [
+            pymongo.ReplaceOne(
+                {"_id": i["natural_key"]},
+                checkpoint_entry(i, os.stat(i["file_path"])),
+                upsert=True,
+            )
+            for i in books_with_file_id
+        ],
+        session=session,
+    )
+
     return
 
 
@@ -135,123 +641,147 @@ def main():
 
     Returns: EXIT_SUCCESS or EXIT_FAILURE
     """
+    parser = argparse.ArgumentParser(description="Bulk load books to MongoDB")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="keep the books collection and only load new or changed books",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="load books from a .jsonl, .csv or directory manifest "
+        "instead of BOOKS_DATA, EPUBs in a directory need no .json file",
+    )
+    parser.add_argument(
+        "--rejects",
+        default="./rejects.jsonl",
+        help="where to write manifest rows that can not be loaded",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="with --manifest or --incremental, read, hash, upload and write "
+        "different books at the same time and print the utilization of "
+        "every stage",
+    )
+    parser.add_argument(
+        "--uploaders",
+        type=int,
+        default=pipeline.PIPELINE_UPLOADERS,
+        help="number of GridFS upload threads of --pipeline",
+    )
+    parser.add_argument(
+        "--fast-load",
+        action="store_true",
+        help="drop the secondary indexes, load, then build and verify them",
+    )
+    args = parser.parse_args()
+    uploaders = args.uploaders if args.pipeline else 0
+
     with (
-        pymongo.MongoClient(URI) as client,
+        get_client("bulk_load") as client,
         client.start_session(causal_consistency=True) as session,
     ):
         db = client.get_database("books")
-        db.drop_collection("books")
+        if not args.incremental:
+            db.drop_collection("books")
+            # every book is uploaded again with a new file
+            db.drop_collection("fs.files")
+            db.drop_collection("fs.chunks")
+            db.drop_collection("books_summary")
+            db.drop_collection("bulk_load_checkpoint")
+            # the text and covers of the dropped books are extracted again
+            db.drop_collection("book_text")
+            db.drop_collection("covers")
         try:
             initialize_database(session=session, db=db)
         except RuntimeError as error_message:
             print("Failed to initialize database: ", error_message)
             return EXIT_FAILURE
+        if args.fast_load:
+            for name in drop_deferred_indexes(session=session, db=db):
+                print(f"dropped index {name}")
 
+        load_start = time.perf_counter()
         try:
-            add_books(session=session, db=db, books=BOOKS_DATA)
-        except BadEpub as error_message:
+            if args.manifest:
+                stats = load_manifest(
+                    session=session,
+                    db=db,
+                    manifest_path=args.manifest,
+                    rejects_path=args.rejects,
+                    batch_size=args.batch_size,
+                    uploaders=uploaders,
+                )
+                if uploaders:
+                    pipeline.print_stages(stats)
+                print(
+                    f"{stats['uploaded']} uploaded, {stats['updated']} updated, "
+                    f"{stats['skipped']} unchanged, {stats['rejected']} rejected "
+                    f"(see {args.rejects})"
+                )
+            elif args.incremental and uploaders:
+                stats = pipeline.load_pipeline(
+                    session=session,
+                    db=db,
+                    books=BOOKS_DATA,
+                    batch_size=args.batch_size,
+                    uploaders=uploaders,
+                )
+                pipeline.print_stages(stats)
+                print(
+                    f"{stats['uploaded']} uploaded, {stats['updated']} updated, "
+                    f"{stats['skipped']} unchanged"
+                )
+            elif args.incremental:
+                stats = add_books_incremental(
+                    session=session,
+                    db=db,
+                    books=BOOKS_DATA,
+                    batch_size=args.batch_size,
+                )
+                print(
+                    f"{stats['uploaded']} uploaded, {stats['updated']} updated, "
+                    f"{stats['skipped']} unchanged"
+                )
+            else:
+                add_books(session=session, db=db, books=BOOKS_DATA)
+        except (BadEpub, BadBook) as error_message:
             print(error_message)
             return EXIT_FAILURE
+        finally:
+            if args.fast_load:
+                # the indexes are built again even if the load stopped part way
+                load_seconds = time.perf_counter() - load_start
+                index_start = time.perf_counter()
+                build_deferred_indexes(session=session, db=db)
+                index_seconds = time.perf_counter() - index_start
+                print(
+                    f"books loaded in {load_seconds:.1f}s, "
+                    f"indexes built in {index_seconds:.1f}s"
+                )
+        if args.fast_load:
+            problems = verify_deferred_indexes(session=session, db=db)
+            for problem in problems:
+                print(problem)
+            if problems:
+                return EXIT_FAILURE
 
+        print("Waiting for the text of the books to be extracted")
+        book_text.shutdown(wait=True)
         print("Success Bulk load to MongoDB")
 
 
-BOOKS_SCHEMA = {
-    "$jsonSchema": {
-        "bsonType": "object",
-        "required": [
-            "title",
-            "author",
-            "language",
-            "ISBN",
-            "published_date",
-            "genres",
-            "sub_genres",
-            "main_characters",
-            "file_name",
-            "file_id",
-        ],
-        "properties": {
-            "title": {
-                "bsonType": "string",
-                "minimum": 1,
-                "description": "Title of the book",
-            },
-            "author": {
-                "bsonType": "array",
-                "items": {
-                    "bsonType": "object",
-                    "required": ["name"],
-                    "properties": {
-                        "name": {
-                            "bsonType": "string",
-                            "minimum": 1,
-                            "description": "Name of the author",
-                        },
-                        "pseudonym": {
-                            "bsonType": "string",
-                            "description": "Pseudonym of the author",
-                        },
-                    },
-                },
-                "description": "Authors of the book",
-            },
-            "language": {"bsonType": "string", "description": "Language of the book"},
-            "published_date": {
-                "bsonType": "date",
-                "description": "Published date of the book",
-            },
-            "genres": {
-                "bsonType": "array",
-                "items": {"bsonType": "string", "description": "Genre of the book"},
-                "description": "Genres of the book",
-            },
-            "sub_genres": {
-                "bsonType": "array",
-                "items": {"bsonType": "string", "description": "Sub-genre of the book"},
-                "description": "Sub-genres of the book",
-            },
-            "set_year": {
-                "bsonType": "string",
-                "minimum": 1,
-                "description": "Set year of the book",
-            },
-            "set_main_location": {
-                "bsonType": "string",
-                "description": "Set country of the book",
-            },
-            "copy_right": {
-                "bsonType": "string",
-                "description": "Copy-right of the book",
-            },
-            "ISBN": {
-                "bsonType": "string",
-                "description": "ISBN of the book",
-            },
-            "main_characters": {
-                "bsonType": "array",
-                "items": {
-                    "bsonType": "string",
-                    "description": "Main characters of the book",
-                },
-                "description": "Main characters of the book",
-            },
-            "file_type": {
-                "bsonType": "string",
-                "description": "File type of the book",
-            },
-            "file_name": {
-                "bsonType": "string",
-                "description": "File name of the book",
-            },
-            "file_id": {
-                "bsonType": "objectId",
-                "description": "File id of the book",
-            },
-        },
-    }
-}
-
+# fields added by the loader, not part of the catalogue
+DERIVED_FIELDS = [
+    "_id",
+    "file_id",
+    "storage_uri",
+    "file_type",
+    "file_hash",
+    "natural_key",
+]
 BOOKS_DATA = [
     {
         "title": "Frankenstein; Or, The Modern Prometheus",
@@ -490,6 +1020,5 @@ BOOKS_DATA = [
 
 EXIT_SUCCESS = 0
 EXIT_FAILURE = 1
-URI = "mongodb://localhost:27017/"
 if __name__ == "__main__":
-    SystemExit(main())
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import csv
+import datetime
+import json
+import os
+import epub
+from bson import json_util
+
+
+class BadRow(Exception):
+    """Catalogue row is invalid"""
+
+
+def read_jsonl(manifest_path: str):
+    """
+    Read a JSON Lines manifest one line at a time, extended json like
+    {"$date": ...} is supported
+
+    Args:
+        manifest_path: path to the manifest
+
+    Returns: Generator of (line number, row or BadRow)
+    """
+    with open(manifest_path, "r", encoding="utf-8") as infile:
+        for line_number, line in enumerate(infile, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json_util.loads(line)
+            except ValueError as error_message:
+                yield line_number, BadRow(f"invalid json: {error_message}")
+
+
+def read_csv(manifest_path: str):
+    """
+    Read a CSV manifest one row at a time, list columns are separated by ";"
+    and authors are written as "Name (Pseudonym)"
+
+    Args:
+        manifest_path: path to the manifest
+
+    Returns: Generator of (line number, row)
+    """
+    with open(manifest_path, "r", encoding="utf-8", newline="") as infile:
+        reader = csv.DictReader(infile)
+        for row in reader:
+            book = {}
+            for key, value in row.items():
+                if key is None or value is None or value.strip() == "":
+                    continue
+                value = value.strip()
+                if key == "author":
+                    book[key] = [parse_author(author) for author in split_list(value)]
+                elif key in LIST_FIELDS:
+                    book[key] = split_list(value)
+                else:
+                    book[key] = value
+            yield reader.line_num, book
+
+
+def read_directory(manifest_path: str):
+    """
+    Read a directory manifest, a book is a <name>.epub or <name>.pdf file
+    with an optional <name>.json file next to it. The metadata of an EPUB
+    is read from its OPF package document and the fields of the json file
+    override it, so a directory of EPUBs needs no json files at all. A PDF
+    has no metadata of its own, one without a json file is rejected
+
+    Args:
+        manifest_path: path to the directory
+
+    Returns: Generator of (file name, row or BadRow)
+    """
+    with os.scandir(manifest_path) as entries:
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            if not entry.is_file():
+                continue
+            if extension == ".epub":
+                if os.path.isfile(os.path.join(manifest_path, stem + ".json")):
+                    continue
+                try:
+                    book = epub.read_metadata(entry.path)
+                except epub.BadPackage as error_message:
+                    yield entry.name, BadRow(str(error_message))
+                    continue
+                book["file_path"] = entry.name
+                yield entry.name, book
+                continue
+            if extension == ".pdf":
+                if not os.path.isfile(os.path.join(manifest_path, stem + ".json")):
+                    yield entry.name, BadRow(f"no {stem}.json with the metadata")
+                continue
+            if extension != ".json":
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as infile:
+                    book = json_util.loads(infile.read())
+            except ValueError as error_message:
+                yield entry.name, BadRow(f"invalid json: {error_message}")
+                continue
+            if isinstance(book, dict) and "file_path" not in book:
+                for extension in [".epub", ".pdf"]:
+                    if os.path.isfile(os.path.join(manifest_path, stem + extension)):
+                        book["file_path"] = stem + extension
+                        break
+            file_path = book.get("file_path") if isinstance(book, dict) else None
+            if isinstance(file_path, str) and file_path.endswith(".epub"):
+                try:
+                    book = {
+                        **epub.read_metadata(
+                            os.path.join(manifest_path, book["file_path"])
+                        ),
+                        **book,
+                    }
+                except (epub.BadPackage, FileNotFoundError):
+                    pass
+            yield entry.name, book
+
+
+def read_manifest(manifest_path: str):
+    """
+    Read a manifest with the reader for its format
+
+    Args:
+        manifest_path: .jsonl, .csv or a directory
+
+    Returns: Generator of (location in the manifest, row or BadRow)
+    """
+    if os.path.isdir(manifest_path):
+        return read_directory(manifest_path)
+    if manifest_path.endswith(".jsonl") or manifest_path.endswith(".json"):
+        return read_jsonl(manifest_path)
+    if manifest_path.endswith(".csv"):
+        return read_csv(manifest_path)
+    raise ValueError(f"Unknown manifest format {manifest_path}")
+
+
+def split_list(value: str) -> list:
+    """
+    Split a ";" separated CSV column
+
+    Args:
+        value: column value
+
+    Returns: list of non empty items
+    """
+    return [item.strip() for item in value.split(";") if item.strip() != ""]
+
+
+def parse_author(value: str) -> dict:
+    """
+    Parse "Name (Pseudonym)" into an author
+
+    Args:
+        value: author text
+
+    Returns: author with name and pseudonym if there is one
+    """
+    if value.endswith(")") and " (" in value:
+        name, pseudonym = value[:-1].split(" (", 1)
+        return {"name": name.strip(), "pseudonym": pseudonym.strip()}
+    return {"name": value}
+
+
+def parse_date(value) -> datetime.datetime:
+    """
+    Parse a published date written as YYYY/MM/DD or ISO 8601
+
+    Args:
+        value: date text or datetime
+
+    Returns: The date
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if not isinstance(value, str):
+        raise BadRow(f"published_date {value!r} is not a date")
+    for date_format in ["%Y/%m/%d", "%Y-%m-%d"]:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRow(f"published_date {value!r} is not YYYY/MM/DD or ISO 8601")
+
+
+def parse_rows(rows, manifest_path: str, rejects):
+    """
+    Turn manifest rows into book documents, bad rows go to the reject file
+
+    Args:
+        rows: rows from read_manifest
+        manifest_path: path to the manifest, file paths are relative to it
+        rejects: opened reject file
+
+    Returns: Generator of (location in the manifest, book)
+    """
+    if os.path.isdir(manifest_path):
+        base_dir = manifest_path
+    else:
+        base_dir = os.path.dirname(manifest_path)
+    for location, row in rows:
+        if isinstance(row, BadRow):
+            write_reject(rejects, manifest_path, location, None, [str(row)])
+            continue
+        if not isinstance(row, dict):
+            write_reject(
+                rejects, manifest_path, location, row, ["row is not an object"]
+            )
+            continue
+        try:
+            if "published_date" in row:
+                row["published_date"] = parse_date(row["published_date"])
+        except BadRow as error_message:
+            write_reject(rejects, manifest_path, location, row, [str(error_message)])
+            continue
+        if "file_path" in row and not isinstance(row["file_path"], str):
+            write_reject(
+                rejects, manifest_path, location, row, ["file_path is not a string"]
+            )
+            continue
+        if "file_path" in row and not os.path.isabs(row["file_path"]):
+            row["file_path"] = os.path.join(base_dir, row["file_path"])
+        if "file_path" in row and "file_name" not in row:
+            row["file_name"] = os.path.basename(row["file_path"])
+        yield location, row
+
+
+def validate_rows(books, manifest_path: str, rejects, validator):
+    """
+    Drop books that fail client side validation to the reject file
+
+    Args:
+        books: (location, book) from parse_rows
+        manifest_path: path to the manifest
+        rejects: opened reject file
+        validator: function returning the list of violations of a book
+
+    Returns: Generator of valid books
+    """
+    for location, book in books:
+        errors = validator(book)
+        if "file_path" not in book:
+            errors.append("file_path is required")
+        if errors:
+            write_reject(rejects, manifest_path, location, book, errors)
+            continue
+        yield book
+
+
+def batched(books, batch_size: int):
+    """
+    Group books into lists of batch_size
+
+    Args:
+        books: iterable of books
+        batch_size: number of books per batch
+
+    Returns: Generator of lists
+    """
+    batch = []
+    for book in books:
+        batch.append(book)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_reject(rejects, manifest_path: str, location, row, errors: list) -> None:
+    """
+    Write a rejected row to the reject file as one json line
+
+    Args:
+        rejects: opened reject file
+        manifest_path: path to the manifest
+        location: line number or file name in the manifest
+        row: the rejected row
+        errors: why it was rejected
+
+    Returns: None
+    """
+    rejects.write(
+        json.dumps(
+            {
+                "manifest": manifest_path,
+                "location": location,
+                "errors": errors,
+                "row": json.loads(json_util.dumps(row)),
+            }
+        )
+        + "\n"
+    )
+    rejects.flush()
+    return
+
+
+LIST_FIELDS = ["genres", "sub_genres", "main_characters"]
@@ -0,0 +1,218 @@
+import importlib.util
+import json
+import os
+import pymongo
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+
+
+def available_compressors(compressors: list) -> list:
+    """
+    Keep only the wire compressors whose python library is installed,
+    pymongo only warns and silently drops the others
+
+    Args:
+        compressors: compressors in order of preference
+
+    Returns: compressors that can be used
+    """
+    available = []
+    for compressor in compressors:
+        module = COMPRESSOR_MODULES.get(compressor)
+        if module is None:
+            raise ValueError(f"Unknown wire compressor {compressor}")
+        if module == "zlib" or importlib.util.find_spec(module) is not None:
+            available.append(compressor)
+    return available
+
+
+def load_config(config_path: str = None) -> dict:
+    """
+    Load the connection config from the config file and environment variables
+
+    The config file is json with an optional "uri", "profiles",
+    "catalogue_reads", "gridfs_chunk_sizes" and "blob_storage", each
+    profile is merged over DEFAULT_PROFILES, catalogue_reads over
+    DEFAULT_CATALOGUE_READS and blob_storage over DEFAULT_BLOB_STORAGE,
+    gridfs_chunk_sizes replaces DEFAULT_GRIDFS_CHUNK_SIZES. Environment
+    variables override the file.
+
+    Args:
+        config_path: path to the config file, MONGO_CONFIG or ./mongo_config.json
+            if not given
+
+    Returns: {"uri": str, "profiles": {name: settings}, "catalogue_reads": settings,
+        "gridfs_chunk_sizes": list of size classes, "blob_storage": settings}
+    """
+    if config_path is None:
+        config_path = os.environ.get("MONGO_CONFIG", DEFAULT_CONFIG_PATH)
+    file_config = {}
+    if os.path.isfile(config_path):
+        with open(config_path, "r", encoding="utf-8") as infile:
+            file_config = json.load(infile)
+
+    profiles = {}
+    for name in DEFAULT_PROFILES.keys() | file_config.get("profiles", {}).keys():
+        profile = dict(DEFAULT_PROFILES.get(name, DEFAULT_PROFILES["interactive"]))
+        profile.update(file_config.get("profiles", {}).get(name, {}))
+        if "MONGO_COMPRESSORS" in os.environ:
+            profile["compressors"] = os.environ["MONGO_COMPRESSORS"].split(",")
+        if "MONGO_MAX_POOL_SIZE" in os.environ:
+            profile["maxPoolSize"] = int(os.environ["MONGO_MAX_POOL_SIZE"])
+        if "MONGO_MIN_POOL_SIZE" in os.environ:
+            profile["minPoolSize"] = int(os.environ["MONGO_MIN_POOL_SIZE"])
+        profiles[name] = profile
+
+    catalogue_reads = dict(DEFAULT_CATALOGUE_READS)
+    catalogue_reads.update(file_config.get("catalogue_reads", {}))
+    if "MONGO_MAX_STALENESS" in os.environ:
+        catalogue_reads["maxStalenessSeconds"] = int(os.environ["MONGO_MAX_STALENESS"])
+
+    blob_storage = dict(DEFAULT_BLOB_STORAGE)
+    blob_storage.update(file_config.get("blob_storage", {}))
+    if "BLOB_BACKEND" in os.environ:
+        blob_storage["backend"] = os.environ["BLOB_BACKEND"]
+
+    return {
+        "uri": os.environ.get("MONGO_URI", file_config.get("uri", DEFAULT_URI)),
+        "profiles": profiles,
+        "catalogue_reads": catalogue_reads,
+        "gridfs_chunk_sizes": file_config.get(
+            "gridfs_chunk_sizes", DEFAULT_GRIDFS_CHUNK_SIZES
+        ),
+        "blob_storage": blob_storage,
+    }
+
+
+def client_options(profile: str = "interactive", config: dict = None) -> dict:
+    """
+    Get the MongoClient keyword arguments of a profile
+
+    Args:
+        profile: name of the profile
+        config: config from load_config, loaded if not given
+
+    Returns: keyword arguments for pymongo.MongoClient
+    """
+    if config is None:
+        config = load_config()
+    if profile not in config["profiles"]:
+        raise ValueError(f"Unknown connection profile {profile}")
+    options = dict(config["profiles"][profile])
+    compressors = available_compressors(options.pop("compressors", []))
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    options.setdefault("appname", f"books-{profile}")
+    return options
+
+
+def get_client(
+    profile: str = "interactive", config: dict = None
+) -> pymongo.MongoClient:
+    """
+    Create a MongoClient with the settings of a profile
+
+    Args:
+        profile: "interactive", "search", "bulk_load" or a profile from the config file
+        config: config from load_config, loaded if not given
+
+    Returns: The MongoClient
+    """
+    if config is None:
+        config = load_config()
+    return pymongo.MongoClient(
+        config["uri"], **client_options(profile=profile, config=config)
+    )
+
+
+def catalogue_reads(
+    db: pymongo.mongo_client.database.Database, config: dict = None
+) -> pymongo.mongo_client.database.Database:
+    """
+    Get the database for read-only catalogue traffic (listing and searching
+    books), it reads from a secondary that is at most maxStalenessSeconds
+    behind the primary and from the primary when there is none. Reads are
+    majority read concern, so with the majority writes of the interactive
+    profile a causally consistent session still sees its own writes.
+    Edits, deletes and the reads they depend on use db itself.
+
+    Args:
+        db: database of the primary client
+        config: config from load_config, the config loaded on first use if
+            not given
+
+    Returns: The database with the catalogue read preference
+    """
+    global _CATALOGUE_READS
+    if config is not None:
+        settings = config["catalogue_reads"]
+    else:
+        # every page, count and prefetch reads through here
+        if _CATALOGUE_READS is None:
+            _CATALOGUE_READS = load_config()["catalogue_reads"]
+        settings = _CATALOGUE_READS
+    if not settings.get("secondary", True):
+        return db
+    # hedged reads are only sent by mongos, a replica set ignores them
+    hedge = {"enabled": True} if settings.get("hedge") else None
+    return db.with_options(
+        read_preference=SecondaryPreferred(
+            max_staleness=settings.get("maxStalenessSeconds", -1), hedge=hedge
+        ),
+        read_concern=ReadConcern("majority"),
+    )
+
+
+COMPRESSOR_MODULES = {
+    "zstd": "zstandard",
+    "snappy": "snappy",
+    "zlib": "zlib",
+}
+DEFAULT_PROFILES = {
+    # menu of main.py, one user at a time
+    "interactive": {
+        "compressors": ["zstd", "snappy", "zlib"],
+        "maxPoolSize": 10,
+        "minPoolSize": 1,
+        "w": "majority",
+    },
+    # search traffic, read from secondaries when there are any
+    "search": {
+        "compressors": ["zstd", "snappy", "zlib"],
+        "maxPoolSize": 50,
+        "minPoolSize": 5,
+        "readPreference": "secondaryPreferred",
+    },
+    # bulk_loader.py, big batches acknowledged by the primary only
+    "bulk_load": {
+        "compressors": ["zstd", "snappy", "zlib"],
+        "maxPoolSize": 20,
+        "minPoolSize": 0,
+        "w": 1,
+        "journal": True,
+    },
+}
+# maxStalenessSeconds can not be less than 90
+DEFAULT_CATALOGUE_READS = {
+    "secondary": True,
+    "maxStalenessSeconds": 90,
+    "hedge": True,
+}
+# GridFS chunk size by file size, the first class whose max_mb the file
+# fits in is used and a max_mb of None fits every file. Bigger chunks mean
+# fewer documents and index keys in fs.chunks for big PDFs, small EPUBs keep
+# the GridFS default so a read of the start of a file stays small
+DEFAULT_GRIDFS_CHUNK_SIZES = [
+    {"max_mb": 1, "chunk_kb": 255},
+    {"max_mb": 16, "chunk_kb": 1024},
+    {"max_mb": None, "chunk_kb": 4096},
+]
+# where new book files are stored, "gridfs" or "filesystem" under root
+DEFAULT_BLOB_STORAGE = {
+    "backend": "gridfs",
+    "root": "./blobs",
+}
+DEFAULT_URI = "mongodb://localhost:27017/"
+DEFAULT_CONFIG_PATH = "./mongo_config.json"
+# catalogue_reads of the config, loaded on first use
+_CATALOGUE_READS = None
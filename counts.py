@@ -0,0 +1,111 @@
+import collections
+import hashlib
+import threading
+import time
+import pymongo
+from bson import json_util
+from connection import catalogue_reads
+
+
+def filter_key(filter_dict: dict) -> str:
+    """
+    Get a hash of a filter that is the same for equal filters, dates and
+    ObjectIds are written in extended JSON so they hash like the server
+    compares them
+
+    Args:
+        filter_dict: the filter
+
+    Returns: hex digest of the filter
+    """
+    canonical = json_util.dumps(filter_dict, sort_keys=True)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def count_books(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict = None,
+    hint: list = None,
+    cap: int = None,
+) -> tuple:
+    """
+    Count the books of a list for its page header. Every book is counted
+    from the collection metadata without reading any, a filter is counted
+    once and cached until a write path calls invalidate or COUNT_SECONDS
+    pass, for writes of other processes. With a cap the server stops
+    counting after cap books
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        filter_dict: filter of the books, None or {} for every book
+        hint: index to count with, None to let the server choose
+        cap: count at most this many books, None to count every match
+
+    Returns: (count, True if there are more than count books)
+    """
+    if not filter_dict:
+        return db.books.estimated_document_count(), False
+    key = (filter_key(filter_dict), cap)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None and time.monotonic() - cached[2] < COUNT_SECONDS:
+            _CACHE.move_to_end(key)
+            return cached[0], cached[1]
+        generation = _GENERATION
+    options = {"hint": hint} if hint is not None else {}
+    if cap is None:
+        count = catalogue_reads(db).books.count_documents(
+            filter_dict, session=session, **options
+        )
+        more = False
+    else:
+        # $limit before $count so the server stops after cap + 1 matches
+        result = list(
+            catalogue_reads(db).books.aggregate(
+                [
+                    {"$match": filter_dict},
+                    {"$limit": cap + 1},
+                    {"$count": "count"},
+                ],
+                session=session,
+                **options,
+            )
+        )
+        count = result[0]["count"] if result else 0
+        more = count > cap
+        count = min(count, cap)
+    with _CACHE_LOCK:
+        # a write during the count made it stale, do not keep it
+        if generation == _GENERATION:
+            _CACHE[key] = (count, more, time.monotonic())
+            _CACHE.move_to_end(key)
+            while len(_CACHE) > CACHE_MAX_ENTRIES:
+                _CACHE.popitem(last=False)
+    return count, more
+
+
+def invalidate() -> None:
+    """
+    Drop every cached count, called by the write paths. A write can change
+    the count of any filter so no cached count is kept
+
+    Returns: None
+    """
+    global _GENERATION
+    with _CACHE_LOCK:
+        _CACHE.clear()
+        _GENERATION += 1
+    return
+
+
+# the "more than" cap of searches, a search that matches more books shows
+# "more than COUNT_CAP books" instead of counting every match
+COUNT_CAP = 1000
+COUNT_SECONDS = 60
+CACHE_MAX_ENTRIES = 256
+_CACHE = collections.OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_GENERATION = 0
@@ -0,0 +1,254 @@
+import collections
+import io
+import threading
+import bson
+import pymongo
+import book_text
+import epub
+from connection import catalogue_reads
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def pdf_cover(pdf_path: str) -> tuple | None:
+    """
+    Read the biggest image of the first page of a PDF as its cover, needs
+    pypdf. Rendering the page itself needs a PDF renderer, which is not
+    available in pure python
+
+    Args:
+        pdf_path: path to the PDF
+
+    Returns: (media type, image bytes) or None if there is no image
+    """
+    if pypdf is None:
+        return None
+    reader = pypdf.PdfReader(pdf_path)
+    if not reader.pages:
+        return None
+    try:
+        images = list(reader.pages[0].images)
+    except Exception:
+        # images pypdf can not decode without extra libraries
+        return None
+    if not images:
+        return None
+    image = max(images, key=lambda image: len(image.data))
+    extension = image.name.rsplit(".", 1)[-1].lower()
+    return MEDIA_TYPES.get(extension, "application/octet-stream"), image.data
+
+
+def make_thumbnail(media_type: str, data: bytes) -> dict | None:
+    """
+    Shrink a cover to fit THUMBNAIL_SIZE as JPEG, needs Pillow. Without
+    Pillow a cover up to MAX_COVER_BYTES is kept as it is
+
+    Args:
+        media_type: media type of the image
+        data: image bytes
+
+    Returns: cover with media_type, data, width and height or None if the
+        cover is too big to keep
+    """
+    if Image is None:
+        if len(data) > MAX_COVER_BYTES:
+            return None
+        return {"media_type": media_type, "data": data, "width": 0, "height": 0}
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail(THUMBNAIL_SIZE)
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    except OSError:
+        return None
+    return {
+        "media_type": "image/jpeg",
+        "data": output.getvalue(),
+        "width": image.width,
+        "height": image.height,
+    }
+
+
+def extract_cover(file_path: str) -> dict | None:
+    """
+    Extract the thumbnail of the cover of a book file, run in a worker
+    process
+
+    Args:
+        file_path: path to the EPUB or PDF
+
+    Returns: cover from make_thumbnail or None if the book has no cover
+    """
+    try:
+        if file_path[-5:] == ".epub":
+            cover = epub.read_cover(file_path)
+        elif file_path[-4:] == ".pdf":
+            cover = pdf_cover(file_path)
+        else:
+            return None
+    except (epub.BadPackage, OSError, ValueError):
+        return None
+    if cover is None:
+        return None
+    return make_thumbnail(*cover)
+
+
+def store_cover(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    cover: dict | None,
+) -> None:
+    """
+    Replace the stored cover of a book, the covers collection is keyed by
+    the _id of the book
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+        cover: cover from extract_cover, None to delete the stored cover
+
+    Returns: None
+    """
+    if cover is None:
+        db.covers.delete_one({"_id": book_id})
+    else:
+        cover = dict(cover, _id=book_id, data=bson.Binary(cover["data"]))
+        db.covers.replace_one({"_id": book_id}, cover, upsert=True)
+    invalidate(book_id)
+    return
+
+
+def schedule_cover(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    file_path: str,
+) -> None:
+    """
+    Extract the cover of an uploaded book in the process pool of book_text
+    and store it when it is done, the caller does not wait
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+        file_path: path to the uploaded file
+
+    Returns: None
+    """
+
+    def store_when_done(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        store_cover(db=db, book_id=book_id, cover=future.result())
+
+    future = book_text.get_pool().submit(extract_cover, file_path)
+    future.add_done_callback(store_when_done)
+    return
+
+
+def delete_cover(*, db: pymongo.mongo_client.database.Database, book_id) -> None:
+    """
+    Delete the stored cover of a book
+
+    Args:
+        db: use in which database
+        book_id: id of the book
+
+    Returns: None
+    """
+    store_cover(db=db, book_id=book_id, cover=None)
+    return
+
+
+def invalidate(book_id) -> None:
+    """
+    Drop a cover from the cache
+
+    Args:
+        book_id: id of the book
+
+    Returns: None
+    """
+    global _CACHE_BYTES
+    with _CACHE_LOCK:
+        cover = _CACHE.pop(book_id, None)
+        if cover is not None:
+            _CACHE_BYTES -= len(cover["data"])
+    return
+
+
+def get_covers(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_ids: list,
+) -> dict:
+    """
+    Get the covers of a page of books, the ones that are not in the LRU
+    cache are read with one query
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_ids: ids of the books
+
+    Returns: covers by book id, books without a cover are left out
+    """
+    global _CACHE_BYTES
+    covers = {}
+    with _CACHE_LOCK:
+        for book_id in book_ids:
+            if book_id in _CACHE:
+                _CACHE.move_to_end(book_id)
+                covers[book_id] = _CACHE[book_id]
+    missing = [book_id for book_id in book_ids if book_id not in covers]
+    if not missing:
+        return covers
+    found = catalogue_reads(db).covers.find({"_id": {"$in": missing}}, session=session)
+    with _CACHE_LOCK:
+        for cover in found:
+            book_id = cover.pop("_id")
+            cover["data"] = bytes(cover["data"])
+            covers[book_id] = cover
+            if book_id not in _CACHE:
+                _CACHE[book_id] = cover
+                _CACHE_BYTES += len(cover["data"])
+        while _CACHE_BYTES > CACHE_MAX_BYTES and _CACHE:
+            _, evicted = _CACHE.popitem(last=False)
+            _CACHE_BYTES -= len(evicted["data"])
+    return covers
+
+
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "jp2": "image/jp2",
+    "tif": "image/tiff",
+    "tiff": "image/tiff",
+}
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/jp2": ".jp2",
+    "image/tiff": ".tif",
+}
+THUMBNAIL_SIZE = (200, 300)
+THUMBNAIL_QUALITY = 80
+MAX_COVER_BYTES = 256 * 1024
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+_CACHE = collections.OrderedDict()
+_CACHE_BYTES = 0
+_CACHE_LOCK = threading.Lock()
@@ -0,0 +1,282 @@
+import datetime
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from html.parser import HTMLParser
+
+
+class BadPackage(Exception):
+    """EPUB package document is missing or invalid"""
+
+
+class TextExtractor(HTMLParser):
+    """Collect the visible text of an XHTML document"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skip > 0:
+            self.skip -= 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip == 0:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        """
+        Get the collected text with one paragraph per line
+
+        Returns: The text
+        """
+        lines = (" ".join(line.split()) for line in "".join(self.parts).split("\n"))
+        return "\n".join(line for line in lines if line)
+
+
+def read_package(epub_file: zipfile.ZipFile) -> tuple:
+    """
+    Find and parse the OPF package document of an EPUB
+
+    Args:
+        epub_file: opened EPUB
+
+    Returns: (path of the package document in the EPUB, its root element)
+    """
+    try:
+        container = ElementTree.fromstring(epub_file.read("META-INF/container.xml"))
+        rootfile = container.find(".//container:rootfile", NAMESPACES)
+        opf_path = rootfile.get("full-path")
+        package = ElementTree.fromstring(epub_file.read(opf_path))
+    except (KeyError, AttributeError, ElementTree.ParseError) as error_message:
+        raise BadPackage(f"invalid EPUB package: {error_message}")
+    return opf_path, package
+
+
+def manifest_items(opf_path: str, package) -> dict:
+    """
+    Get the items of the package manifest
+
+    Args:
+        opf_path: path of the package document, hrefs are relative to it
+        package: root element of the package document
+
+    Returns: items by id with the path in the EPUB, media-type and properties
+    """
+    base = posixpath.dirname(opf_path)
+    items = {}
+    for item in package.findall("opf:manifest/opf:item", NAMESPACES):
+        items[item.get("id")] = {
+            "path": posixpath.normpath(posixpath.join(base, item.get("href", ""))),
+            "media_type": item.get("media-type", ""),
+            "properties": item.get("properties", "").split(),
+        }
+    return items
+
+
+def parse_opf_date(value: str) -> datetime.datetime | None:
+    """
+    Parse a dc:date, which can be YYYY, YYYY-MM, YYYY-MM-DD or a full timestamp
+
+    Args:
+        value: text of dc:date
+
+    Returns: The date or None if it can not be parsed
+    """
+    value = value.strip()
+    for date_format, length in [("%Y-%m-%d", 10), ("%Y-%m", 7), ("%Y", 4)]:
+        try:
+            return datetime.datetime.strptime(value[:length], date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def character_name(subject: str) -> str | None:
+    """
+    Get the character of a "Last, First (Fictitious character)" subject
+
+    Args:
+        subject: text of dc:subject
+
+    Returns: "First Last" or None if the subject is not a character
+    """
+    match = re.match(r"^(.*?)\s*\(Fictitious character\)", subject)
+    if match is None:
+        return None
+    name = match.group(1)
+    if ", " in name:
+        last, first = name.split(", ", 1)
+        name = f"{first} {last}"
+    return name
+
+
+def read_metadata(epub_path: str) -> dict:
+    """
+    Read the book document fields from the dc: metadata of the OPF package
+    document, fields that are not in the EPUB are left out except the
+    lists, which are empty, and ISBN, which is "N/A" like in BOOKS_DATA
+
+    Args:
+        epub_path: path to the EPUB
+
+    Returns: book fields
+    """
+    try:
+        with zipfile.ZipFile(epub_path) as epub_file:
+            _, package = read_package(epub_file)
+    except zipfile.BadZipFile as error_message:
+        raise BadPackage(f"invalid EPUB: {error_message}")
+    metadata = package.find("opf:metadata", NAMESPACES)
+    if metadata is None:
+        raise BadPackage("EPUB package has no metadata")
+
+    def texts(tag):
+        return [
+            " ".join(element.text.split())
+            for element in metadata.findall(f"dc:{tag}", NAMESPACES)
+            if element.text and element.text.strip()
+        ]
+
+    # EPUB 3 puts the role of a creator in a refining meta element
+    roles = {
+        meta.get("refines", "").lstrip("#"): (meta.text or "").strip()
+        for meta in metadata.findall("opf:meta[@property='role']", NAMESPACES)
+    }
+    book = {}
+    titles = texts("title")
+    if titles:
+        book["title"] = titles[0]
+    authors = []
+    for creator in metadata.findall("dc:creator", NAMESPACES):
+        role = creator.get(f"{{{NAMESPACES['opf']}}}role")
+        if role is None:
+            role = roles.get(creator.get("id"))
+        if creator.text and creator.text.strip() and role in [None, "", "aut"]:
+            authors.append({"name": " ".join(creator.text.split())})
+    if authors:
+        book["author"] = authors
+    languages = texts("language")
+    if languages:
+        book["language"] = LANGUAGE_NAMES.get(languages[0].lower(), languages[0])
+    for date in texts("date"):
+        published_date = parse_opf_date(date)
+        if published_date is not None:
+            book["published_date"] = published_date
+            break
+    book["ISBN"] = "N/A"
+    for identifier in metadata.findall("dc:identifier", NAMESPACES):
+        scheme = identifier.get(f"{{{NAMESPACES['opf']}}}scheme", "")
+        value = (identifier.text or "").strip()
+        if scheme.upper() == "ISBN" or value.lower().startswith("urn:isbn:"):
+            book["ISBN"] = re.sub(r"^urn:isbn:", "", value, flags=re.IGNORECASE)
+            break
+    book["genres"] = []
+    book["sub_genres"] = []
+    book["main_characters"] = []
+    for subject in texts("subject"):
+        character = character_name(subject)
+        if character is not None:
+            book["main_characters"].append(character)
+        else:
+            genre = re.sub(r"\s*--\s*Fiction$", "", subject)
+            if genre not in book["genres"]:
+                book["genres"].append(genre)
+    rights = texts("rights")
+    if rights:
+        book["copy_right"] = rights[0]
+    return book
+
+
+def read_cover(epub_path: str) -> tuple | None:
+    """
+    Read the cover image of an EPUB, the manifest item with the EPUB 3
+    cover-image property or the item named by the EPUB 2 <meta name="cover">
+
+    Args:
+        epub_path: path to the EPUB
+
+    Returns: (media type, image bytes) or None if the EPUB has no cover
+    """
+    with zipfile.ZipFile(epub_path) as epub_file:
+        opf_path, package = read_package(epub_file)
+        items = manifest_items(opf_path, package)
+        cover = None
+        for item in items.values():
+            if "cover-image" in item["properties"]:
+                cover = item
+                break
+        if cover is None:
+            meta = package.find("opf:metadata/opf:meta[@name='cover']", NAMESPACES)
+            if meta is not None:
+                cover = items.get(meta.get("content"))
+        if cover is None or not cover["media_type"].startswith("image/"):
+            return None
+        try:
+            return cover["media_type"], epub_file.read(cover["path"])
+        except KeyError:
+            return None
+
+
+def iter_epub_text(epub_path: str):
+    """
+    Read the text of an EPUB in reading order one spine item at a time
+
+    Args:
+        epub_path: path to the EPUB
+
+    Returns: Generator of (path of the spine item, text)
+    """
+    with zipfile.ZipFile(epub_path) as epub_file:
+        opf_path, package = read_package(epub_file)
+        items = manifest_items(opf_path, package)
+        for itemref in package.findall("opf:spine/opf:itemref", NAMESPACES):
+            item = items.get(itemref.get("idref"))
+            if item is None or item["media_type"] not in TEXT_MEDIA_TYPES:
+                continue
+            try:
+                content = epub_file.read(item["path"])
+            except KeyError:
+                continue
+            extractor = TextExtractor()
+            extractor.feed(content.decode("utf-8", errors="replace"))
+            extractor.close()
+            text = extractor.text()
+            if text:
+                yield item["path"], text
+
+
+NAMESPACES = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+LANGUAGE_NAMES = {
+    "en": "English",
+    "fr": "French",
+    "de": "German",
+    "es": "Spanish",
+    "it": "Italian",
+    "pt": "Portuguese",
+    "nl": "Dutch",
+    "ru": "Russian",
+    "ja": "Japanese",
+    "zh": "Chinese",
+    "th": "Thai",
+}
+TEXT_MEDIA_TYPES = ["application/xhtml+xml", "text/html"]
+SKIP_TAGS = ["script", "style", "head"]
+BLOCK_TAGS = [
+    "p", "div", "br", "h1", "h2", "h3", "h4", "h5", "h6", "li", "tr",
+    "blockquote", "section", "pre",
+]
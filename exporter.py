@@ -0,0 +1,450 @@
+#! /usr/bin/env python3
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+import sys
+import time
+import pymongo
+from bson import json_util
+from connection import get_client
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def split_id_ranges(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict,
+    parts: int,
+) -> list:
+    """
+    Split the books into _id ranges of about the same size from a sample of
+    _id, so every worker scans its own part of the _id index
+
+    Args:
+        db: use in which database
+        filter_dict: filter of the books to export
+        parts: number of ranges
+
+    Returns: list of (lower, upper) _id bounds, None means unbounded
+    """
+    if parts <= 1:
+        return [(None, None)]
+    sample = db.books.aggregate(
+        [
+            {"$match": filter_dict},
+            {"$sample": {"size": parts * SAMPLES_PER_PART}},
+            {"$project": {"_id": 1}},
+            {"$sort": {"_id": 1}},
+        ]
+    )
+    ids = [book["_id"] for book in sample]
+    if len(ids) < parts:
+        return [(None, None)]
+    bounds = [ids[len(ids) * i // parts] for i in range(1, parts)]
+    bounds = sorted(set(bounds))
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def iter_books(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict,
+    fields: list,
+    lower=None,
+    upper=None,
+    batch_size: int = 5000,
+):
+    """
+    Stream books of an _id range in _id order with a projection
+
+    Args:
+        db: use in which database
+        filter_dict: filter of the books to export
+        fields: fields to export
+        lower: first _id of the range, None for no lower bound
+        upper: _id after the range, None for no upper bound
+        batch_size: number of books per round trip
+
+    Returns: Generator of books
+    """
+    id_range = {}
+    if lower is not None:
+        id_range["$gte"] = lower
+    if upper is not None:
+        id_range["$lt"] = upper
+    query = dict(filter_dict)
+    if id_range:
+        query = {"$and": [filter_dict, {"_id": id_range}]}
+    cursor = db.books.find(
+        query, {field: 1 for field in fields}, batch_size=batch_size
+    ).sort("_id", pymongo.ASCENDING)
+    if id_range:
+        # each worker scans its own range of the _id index, a single export
+        # leaves the planner free to use the index of a selective filter
+        cursor = cursor.hint([("_id", pymongo.ASCENDING)])
+    with cursor:
+        yield from cursor
+
+
+def csv_value(field: str, value) -> str:
+    """
+    Format a value for CSV in the same format bulk_loader --manifest reads
+
+    Args:
+        field: name of the field
+        value: value of the field
+
+    Returns: The text to write
+    """
+    if value is None:
+        return ""
+    if field == "author":
+        return "; ".join(
+            f"{author['name']} ({author['pseudonym']})"
+            if "pseudonym" in author
+            else author["name"]
+            for author in value
+        )
+    if isinstance(value, list):
+        return "; ".join(str(item) for item in value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y/%m/%d")
+    return str(value)
+
+
+def write_jsonl(books, output_path: str, fields: list) -> int:
+    """
+    Write books as JSON Lines
+
+    Args:
+        books: iterable of books
+        output_path: file to write
+        fields: exported fields
+
+    Returns: number of books written
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as outfile:
+        for book in books:
+            # the projection of find always returns _id
+            book = {field: book[field] for field in fields if field in book}
+            outfile.write(
+                json_util.dumps(book, json_options=json_util.RELAXED_JSON_OPTIONS)
+            )
+            outfile.write("\n")
+            count += 1
+    return count
+
+
+def write_csv(books, output_path: str, fields: list) -> int:
+    """
+    Write books as CSV with a header row that bulk_loader.py --manifest can
+    load back. The fields of STORAGE_FIELDS belong to the stored file of
+    this database and are left out, the file_path column is the file name
+    so the CSV loads the files downloaded next to it by bulk_download.py
+
+    Args:
+        books: iterable of books
+        output_path: file to write
+        fields: exported fields
+
+    Returns: number of books written
+    """
+    fields = [field for field in fields if field not in STORAGE_FIELDS]
+    header = list(fields)
+    if "file_name" in fields:
+        header.append("file_path")
+    count = 0
+    with open(output_path, "w", encoding="utf-8", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(header)
+        for book in books:
+            row = [csv_value(field, book.get(field)) for field in fields]
+            if "file_name" in fields:
+                row.append(os.path.basename(book.get("file_name") or ""))
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def arrow_schema(fields: list):
+    """
+    Get the Arrow schema of the exported fields
+
+    Args:
+        fields: exported fields
+
+    Returns: pyarrow.Schema
+    """
+    types = {
+        "_id": pyarrow.string(),
+        "title": pyarrow.string(),
+        "author": pyarrow.list_(
+            pyarrow.struct(
+                [("name", pyarrow.string()), ("pseudonym", pyarrow.string())]
+            )
+        ),
+        "language": pyarrow.string(),
+        "published_date": pyarrow.timestamp("ms"),
+        "genres": pyarrow.list_(pyarrow.string()),
+        "sub_genres": pyarrow.list_(pyarrow.string()),
+        "main_characters": pyarrow.list_(pyarrow.string()),
+        "file_id": pyarrow.string(),
+    }
+    return pyarrow.schema(
+        [(field, types.get(field, pyarrow.string())) for field in fields]
+    )
+
+
+def arrow_batches(books, fields: list, batch_size: int):
+    """
+    Turn books into Arrow record batches of batch_size rows
+
+    Args:
+        books: iterable of books
+        fields: exported fields
+        batch_size: rows per record batch
+
+    Returns: Generator of pyarrow.RecordBatch
+    """
+    schema = arrow_schema(fields)
+    columns = {field: [] for field in fields}
+    rows = 0
+    for book in books:
+        for field in fields:
+            value = book.get(field)
+            if field in ["_id", "file_id"] and value is not None:
+                value = str(value)
+            columns[field].append(value)
+        rows += 1
+        if rows >= batch_size:
+            yield pyarrow.RecordBatch.from_pydict(columns, schema=schema)
+            columns = {field: [] for field in fields}
+            rows = 0
+    if rows:
+        yield pyarrow.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def write_parquet(books, output_path: str, fields: list) -> int:
+    """
+    Write books as Parquet, one row group per batch
+
+    Args:
+        books: iterable of books
+        output_path: file to write
+        fields: exported fields
+
+    Returns: number of books written
+    """
+    count = 0
+    with pyarrow.parquet.ParquetWriter(
+        output_path, arrow_schema(fields), compression="zstd"
+    ) as writer:
+        for batch in arrow_batches(books, fields, ARROW_BATCH_SIZE):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+def write_arrow(books, output_path: str, fields: list) -> int:
+    """
+    Write books as an Arrow IPC file
+
+    Args:
+        books: iterable of books
+        output_path: file to write
+        fields: exported fields
+
+    Returns: number of books written
+    """
+    count = 0
+    with pyarrow.ipc.new_file(output_path, arrow_schema(fields)) as writer:
+        for batch in arrow_batches(books, fields, ARROW_BATCH_SIZE):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+def export_part(task: dict) -> int:
+    """
+    Export one _id range, run in a worker process with its own client
+
+    Args:
+        task: output_path, output_format, filter_dict, fields, lower, upper
+            and batch_size
+
+    Returns: number of books written
+    """
+    with get_client("search") as client:
+        db = client.get_database("books")
+        books = iter_books(
+            db=db,
+            filter_dict=task["filter_dict"],
+            fields=task["fields"],
+            lower=task["lower"],
+            upper=task["upper"],
+            batch_size=task["batch_size"],
+        )
+        write = WRITERS[task["output_format"]]
+        return write(books, task["output_path"], task["fields"])
+
+
+def part_path(output_path: str, part: int, parts: int) -> str:
+    """
+    Get the file name of one part of the export
+
+    Args:
+        output_path: requested output file
+        part: number of the part
+        parts: number of parts
+
+    Returns: output_path itself for a single part or name.partN.ext
+    """
+    if parts == 1:
+        return output_path
+    name, extension = os.path.splitext(output_path)
+    return f"{name}.part{part}{extension}"
+
+
+def export_books(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    output_path: str,
+    output_format: str,
+    filter_dict: dict = None,
+    fields: list = None,
+    workers: int = 1,
+    batch_size: int = 5000,
+) -> int:
+    """
+    Export books, split across worker processes by _id range
+
+    Args:
+        db: use in which database
+        output_path: file to write
+        output_format: "jsonl", "csv", "parquet" or "arrow"
+        filter_dict: filter of the books to export
+        fields: fields to export
+        workers: number of worker processes
+        batch_size: number of books per round trip
+
+    Returns: number of books written
+    """
+    if output_format in ["parquet", "arrow"] and pyarrow is None:
+        raise RuntimeError(f"pyarrow is required to export {output_format}")
+    if filter_dict is None:
+        filter_dict = {}
+    if fields is None:
+        fields = EXPORT_FIELDS
+    ranges = split_id_ranges(db=db, filter_dict=filter_dict, parts=workers)
+    tasks = [
+        {
+            "output_path": part_path(output_path, part, len(ranges)),
+            "output_format": output_format,
+            "filter_dict": filter_dict,
+            "fields": fields,
+            "lower": lower,
+            "upper": upper,
+            "batch_size": batch_size,
+        }
+        for part, (lower, upper) in enumerate(ranges)
+    ]
+    if len(tasks) == 1:
+        return export_part(tasks[0])
+    # spawn so the workers do not inherit the client of this process
+    with multiprocessing.get_context("spawn").Pool(len(tasks)) as pool:
+        return sum(pool.map(export_part, tasks))
+
+
+def main():
+    """
+    Main function to run the export
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Export the books collection")
+    parser.add_argument(
+        "output", help="file to write, split into .partN files with --workers"
+    )
+    parser.add_argument(
+        "--format", choices=list(WRITERS), help="default from the output extension"
+    )
+    parser.add_argument(
+        "--filter", default="{}", help="extended json filter of the books to export"
+    )
+    parser.add_argument(
+        "--fields", default=",".join(EXPORT_FIELDS), help="comma separated fields"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        output_format = os.path.splitext(args.output)[1].lstrip(".")
+    if output_format not in WRITERS:
+        print(f"Unknown export format {output_format}")
+        return EXIT_FAILURE
+
+    start = time.perf_counter()
+    with get_client("search") as client:
+        db = client.get_database("books")
+        try:
+            count = export_books(
+                db=db,
+                output_path=args.output,
+                output_format=output_format,
+                filter_dict=json_util.loads(args.filter),
+                fields=args.fields.split(","),
+                workers=args.workers,
+                batch_size=args.batch_size,
+            )
+        except RuntimeError as error_message:
+            print(error_message)
+            return EXIT_FAILURE
+    elapsed = time.perf_counter() - start
+    rate = count / max(elapsed, 1e-9)
+    print(f"Exported {count} books in {elapsed:.1f}s ({rate:.0f} books/s)")
+    return EXIT_SUCCESS
+
+
+WRITERS = {
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+EXPORT_FIELDS = [
+    "_id",
+    "title",
+    "author",
+    "language",
+    "published_date",
+    "genres",
+    "sub_genres",
+    "main_characters",
+    "set_year",
+    "set_main_location",
+    "copy_right",
+    "ISBN",
+    "file_name",
+    "file_type",
+    "file_id",
+    "storage_uri",
+]
+# fields of the stored file, a loaded book gets new ones when it is uploaded
+STORAGE_FIELDS = ["_id", "file_id", "storage_uri"]
+ARROW_BATCH_SIZE = 10000
+SAMPLES_PER_PART = 100
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
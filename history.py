@@ -0,0 +1,525 @@
+#! /usr/bin/env python3
+import argparse
+import datetime
+import sys
+import bson
+import pymongo
+from bson import json_util
+from connection import get_client
+
+
+def partition_name(when: datetime.datetime) -> str:
+    """
+    Get the name of the history partition of a month
+
+    Args:
+        when: a time in the month
+
+    Returns: books_history_YYYY_MM
+    """
+    return f"{HISTORY_PREFIX}{when.year:04d}_{when.month:02d}"
+
+
+def partition_month(name: str) -> datetime.datetime | None:
+    """
+    Get the month of a history partition from its name
+
+    Args:
+        name: name of a collection
+
+    Returns: first day of the month or None if it is not a history partition
+    """
+    if not name.startswith(HISTORY_PREFIX):
+        return None
+    try:
+        return datetime.datetime.strptime(name[len(HISTORY_PREFIX) :], "%Y_%m")
+    except ValueError:
+        return None
+
+
+def list_partitions(db: pymongo.mongo_client.database.Database) -> list:
+    """
+    Get the history partitions, newest first
+
+    Args:
+        db: use in which database
+
+    Returns: list of (month, collection name)
+    """
+    partitions = []
+    for name in db.list_collection_names():
+        month = partition_month(name)
+        if month is not None:
+            partitions.append((month, name))
+    partitions.sort(reverse=True)
+    return partitions
+
+
+def ensure_partition(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    when: datetime.datetime,
+) -> str:
+    """
+    Create the partition of a month with its index before the first change
+    of the month is written, a collection can not be created with its index
+    inside a transaction. Creating a partition also drops the partitions
+    older than HISTORY_MONTHS
+
+    Args:
+        db: use in which database
+        when: time of the change
+
+    Returns: name of the partition
+    """
+    name = partition_name(when)
+    if name in _PARTITIONS:
+        return name
+    if name not in db.list_collection_names():
+        # creating the index creates the collection
+        db.get_collection(name).create_index([("book_id", 1), ("time", -1)])
+        prune(db=db, now=when)
+    _PARTITIONS.add(name)
+    return name
+
+
+def prune(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    now: datetime.datetime,
+    months: int = None,
+) -> list:
+    """
+    Drop the history partitions older than the retention, dropping a whole
+    month is cheaper than expiring its changes one by one. It runs when the
+    first change of a month creates its partition and from the prune command
+
+    Args:
+        db: use in which database
+        now: current time
+        months: months of history to keep, HISTORY_MONTHS if None
+
+    Returns: names of the dropped partitions
+    """
+    if months is None:
+        months = HISTORY_MONTHS
+    month_index = now.year * 12 + now.month - 1 - (months - 1)
+    oldest = datetime.datetime(month_index // 12, month_index % 12 + 1, 1)
+    dropped = []
+    for month, name in list_partitions(db):
+        if month < oldest:
+            db.drop_collection(name)
+            _PARTITIONS.discard(name)
+            dropped.append(name)
+    return dropped
+
+
+def drop_partitions(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> list:
+    """
+    Drop every history partition, when the books are replaced by a restore
+    their history describes changes the restored books do not have
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: names of the dropped partitions
+    """
+    dropped = []
+    for _, name in list_partitions(db):
+        db.drop_collection(name, session=session)
+        dropped.append(name)
+    _PARTITIONS.clear()
+    return dropped
+
+
+def diff(old_book: dict | None, new_book: dict | None) -> dict:
+    """
+    Get the fields that changed between two versions of a book with their
+    old and new values, a field that did not exist has no value
+
+    Args:
+        old_book: the book before the change, None if it was added
+        new_book: the book after the change, None if it was deleted
+
+    Returns: changes by field, {"old": value, "new": value}
+    """
+    old_book = old_book or {}
+    new_book = new_book or {}
+    changes = {}
+    fields = list(old_book) + [field for field in new_book if field not in old_book]
+    for field in fields:
+        if field == "_id":
+            continue
+        if old_book.get(field, _MISSING) == new_book.get(field, _MISSING):
+            continue
+        change = {}
+        if field in old_book:
+            change["old"] = old_book[field]
+        if field in new_book:
+            change["new"] = new_book[field]
+        changes[field] = change
+    return changes
+
+
+def supports_transactions(client: pymongo.MongoClient) -> bool:
+    """
+    Check if the server runs transactions, a standalone server does not
+
+    Args:
+        client: client of the server
+
+    Returns: True for a replica set or a sharded cluster
+    """
+    return client.topology_description.topology_type_name != "Single"
+
+
+def write_change(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_filter: dict,
+    change,
+    action: str,
+):
+    """
+    Change a book and append the diff to the history in one transaction, on
+    a standalone server the two writes are done one after the other
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_filter: filter of the book, with its _id
+        change: function(session) that changes the book and returns it as
+            it is after the change, None if it was deleted
+        action: "add", "edit" or "delete"
+
+    Returns: The book after the change
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    history = db.get_collection(ensure_partition(db=db, when=now))
+
+    def write(write_session):
+        old_book = None
+        if action != "add":
+            old_book = db.books.find_one(book_filter, session=write_session)
+            if old_book is None:
+                return None
+        new_book = change(write_session)
+        # an added book is not copied, only that it did not exist before
+        changes = diff(old_book, new_book) if action != "add" else {}
+        if changes or action != "edit":
+            history.insert_one(
+                {
+                    "book_id": book_filter["_id"],
+                    "time": now,
+                    "action": action,
+                    "changes": changes,
+                },
+                session=write_session,
+            )
+        return new_book
+
+    if supports_transactions(db.client):
+        return session.with_transaction(write)
+    return write(session)
+
+
+def record_changes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    changes: list,
+) -> None:
+    """
+    Append the changes of writes that did not go through write_change, the
+    bulk loader writes a whole batch of books with one bulk_write
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        changes: list of (action, book before, book after), the books have
+            their _id
+
+    Returns: None
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    records = []
+    for action, old_book, new_book in changes:
+        book_changes = diff(old_book, new_book) if action != "add" else {}
+        if not book_changes and action == "edit":
+            continue
+        records.append(
+            {
+                "book_id": (new_book or old_book)["_id"],
+                "time": now,
+                "action": action,
+                "changes": book_changes,
+            }
+        )
+    if records:
+        history = db.get_collection(ensure_partition(db=db, when=now))
+        history.insert_many(records, ordered=False, session=session)
+    return
+
+
+def update_book(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_filter: dict,
+    update: dict,
+) -> dict | None:
+    """
+    Update a book and record the fields that changed
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_filter: filter of the book, with its _id
+        update: the update
+
+    Returns: The book after the update, None if it does not exist
+    """
+    return write_change(
+        session=session,
+        db=db,
+        book_filter=book_filter,
+        change=lambda write_session: db.books.find_one_and_update(
+            book_filter,
+            update,
+            return_document=pymongo.ReturnDocument.AFTER,
+            session=write_session,
+        ),
+        action="edit",
+    )
+
+
+def insert_book(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+) -> None:
+    """
+    Insert a book and record that it was added, the book itself is not
+    copied to the history
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: the book, it gets an _id if it has none
+
+    Returns: None
+    """
+    book.setdefault("_id", bson.ObjectId())
+
+    def insert(write_session):
+        db.books.insert_one(book, session=write_session)
+        return book
+
+    write_change(
+        session=session,
+        db=db,
+        book_filter={"_id": book["_id"]},
+        change=insert,
+        action="add",
+    )
+    return
+
+
+def delete_book(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_filter: dict,
+) -> None:
+    """
+    Delete a book and record its fields so it can be reconstructed
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_filter: filter of the book, with its _id
+
+    Returns: None
+    """
+
+    def delete(write_session):
+        db.books.delete_one(book_filter, session=write_session)
+        return None
+
+    write_change(
+        session=session, db=db, book_filter=book_filter, change=delete, action="delete"
+    )
+    return
+
+
+def iter_changes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    since: datetime.datetime = None,
+):
+    """
+    Stream the changes of a book newest first, one partition at a time
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_id: id of the book
+        since: only the changes after this time, None for every change
+
+    Returns: Generator of history documents
+    """
+    for month, name in list_partitions(db):
+        history_filter = {"book_id": book_id}
+        if since is not None:
+            # the partitions of the months before since have nothing newer
+            if month.year * 12 + month.month < since.year * 12 + since.month:
+                break
+            history_filter["time"] = {"$gt": since}
+        yield from db.get_collection(name).find(
+            history_filter, session=session
+        ).sort([("time", -1), ("_id", -1)])
+
+
+def changed_since(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    since: datetime.datetime,
+) -> tuple:
+    """
+    Get the books that were added, edited or deleted after a time, for
+    incremental backups
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        since: the time, UTC
+
+    Returns: (set of ids of the added or edited books, file ids of the
+        deleted books by book id)
+    """
+    changed = set()
+    deleted = {}
+    for month, name in list_partitions(db):
+        if month.year * 12 + month.month < since.year * 12 + since.month:
+            break
+        records = db.get_collection(name).find(
+            {"time": {"$gt": since}},
+            {"book_id": 1, "action": 1, "changes.file_id": 1},
+            session=session,
+        )
+        for record in records:
+            if record["action"] == "delete":
+                file_id = record["changes"].get("file_id", {}).get("old")
+                deleted[record["book_id"]] = file_id
+            else:
+                changed.add(record["book_id"])
+    return changed - set(deleted), deleted
+
+
+def book_at(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+    when: datetime.datetime,
+) -> dict | None:
+    """
+    Reconstruct a book as it was at a time by undoing the changes after it
+    on the current book, newest first
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_id: id of the book
+        when: the time, UTC
+
+    Returns: The book or None if it did not exist at that time
+    """
+    book = db.books.find_one({"_id": book_id}, session=session)
+    for record in iter_changes(session=session, db=db, book_id=book_id, since=when):
+        if record["action"] == "add":
+            book = None
+            continue
+        book = dict(book or {"_id": book_id})
+        for field, change in record["changes"].items():
+            if "old" in change:
+                book[field] = change["old"]
+            else:
+                book.pop(field, None)
+    return book
+
+
+def main():
+    """
+    Main function to show the history of a book or a book at a time
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="History of the books")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    show = subparsers.add_parser("show", help="changes of a book, newest first")
+    show.add_argument("book_id")
+    at = subparsers.add_parser("at", help="a book as it was at a time")
+    at.add_argument("book_id")
+    at.add_argument("time", help="UTC time, 2024-05-01 or 2024-05-01T12:30:00")
+    prune_parser = subparsers.add_parser("prune", help="drop old partitions")
+    prune_parser.add_argument("--months", type=int, default=HISTORY_MONTHS)
+    args = parser.parse_args()
+
+    with (
+        get_client("interactive") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books")
+        if args.command == "prune":
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            for name in prune(db=db, now=now, months=args.months):
+                print(f"dropped {name}")
+            return EXIT_SUCCESS
+        try:
+            book_id = bson.ObjectId(args.book_id)
+        except bson.errors.InvalidId:
+            print(f"Invalid book id {args.book_id}")
+            return EXIT_FAILURE
+        if args.command == "show":
+            for record in iter_changes(session=session, db=db, book_id=book_id):
+                print("-" * 79)
+                print(f"{record['time']:%Y-%m-%d %H:%M:%S} {record['action']}")
+                for field, change in record["changes"].items():
+                    old = json_util.dumps(change.get("old"))
+                    new = json_util.dumps(change.get("new"))
+                    print(f"    {field}: {old} -> {new}")
+            return EXIT_SUCCESS
+        try:
+            when = datetime.datetime.fromisoformat(args.time)
+        except ValueError:
+            print(f"Invalid time {args.time}")
+            return EXIT_FAILURE
+        book = book_at(session=session, db=db, book_id=book_id, when=when)
+        if book is None:
+            print("The book did not exist at that time")
+            return EXIT_FAILURE
+        print(json_util.dumps(book, indent=4))
+    return EXIT_SUCCESS
+
+
+HISTORY_PREFIX = "books_history_"
+# months of history to keep, the partition of a month is dropped as a whole
+HISTORY_MONTHS = 24
+# partitions known to exist, so a change does not list the collections
+_PARTITIONS = set()
+_MISSING = object()
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
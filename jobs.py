@@ -0,0 +1,403 @@
+import datetime
+import threading
+import uuid
+import pymongo
+from bson import json_util
+from book_storage import BadEpub
+from schema import BadBook
+
+
+def now_utc() -> datetime.datetime:
+    """
+    Get the current time as the naive UTC datetime MongoDB returns
+
+    Returns: The time
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def ensure_indexes(*, db: pymongo.mongo_client.database.Database) -> None:
+    """
+    Create the indexes of the jobs collection, the queue takes the oldest
+    queued job that is due and the status view shows the newest jobs
+
+    Args:
+        db: use in which database
+
+    Returns: None
+    """
+    db.jobs.create_index([("status", 1), ("run_at", 1), ("_id", 1)])
+    db.jobs.create_index([("created", -1)])
+    return
+
+
+def submit(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    kind: str,
+    title: str,
+    **kwargs,
+):
+    """
+    Add a job to the jobs collection, the job queue of this process or of
+    the next main.py that starts runs it
+
+    Args:
+        db: use in which database
+        kind: name of the runner of the job
+        title: what the status view shows
+        kwargs: arguments of the runner, stored as extended json so filters
+            with $ operators can be stored
+
+    Returns: id of the job
+    """
+    now = now_utc()
+    job_id = db.jobs.insert_one(
+        {
+            "kind": kind,
+            "title": title,
+            "args": json_util.dumps(kwargs),
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": MAX_ATTEMPTS,
+            "progress": {"done": 0, "total": None, "message": None},
+            "created": now,
+            "run_at": now,
+        }
+    ).inserted_id
+    if _QUEUE is not None:
+        _QUEUE.wake.set()
+    return job_id
+
+
+def list_jobs(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    limit: int = None,
+) -> list:
+    """
+    Get the newest jobs
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        limit: number of jobs, JOBS_SHOWN if None
+
+    Returns: list of job documents, newest first
+    """
+    return list(
+        db.jobs.find({}, {"args": 0}, session=session)
+        .sort("created", -1)
+        .limit(limit or JOBS_SHOWN)
+    )
+
+
+def retry_job(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    job_id,
+) -> bool:
+    """
+    Queue a failed job again with all its attempts
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        job_id: id of the job
+
+    Returns: True if the job was failed and is queued again
+    """
+    result = db.jobs.update_one(
+        {"_id": job_id, "status": "failed"},
+        {
+            "$set": {"status": "queued", "attempts": 0, "run_at": now_utc()},
+            "$unset": {"error": ""},
+        },
+        session=session,
+    )
+    if _QUEUE is not None:
+        _QUEUE.wake.set()
+    return result.modified_count == 1
+
+
+def recover(*, db: pymongo.mongo_client.database.Database) -> int:
+    """
+    Queue again the running jobs whose process stopped, a running queue
+    updates the heartbeat of its jobs every HEARTBEAT_SECONDS. A job that
+    used all its attempts fails instead, so a job that stops its process
+    is not run forever
+
+    Args:
+        db: use in which database
+
+    Returns: number of jobs queued again
+    """
+    now = now_utc()
+    stale = now - datetime.timedelta(seconds=STALE_SECONDS)
+    db.jobs.update_many(
+        {
+            "status": "running",
+            "heartbeat": {"$lt": stale},
+            "$expr": {"$gte": ["$attempts", "$max_attempts"]},
+        },
+        {
+            "$set": {
+                "status": "failed",
+                "finished": now,
+                "error": "The process running the job stopped",
+            }
+        },
+    )
+    result = db.jobs.update_many(
+        {"status": "running", "heartbeat": {"$lt": stale}},
+        {"$set": {"status": "queued", "run_at": now}},
+    )
+    return result.modified_count
+
+
+class JobQueue:
+    """Run the jobs of the jobs collection in background threads"""
+
+    def __init__(
+        self,
+        db: pymongo.mongo_client.database.Database,
+        runners: dict,
+        workers: int = None,
+    ):
+        self.db = db
+        self.runners = runners
+        self.owner = uuid.uuid4().hex
+        self.running = set()
+        self.running_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.work, name=f"job{i}", daemon=True)
+            for i in range(workers or JOB_WORKERS)
+        ]
+        self.threads.append(
+            threading.Thread(target=self.beat, name="job-heartbeat", daemon=True)
+        )
+        for thread in self.threads:
+            thread.start()
+
+    def claim(self) -> dict | None:
+        """
+        Take the oldest queued job that is due, the update is atomic so two
+        processes never run the same job
+
+        Returns: The job or None if there is none
+        """
+        now = now_utc()
+        return self.db.jobs.find_one_and_update(
+            {
+                "status": "queued",
+                "run_at": {"$lte": now},
+                "kind": {"$in": list(self.runners)},
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "owner": self.owner,
+                    "started": now,
+                    "heartbeat": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1), ("_id", 1)],
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+
+    def work(self) -> None:
+        """Run jobs until the queue is closed"""
+        while not self.stop.is_set():
+            try:
+                job = self.claim()
+            except pymongo.errors.PyMongoError:
+                job = None
+            if job is None:
+                self.wake.wait(POLL_SECONDS)
+                self.wake.clear()
+                continue
+            with self.running_lock:
+                self.running.add(job["_id"])
+            try:
+                self.run(job)
+            except pymongo.errors.PyMongoError:
+                # the end of the job could not be recorded, recover queues
+                # it again at the next start once its heartbeat is stale
+                pass
+            finally:
+                with self.running_lock:
+                    self.running.discard(job["_id"])
+
+    def beat(self) -> None:
+        """
+        Update the heartbeat of the running jobs so recover leaves them, and
+        recover the jobs of stopped processes, a process that stopped less
+        than STALE_SECONDS before this one started has its jobs queued again
+        once their heartbeat is stale
+        """
+        while not self.stop.wait(HEARTBEAT_SECONDS):
+            with self.running_lock:
+                running = list(self.running)
+            try:
+                if running:
+                    self.db.jobs.update_many(
+                        {"_id": {"$in": running}},
+                        {"$set": {"heartbeat": now_utc()}},
+                    )
+                if recover(db=self.db):
+                    self.wake.set()
+            except pymongo.errors.PyMongoError:
+                pass
+
+    def run(self, job: dict) -> None:
+        """
+        Run a job and record how it ended, an error that is not one of
+        PERMANENT_ERRORS queues the job again after a backoff until it has
+        used max_attempts
+
+        Args:
+            job: the claimed job
+        """
+        last_update = [0.0]
+
+        def progress(done: int, total: int = None, message: str = None):
+            # at most one write per PROGRESS_SECONDS, the last one is always
+            # written by the end of the job
+            now = now_utc()
+            if total is not None and done < total and (
+                now.timestamp() - last_update[0] < PROGRESS_SECONDS
+            ):
+                return
+            last_update[0] = now.timestamp()
+            self.db.jobs.update_one(
+                {"_id": job["_id"]},
+                {
+                    "$set": {
+                        "progress": {"done": done, "total": total, "message": message},
+                        "heartbeat": now,
+                    }
+                },
+            )
+
+        runner = self.runners[job["kind"]]
+        try:
+            with self.db.client.start_session(causal_consistency=True) as session:
+                result = runner(
+                    session=session,
+                    db=self.db,
+                    progress=progress,
+                    **json_util.loads(job["args"]),
+                )
+        except Exception as error_message:
+            retry = not isinstance(error_message, PERMANENT_ERRORS) and (
+                job["attempts"] < job["max_attempts"]
+            )
+            update = {"error": f"{type(error_message).__name__}: {error_message}"}
+            if retry:
+                delay = RETRY_SECONDS * 2 ** (job["attempts"] - 1)
+                update["status"] = "queued"
+                update["run_at"] = now_utc() + datetime.timedelta(seconds=delay)
+            else:
+                update["status"] = "failed"
+                update["finished"] = now_utc()
+            self.db.jobs.update_one({"_id": job["_id"]}, {"$set": update})
+            return
+        self.db.jobs.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": "done",
+                    "finished": now_utc(),
+                    "result": result,
+                },
+                "$unset": {"error": ""},
+            },
+        )
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop taking jobs, the queued jobs stay in the collection for the next
+        start
+
+        Args:
+            wait: wait for the running jobs to finish
+        """
+        self.stop.set()
+        self.wake.set()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+def start(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    runners: dict,
+    workers: int = None,
+) -> JobQueue:
+    """
+    Start the job queue of this process, the jobs of a process that stopped
+    while running them are queued again first
+
+    Args:
+        db: use in which database
+        runners: function(session=..., db=..., progress=..., **args) by kind,
+            progress(done, total=None, message=None) records the progress
+        workers: number of worker threads, JOB_WORKERS if None
+
+    Returns: The job queue
+    """
+    global _QUEUE
+    ensure_indexes(db=db)
+    recover(db=db)
+    _QUEUE = JobQueue(db, runners, workers)
+    return _QUEUE
+
+
+def running_count() -> int:
+    """
+    Get the number of jobs this process is running
+
+    Returns: The number of jobs
+    """
+    if _QUEUE is None:
+        return 0
+    with _QUEUE.running_lock:
+        return len(_QUEUE.running)
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Stop the job queue of this process
+
+    Args:
+        wait: wait for the running jobs to finish
+
+    Returns: None
+    """
+    global _QUEUE
+    if _QUEUE is not None:
+        _QUEUE.close(wait=wait)
+        _QUEUE = None
+    return
+
+
+# errors that happen again when the job is retried
+PERMANENT_ERRORS = (BadEpub, BadBook)
+JOB_WORKERS = 2
+MAX_ATTEMPTS = 3
+# the first retry waits RETRY_SECONDS, every next one twice as long
+RETRY_SECONDS = 5
+POLL_SECONDS = 1.0
+PROGRESS_SECONDS = 1.0
+HEARTBEAT_SECONDS = 30
+# a running job without heartbeat for this long lost its process
+STALE_SECONDS = 120
+JOBS_SHOWN = 10
+# job queue of this process, created by start
+_QUEUE = None
@@ -1,18 +1,31 @@
 #! /usr/bin/env python3
 import datetime
 import os
-import gridfs
+import sys
+import bson
 import pymongo
-from gridfs import GridFS
+import autocomplete
+import blob_storage
+import book_text
+import counts
+import covers
+import epub
+import exporter
+import history
+import jobs
+import prefetch
+import query
+import summary
+from book_storage import BadEpub
+from bulk_download import download_books
+from bulk_loader import delete_checkpoint
+from connection import catalogue_reads, get_client
+from schema import BadBook, validate_book
 
 
 # output screen width 79 height 20
 
 
-class BadEpub(Exception):
-    """File is invalid"""
-
-
 def get_choice(prompt: str, max_choice: int) -> int:
     """
     Get a choice from the user
@@ -38,21 +51,22 @@ def download_file_by_id(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
-    file_id: str,
+    book: dict,
     file_name: str,
 ) -> str:
     """
-    Download a file from GridFS by its id to books_download directory
+    Download the file of a book from its storage backend to books_download
+    directory, the file is decompressed while streaming if it was stored
+    compressed
 
     Args:
         session: session to connect to the database
         db: use in which database
-        file_id: file id to download
+        book: book with file_id or storage_uri
         file_name: what to name the file
 
     Returns: The path to the downloaded file
     """
-    fs = gridfs.GridFS(db)
     output_file_name = "./books_download/" + file_name
     # if the output file already exists, remove it
     try:
@@ -61,81 +75,14 @@ def download_file_by_id(
         pass
 
     with open(output_file_name, "wb") as output_file:
-        output_file.write(fs.get(file_id, session=session).read())
+        blob_storage.copy_to_file(
+            session=session, db=db, book=book, output_file=output_file
+        )
 
     print(f"File {file_name} downloaded to books_download directory")
     return output_file_name
 
 
-def save_file_gridfs(
-    *,
-    session: pymongo.mongo_client.client_session,
-    db: pymongo.mongo_client.database.Database,
-    file_name: str,
-    file_path: str,
-) -> str:
-    """
-    Save a file to GridFS
-
-    Args:
-        session: session to connect to the database
-        db: use in which database
-        file_name: name of the file
-        file_path: path to the file
-
-    Returns: The id of the file in GridFS
-    """
-    if file_path[-5:] != ".epub" and file_path[-5:] != ".pdf":
-        print("-" * 79)
-        raise BadEpub(f"File {file_path} is not an epub or pdf file.")
-
-    file_name_filter = {"filename": file_name}
-    fs: GridFS = gridfs.GridFS(db)
-    if fs.exists(file_name_filter, session=session):
-        the_id = fs.find_one(
-            file_name_filter, no_cursor_timeout=True, session=session
-        )._id
-        fs.delete(the_id, session=session)
-        del the_id
-    if os.path.isdir(file_path):
-        raise BadEpub(f'specified file "{file_path}" is a directory, not a file.')
-    try:
-        with open(file_path, "rb") as infile:
-            the_id = fs.put(
-                infile.read(),
-                filename=file_name,
-                content_type="EPUB Document",
-                session=session,
-            )
-            if the_id is None:
-                raise BadEpub(f'failed to save file "{file_path}" to GridFS.')
-    except FileNotFoundError:
-        raise BadEpub(f'specified file "{file_path}" does not exist.')
-
-    return the_id
-
-
-def delete_file_gridfs(
-    *,
-    session: pymongo.mongo_client.client_session,
-    db: pymongo.mongo_client.database.Database,
-    file_id: str,
-) -> None:
-    """
-    Delete a file from GridFS
-
-    Args:
-        session: session to connect to the database
-        db: use in which database
-        file_id: id of the file to delete
-
-    Returns: None
-    """
-    fs = gridfs.GridFS(db)
-    fs.delete(file_id, session=session)
-    return
-
-
 def add_books(
     *,
     session: pymongo.mongo_client.client_session,
@@ -152,13 +99,19 @@ def add_books(
 
     Returns: None
     """
+    # fail fast before any file is uploaded
+    for i in books:
+        validate_book(i)
+
     for i in books:
         try:
-            i["file_id"] = save_file_gridfs(
-                db=db,
-                session=session,
-                file_name=i["file_name"],
-                file_path=i["file_path"],
+            i.update(
+                blob_storage.save_file(
+                    db=db,
+                    session=session,
+                    file_name=i["file_name"],
+                    file_path=i["file_path"],
+                )
             )
         except BadEpub as error_message:
             raise BadEpub(error_message)
@@ -167,18 +120,65 @@ def add_books(
         elif i["file_path"][-4:] == ".pdf":
             i["file_type"] = "PDF"
 
-        db.books.insert_one(i, session=session)
+        history.insert_book(session=session, db=db, book=i)
+        summary.book_saved(session=session, db=db, book=i)
+        book_text.schedule_extraction(db=db, book_id=i["_id"], file_path=i["file_path"])
+        covers.schedule_cover(db=db, book_id=i["_id"], file_path=i["file_path"])
+        autocomplete.book_added(i)
+    counts.invalidate()
 
     return
 
 
+def input_with_default(prompt: str, default: str) -> str:
+    """
+    Get an input where an empty answer keeps a value read from the file
+
+    Args:
+        prompt: Text to display to the user
+        default: value read from the file, None if there is none
+
+    Returns: The input or the default
+    """
+    if not default:
+        return input(f"{prompt}: ")
+    value = input(f"{prompt} [{default}]: ")
+    if value == "":
+        return default
+    return value
+
+
+def keep_from_file(label: str, values: list) -> bool:
+    """
+    Ask if a list read from the file is kept
+
+    Args:
+        label: name of the field
+        values: values read from the file
+
+    Returns: True if the values are kept
+    """
+    if not values:
+        return False
+    print(f"{label} from the file: {'; '.join(values)}")
+    while True:
+        keep = input(f"Keep these {label.lower()}? (y/n): ")
+        if keep not in ["y", "Y", "n", "N"]:
+            print("Invalid input")
+            continue
+        break
+    return keep in ["y", "Y"]
+
+
 def add_book_menu(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
 ) -> None:
     """
-    Add a book to the database Menu from user input
+    Add a book to the database Menu from user input, the fields found in
+    the OPF metadata of an EPUB are offered as defaults. The book is checked
+    here and uploaded by a job
 
     Args:
         session: session to connect to the database
@@ -193,55 +193,99 @@ def add_book_menu(
     book = {}
 
     while True:
-        book["title"] = input("Enter the title of the book (required): ")
-        if book["title"] == "":
+        book["file_path"] = input("Enter the file path of the book (required): ")
+        if book["file_path"] == "":
+            print("Invalid input")
+            continue
+        if book["file_path"][-5:] != ".epub" and book["file_path"][-4:] != ".pdf":
+            print("Invalid file path (must end with .epub or .pdf)")
+            continue
+        elif not os.path.isfile(book["file_path"]):
+            print("Invalid file path")
+            continue
+        break
+
+    while True:
+        book["file_name"] = input_with_default(
+            "Enter the file name of the book (required)",
+            os.path.basename(book["file_path"]),
+        )
+        if book["file_name"] == "":
             print("Invalid input")
             continue
+        if book["file_name"][-5:] != ".epub" and book["file_name"][-4:] != ".pdf":
+            print("Invalid file name (must end with .epub or .pdf)")
+            continue
         break
 
-    authors = []
+    metadata = {}
+    if book["file_path"][-5:] == ".epub":
+        try:
+            metadata = epub.read_metadata(book["file_path"])
+        except epub.BadPackage as error_message:
+            print(f"Could not read the metadata of the file: {error_message}")
+
     while True:
-        author = {"name": input("Enter the name of the author (required): ")}
-        if author["name"] == "":
+        book["title"] = input_with_default(
+            "Enter the title of the book (required)", metadata.get("title")
+        )
+        if book["title"] == "":
             print("Invalid input")
             continue
-        author["pseudonym"] = input("Enter the pseudonym of the author: ")
-        if author["pseudonym"] == "":
-            del author["pseudonym"]
-        authors.append(author)
+        break
+
+    file_authors = [author["name"] for author in metadata.get("author", [])]
+    if keep_from_file("Authors", file_authors):
+        book["author"] = metadata["author"]
+    else:
+        authors = []
         while True:
-            again = input("Add another Author? (y/n): ")
-            if again not in ["y", "Y", "n", "N"]:
+            author = {"name": input("Enter the name of the author (required): ")}
+            if author["name"] == "":
                 print("Invalid input")
                 continue
-            break
-        if again in ["n", "N"]:
-            break
-    book["author"] = authors
+            author["pseudonym"] = input("Enter the pseudonym of the author: ")
+            if author["pseudonym"] == "":
+                del author["pseudonym"]
+            authors.append(author)
+            while True:
+                again = input("Add another Author? (y/n): ")
+                if again not in ["y", "Y", "n", "N"]:
+                    print("Invalid input")
+                    continue
+                break
+            if again in ["n", "N"]:
+                break
+        book["author"] = authors
 
     while True:
-        book["language"] = input("Enter the language of the book (required): ")
+        book["language"] = input_with_default(
+            "Enter the language of the book (required)", metadata.get("language")
+        )
         if book["language"] == "":
             print("Invalid input")
             continue
         break
 
-    genres = []
-    while True:
-        genre = input("Enter the genre of the book (required): ")
-        if genre == "":
-            print("Invalid input")
-            continue
-        genres.append(genre)
+    if keep_from_file("Genres", metadata.get("genres")):
+        book["genres"] = metadata["genres"]
+    else:
+        genres = []
         while True:
-            again = input("Add another genre? (y/n): ")
-            if again not in ["y", "Y", "n", "N"]:
+            genre = input("Enter the genre of the book (required): ")
+            if genre == "":
                 print("Invalid input")
                 continue
-            break
-        if again in ["n", "N"]:
-            break
-    book["genres"] = genres
+            genres.append(genre)
+            while True:
+                again = input("Add another genre? (y/n): ")
+                if again not in ["y", "Y", "n", "N"]:
+                    print("Invalid input")
+                    continue
+                break
+            if again in ["n", "N"]:
+                break
+        book["genres"] = genres
 
     sub_genres = []
     while True:
@@ -260,25 +304,35 @@ def add_book_menu(
             break
     book["sub_genres"] = sub_genres
 
-    main_characters = []
-    while True:
-        main_character = input("Enter the main character of the book (required): ")
-        if main_character == "":
-            print("Invalid input")
-            continue
-        main_characters.append(main_character)
+    if keep_from_file("Main characters", metadata.get("main_characters")):
+        book["main_characters"] = metadata["main_characters"]
+    else:
+        main_characters = []
         while True:
-            again = input("Add another main character? (y/n): ")
-            if again not in ["y", "Y", "n", "N"]:
+            main_character = input(
+                "Enter the main character of the book (required): "
+            )
+            if main_character == "":
                 print("Invalid input")
                 continue
-            break
-        if again == "n":
-            break
-    book["main_characters"] = main_characters
+            main_characters.append(main_character)
+            while True:
+                again = input("Add another main character? (y/n): ")
+                if again not in ["y", "Y", "n", "N"]:
+                    print("Invalid input")
+                    continue
+                break
+            if again == "n":
+                break
+        book["main_characters"] = main_characters
 
+    file_date = None
+    if "published_date" in metadata:
+        file_date = metadata["published_date"].strftime("%Y/%m/%d")
     while True:
-        published_date = input("Enter the published date of the book (required): ")
+        published_date = input_with_default(
+            "Enter the published date of the book (required)", file_date
+        )
         if published_date == "":
             print("Invalid input (YYYY/MM/DD) Example. 1993/10/01")
             continue
@@ -303,43 +357,54 @@ def add_book_menu(
 
     book["set_year"] = input("Enter the set year of the book: ")
     book["set_main_location"] = input("Enter the set country of the book: ")
-    book["copy_right"] = input("Enter the copy-right of the book: ")
+    book["copy_right"] = input_with_default(
+        "Enter the copy-right of the book", metadata.get("copy_right")
+    )
     while True:
-        book["ISBN"] = input("Enter the ISBN of the book (required): ")
+        book["ISBN"] = input_with_default(
+            "Enter the ISBN of the book (required)", metadata.get("ISBN")
+        )
         if book["ISBN"] == "":
             print("Invalid input")
             continue
         break
 
-    while True:
-        book["file_name"] = input("Enter the file name of the book (required): ")
-        if book["file_name"] == "":
-            print("Invalid input")
-            continue
-        if book["file_name"][-5:] != ".epub" and book["file_name"][-4:] != ".pdf":
-            print("Invalid file name (must end with .epub or .pdf)")
-            continue
-        break
-
-    while True:
-        book["file_path"] = input("Enter the file path of the book (required): ")
-        if book["file_path"] == "":
-            print("Invalid input")
-            continue
-        if book["file_path"][-5:] != ".epub" and book["file_path"][-4:] != ".pdf":
-            print("Invalid file path (must end with .epub or .pdf)")
-            continue
-        elif not os.path.isfile(book["file_path"]):
-            print("Invalid file path")
-            continue
-        break
-
     try:
-        add_books(session=session, db=db, books=[book])
-        print("Book added")
-    except BadEpub as error_message:
+        validate_book(book)
+    except BadBook as error_message:
         print(error_message)
         return
+    # the id is chosen now so a retried upload does not add the book twice
+    book["_id"] = bson.ObjectId()
+    jobs.submit(db=db, kind="add_book", title=f"Add {book['title']}", book=book)
+    print("Book queued for upload, see Jobs in the main menu")
+
+
+def run_add_book(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+    book: dict,
+) -> dict:
+    """
+    Job that uploads the file of a book and adds the book
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+        book: the book with its _id
+
+    Returns: number of books added
+    """
+    if db.books.find_one({"_id": book["_id"]}, {"_id": 1}, session=session):
+        # added by an attempt that failed after the book was written
+        return {"added": 0}
+    progress(0, 1, "uploading")
+    add_books(session=session, db=db, books=[book])
+    progress(1, 1)
+    return {"added": 1}
 
 
 def get_book_data(
@@ -387,9 +452,11 @@ def edit_book_title(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"title": new_title}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"title": new_title}},
     )
     print("Title updated")
 
@@ -442,9 +509,11 @@ def edit_book_author(
             if again in ["n", "N"]:
                 break
 
-        db.books.update_one(
-            {"_id": book_id},
-            {"$push": {"author": {"$each": new_author}}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$push": {"author": {"$each": new_author}}},
         )
         print("Author added")
     elif choice == 2:
@@ -459,9 +528,11 @@ def edit_book_author(
                 print(f"{i+1}. {author['name']}")
         print("which author do you want to remove?")
         choice = get_choice("Enter your choice: ", len(book["author"]))
-        db.books.update_one(
-            {"_id": book_id},
-            {"$pull": {"author": book["author"][choice - 1]}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$pull": {"author": book["author"][choice - 1]}},
         )
 
         print("Author removed")
@@ -494,9 +565,11 @@ def edit_book_language(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"language": new_language}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"language": new_language}},
     )
     print("Language updated")
 
@@ -540,9 +613,11 @@ def edit_published_date(
         if published_date[4] != "/" or published_date[7] != "/":
             print("Invalid input (YYYY/MM/DD) Example. 1993/10/01")
             continue
-        db.books.update_one(
-            {"_id": book_id},
-            {
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={
                 "$set": {
                     "published_date": datetime.datetime.strptime(
                         published_date, "%Y/%m/%d"
@@ -595,9 +670,11 @@ def edit_genres(
             if again in ["n", "N"]:
                 break
 
-        db.books.update_one(
-            {"_id": book_id},
-            {"$push": {"genres": {"$each": new_genres}}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$push": {"genres": {"$each": new_genres}}},
         )
         print("Genre added")
     elif choice == 2:
@@ -608,9 +685,11 @@ def edit_genres(
             print(f"{i+1}. {book['genres'][i]}")
         print("which genre do you want to remove?")
         choice = get_choice("Enter your choice: ", len(book["genres"]))
-        db.books.update_one(
-            {"_id": book_id},
-            {"$pull": {"genres": book["genres"][choice - 1]}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$pull": {"genres": book["genres"][choice - 1]}},
         )
 
         print("Genre removed")
@@ -659,9 +738,11 @@ def edit_sub_genres(
             if again in ["n", "N"]:
                 break
 
-        db.books.update_one(
-            {"_id": book_id},
-            {"$push": {"sub_genres": {"$each": new_sub_genres}}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$push": {"sub_genres": {"$each": new_sub_genres}}},
         )
         print("Sub-genre added")
     elif choice == 2:
@@ -672,9 +753,11 @@ def edit_sub_genres(
             print(f"{i+1}. {book['sub_genres'][i]}")
         print("which sub-genre do you want to remove?")
         choice = get_choice("Enter your choice: ", len(book["sub_genres"]))
-        db.books.update_one(
-            {"_id": book_id},
-            {"$pull": {"sub_genres": book["sub_genres"][choice - 1]}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$pull": {"sub_genres": book["sub_genres"][choice - 1]}},
         )
 
         print("Sub-genre removed")
@@ -723,9 +806,11 @@ def edit_main_characters(
             if again in ["n", "N"]:
                 break
 
-        db.books.update_one(
-            {"_id": book_id},
-            {"$push": {"main_characters": {"$each": new_main_characters}}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$push": {"main_characters": {"$each": new_main_characters}}},
         )
         print("Main character added")
     elif choice == 2:
@@ -736,9 +821,11 @@ def edit_main_characters(
             print(f"{i+1}. {book['main_characters'][i]}")
         print("which main character do you want to remove?")
         choice = get_choice("Enter your choice: ", len(book["main_characters"]))
-        db.books.update_one(
-            {"_id": book_id},
-            {"$pull": {"main_characters": book["main_characters"][choice - 1]}},
+        history.update_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+            update={"$pull": {"main_characters": book["main_characters"][choice - 1]}},
         )
 
         print("Main character removed")
@@ -771,9 +858,11 @@ def edit_isbn(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"ISBN": new_isbn}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"ISBN": new_isbn}},
     )
     print("ISBN updated")
 
@@ -803,9 +892,11 @@ def edit_set_year(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"set_year": new_set_year}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"set_year": new_set_year}},
     )
     print("Set Year updated")
 
@@ -835,9 +926,11 @@ def edit_set_main_location(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"set_main_location": new_set_main_location}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"set_main_location": new_set_main_location}},
     )
     print("Set Main Location updated")
 
@@ -867,9 +960,11 @@ def edit_copy_right(
             continue
         break
 
-    db.books.update_one(
-        {"_id": book_id},
-        {"$set": {"copy_right": new_copy_right}},
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={"$set": {"copy_right": new_copy_right}},
     )
     print("Copy Right updated")
 
@@ -989,7 +1084,7 @@ def change_book_file(
     book_id: str,
 ):
     """
-    Change the file of a book
+    Change the file of a book, the upload runs as a job
     Args:
         session: session to connect to the database
         db: use in which database
@@ -1023,34 +1118,83 @@ def change_book_file(
             continue
         break
 
-    try:
-        file_id = save_file_gridfs(
-            db=db,
-            session=session,
-            file_name=new_file_name,
-            file_path=new_file_path,
-        )
-    except BadEpub as error_message:
-        print(error_message)
-        return
+    jobs.submit(
+        db=db,
+        kind="change_file",
+        title=f"Change the file of {book['title']}",
+        book_id=book_id,
+        file_name=new_file_name,
+        file_path=new_file_path,
+    )
+    print("File queued for upload, see Jobs in the main menu")
+
+
+def run_change_file(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+    book_id,
+    file_name: str,
+    file_path: str,
+) -> dict:
+    """
+    Job that uploads a new file for a book, the old file is left to
+    blob_storage.collect_garbage
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+        book_id: id of the book
+        file_name: name of the new file
+        file_path: path to the new file
+
+    Returns: the new file name
+    """
+    book = get_book_data(session=session, db=db, book_id=book_id)
+    if book is None:
+        raise BadBook([f"the book {book_id} was deleted"])
+    progress(0, 1, "uploading")
+    file_fields = blob_storage.save_file(
+        db=db,
+        session=session,
+        file_name=file_name,
+        file_path=file_path,
+    )
 
-    if new_file_path[-5:] == ".epub":
+    if file_path[-5:] == ".epub":
         new_file_type = "EPUB"
-    elif new_file_path[-4:] == ".pdf":
+    elif file_path[-4:] == ".pdf":
         new_file_type = "PDF"
 
-    db.books.update_one(
-        {"_id": book_id},
-        {
+    # the old file_type is in the filter because it is part of the shard key
+    history.update_book(
+        session=session,
+        db=db,
+        book_filter={"_id": book_id, "file_type": book["file_type"]},
+        update={
             "$set": {
-                "file_id": file_id,
-                "file_name": new_file_name,
-                "file_path": new_file_path,
+                **file_fields,
+                "file_name": file_name,
+                "file_path": file_path,
                 "file_type": new_file_type,
-            }
+            },
+            # the new file can be in another storage backend than the old one
+            "$unset": {
+                field: ""
+                for field in ["file_id", "storage_uri"]
+                if field not in file_fields
+            },
         },
     )
-    print("File updated")
+    book_text.schedule_extraction(db=db, book_id=book_id, file_path=file_path)
+    covers.schedule_cover(db=db, book_id=book_id, file_path=file_path)
+    changed_book = get_book_data(session=session, db=db, book_id=book_id)
+    summary.book_saved(session=session, db=db, book=changed_book)
+    counts.invalidate()
+    progress(1, 1)
+    return {"file_name": file_name}
 
 
 def delete_book(
@@ -1083,18 +1227,58 @@ def delete_book(
     print("2. No")
     choice = get_choice("Enter your choice: ", 2)
     if choice == 1:
-        delete_file_gridfs(db=db, session=session, file_id=book["file_id"])
-        db.books.delete_one({"_id": book_id})
+        blob_storage.delete_file(db=db, session=session, book=book)
+        history.delete_book(
+            session=session,
+            db=db,
+            book_filter={"_id": book_id, "file_type": book["file_type"]},
+        )
+        summary.book_deleted(session=session, db=db, book_id=book_id)
+        delete_checkpoint(session=session, db=db, book=book)
+        book_text.delete_text(db=db, book_id=book_id)
+        covers.delete_cover(db=db, book_id=book_id)
+        autocomplete.book_changed(book, None)
+        counts.invalidate()
         print("Book deleted")
     elif choice == 2:
         pass
 
 
+def save_cover(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+):
+    """
+    Save the cover thumbnail of a book to the download folder
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: the book
+    """
+    cover = covers.get_covers(session=session, db=db, book_ids=[book["_id"]]).get(
+        book["_id"]
+    )
+    if cover is None:
+        print("This book has no cover")
+        return
+    extension = covers.EXTENSIONS.get(cover["media_type"], ".img")
+    output_file_name = os.path.join(
+        "./books_download/", os.path.splitext(book["file_name"])[0] + extension
+    )
+    os.makedirs("./books_download/", exist_ok=True)
+    with open(output_file_name, "wb") as output_file:
+        output_file.write(cover["data"])
+    print(f"Cover saved to {output_file_name}")
+
+
 def book_data_menu(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
     book_id: str,
+    book: dict = None,
 ):
     """
     Print the data of a book and ask the user what to do next
@@ -1102,13 +1286,15 @@ def book_data_menu(
         session: session to connect to the database
         db: use in which database
         book_id: id of the book
+        book: the data of the book if it was already read, None to read it
     """
     print("-" * 79)
     print("Book Data")
     print("-" * 79)
-    book = get_book_data(session=session, db=db, book_id=book_id)
+    if book is None:
+        book = get_book_data(session=session, db=db, book_id=book_id)
     for key, value in book.items():
-        if key in ["_id", "file_id", "file_path"]:
+        if key in ["_id", "file_id", "storage_uri", "file_path"]:
             continue
         elif key == "author":
             print(f"{key}:")
@@ -1129,78 +1315,531 @@ def book_data_menu(
     print("1. Edit Metadata")
     print("2. Change Book File")
     print("3. Download Book")
-    print("4. Delete Book")
-    print("5. Back")
+    print("4. Save Cover")
+    print("5. Delete Book")
+    print("6. Back")
     print("-" * 79)
-    choice = get_choice("Enter your choice: ", 5)
+    choice = get_choice("Enter your choice: ", 6)
     match choice:
         case 1:
             edit_book_metadata(session=session, db=db, book_id=book_id)
+            edited_book = get_book_data(session=session, db=db, book_id=book_id)
+            summary.book_saved(session=session, db=db, book=edited_book)
+            autocomplete.book_changed(book, edited_book)
+            counts.invalidate()
         case 2:
             change_book_file(session=session, db=db, book_id=book_id)
         case 3:
             download_file_by_id(
                 db=db,
                 session=session,
-                file_id=book["file_id"],
+                book=book,
                 file_name=book["file_name"],
             )
         case 4:
+            save_cover(session=session, db=db, book=book)
+        case 5:
             delete_book(session=session, db=db, book_id=book_id)
 
-        case 5:
+        case 6:
             pass
 
 
+def download_books_menu(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict = None,
+    file_type: str = "ALL",
+):
+    """
+    Download the files of every book in a list to books_download directory
+    or to an archive
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        filter_dict: filter of the books
+        file_type: file type to filter books
+    """
+    print("-" * 79)
+    print("Download all books")
+    print("-" * 79)
+    print("1. Download to books_download directory")
+    print("2. Download to a tar archive")
+    print("3. Download to a zip archive")
+    print("4. Back")
+    print("-" * 79)
+    choice = get_choice("Enter your choice: ", 4)
+    archive_path = None
+    match choice:
+        case 2:
+            archive_path = "./books_download/books.tar"
+        case 3:
+            archive_path = "./books_download/books.zip"
+        case 4:
+            return
+
+    download_filter = {}
+    if filter_dict:
+        download_filter = filter_dict
+    if file_type != "ALL":
+        download_filter = {"$and": [download_filter, {"file_type": file_type}]}
+    jobs.submit(
+        db=db,
+        kind="download",
+        title=f"Download to {archive_path or './books_download/'}",
+        filter_dict=download_filter,
+        archive_path=archive_path,
+    )
+    print("Download queued, see Jobs in the main menu")
+
+
+def run_download(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+    filter_dict: dict,
+    archive_path: str = None,
+) -> dict:
+    """
+    Job that downloads the files of books, the files already downloaded
+    are skipped when it is retried
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+        filter_dict: filter of the books
+        archive_path: tar or zip archive to write, None for the directory
+
+    Returns: the stats of download_books
+    """
+    stats = download_books(db=db, filter_dict=filter_dict, archive_path=archive_path)
+    mb = stats["bytes"] / 1024 / 1024
+    progress(
+        stats["downloaded"],
+        stats["downloaded"],
+        f"{mb:.1f} MB in {stats['seconds']:.1f}s "
+        f"({mb / max(stats['seconds'], 1e-9):.1f} MB/s)",
+    )
+    return stats
+
+
+def edit_books_menu(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict = None,
+):
+    """
+    Set a field of every book in a list, the edit runs as a job
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        filter_dict: filter of the books
+    """
+    print("-" * 79)
+    print("Edit all books")
+    print("-" * 79)
+    for i, (field, label) in enumerate(BULK_EDIT_FIELDS):
+        print(f"{i+1}. Set {label}")
+    print(f"{len(BULK_EDIT_FIELDS)+1}. Back")
+    print("-" * 79)
+    choice = get_choice("Enter your choice: ", len(BULK_EDIT_FIELDS) + 1)
+    if choice > len(BULK_EDIT_FIELDS):
+        return
+    field, label = BULK_EDIT_FIELDS[choice - 1]
+    while True:
+        value = input(f"Enter the new {label}: ")
+        if value == "":
+            print("Invalid input")
+            continue
+        break
+    jobs.submit(
+        db=db,
+        kind="bulk_edit",
+        title=f"Set {label} to {value}",
+        filter_dict=filter_dict or {},
+        field=field,
+        value=value,
+    )
+    print("Edit queued, see Jobs in the main menu")
+
+
+def run_bulk_edit(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+    filter_dict: dict,
+    field: str,
+    value: str,
+    batch_size: int = 500,
+) -> dict:
+    """
+    Job that sets a field of every book that matches a filter, each book is
+    edited with its history like an edit from the book menu. The books are
+    read in _id order so a retry goes over the books again without missing
+    the ones the filter no longer matches
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+        filter_dict: filter of the books
+        field: one of BULK_EDIT_FIELDS
+        value: the new value
+        batch_size: number of books read per query
+
+    Returns: number of books edited
+    """
+    if field not in dict(BULK_EDIT_FIELDS):
+        raise BadBook([f"{field} can not be edited on all books"])
+    total = db.books.count_documents(filter_dict, session=session)
+    edited = 0
+    last_id = None
+    while True:
+        page_filter = filter_dict
+        if last_id is not None:
+            page_filter = {"$and": [filter_dict, {"_id": {"$gt": last_id}}]}
+        books = list(
+            db.books.find(page_filter, session=session).sort("_id", 1).limit(batch_size)
+        )
+        if not books:
+            break
+        last_id = books[-1]["_id"]
+        for book in books:
+            # file_type is in the filter because it is part of the shard key
+            edited_book = history.update_book(
+                session=session,
+                db=db,
+                book_filter={"_id": book["_id"], "file_type": book["file_type"]},
+                update={"$set": {field: value}},
+            )
+            if edited_book is None:
+                # deleted since the page was read
+                continue
+            summary.book_saved(session=session, db=db, book=edited_book)
+            autocomplete.book_changed(book, edited_book)
+            edited += 1
+        progress(edited, total)
+    counts.invalidate()
+    return {"edited": edited}
+
+
+def export_books_menu(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    filter_dict: dict = None,
+):
+    """
+    Export the metadata of every book in a list to books_download
+    directory, the export runs as a job
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        filter_dict: filter of the books
+    """
+    print("-" * 79)
+    print("Export all books")
+    print("-" * 79)
+    output_formats = list(exporter.WRITERS)
+    for i, output_format in enumerate(output_formats):
+        print(f"{i+1}. Export to {output_format}")
+    print(f"{len(output_formats)+1}. Back")
+    print("-" * 79)
+    choice = get_choice("Enter your choice: ", len(output_formats) + 1)
+    if choice > len(output_formats):
+        return
+    output_format = output_formats[choice - 1]
+    jobs.submit(
+        db=db,
+        kind="export",
+        title=f"Export to {output_format}",
+        filter_dict=filter_dict or {},
+        output_format=output_format,
+    )
+    print("Export queued, see Jobs in the main menu")
+
+
+def run_export(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+    filter_dict: dict,
+    output_format: str,
+) -> dict:
+    """
+    Job that exports the metadata of books to books_download directory
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+        filter_dict: filter of the books
+        output_format: a format of exporter.WRITERS
+
+    Returns: number of books exported and the path of the export
+    """
+    output_path = f"./books_download/books.{output_format}"
+    os.makedirs("./books_download/", exist_ok=True)
+    exported = exporter.export_books(
+        db=db,
+        output_path=output_path,
+        output_format=output_format,
+        filter_dict=filter_dict,
+    )
+    progress(exported, exported, output_path)
+    return {"exported": exported, "output_path": output_path}
+
+
+def run_collect_garbage(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    progress,
+) -> dict:
+    """
+    Job that deletes the stored files no book points to anymore
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        progress: function(done, total=None, message=None) of the job
+
+    Returns: number of files checked and deleted
+    """
+    return blob_storage.collect_garbage(session=session, db=db, progress=progress)
+
+
+def format_job(job: dict) -> str:
+    """
+    Get the line of a job in the jobs menu
+
+    Args:
+        job: the job
+
+    Returns: time, status, progress, attempts and title of the job
+    """
+    progress = job.get("progress") or {}
+    done = ""
+    if progress.get("total"):
+        done = f"{progress['done'] / progress['total']:.0%}"
+    elif progress.get("done"):
+        done = str(progress["done"])
+    attempts = f"{job['attempts']}/{job['max_attempts']}"
+    return (
+        f"{job['created']:%Y-%m-%d %H:%M:%S} {job['status']:<7} {done:>5} "
+        f"{attempts:>4} {job['title']}"
+    )
+
+
+def jobs_menu(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+):
+    """
+    Show the newest jobs, retry a failed job or start a clean up of the
+    stored files
+    Args:
+        session: session to connect to the database
+        db: use in which database
+    """
+    while True:
+        print("-" * 79)
+        print("Jobs")
+        print("-" * 79)
+        job_list = jobs.list_jobs(session=session, db=db)
+        if not job_list:
+            print("No jobs")
+        for job in job_list:
+            print(format_job(job))
+            progress = job.get("progress") or {}
+            if job.get("error"):
+                print(f"    {job['error']}")
+            elif job["status"] == "done" and progress.get("message"):
+                print(f"    {progress['message']}")
+        print("-" * 79)
+        print("1. Refresh")
+        print("2. Retry a failed job")
+        print("3. Delete unused book files")
+        print("4. Back")
+        print("-" * 79)
+        choice = get_choice("Enter your choice: ", 4)
+        match choice:
+            case 1:
+                continue
+            case 2:
+                failed = [job for job in job_list if job["status"] == "failed"]
+                if not failed:
+                    print("No failed jobs")
+                    continue
+                for i, job in enumerate(failed):
+                    print(f"{i+1}. {job['title']}")
+                choice = get_choice("Enter your choice: ", len(failed))
+                jobs.retry_job(session=session, db=db, job_id=failed[choice - 1]["_id"])
+                print("Job queued")
+            case 3:
+                jobs.submit(db=db, kind="gc", title="Delete unused book files")
+                print("Clean up queued")
+            case 4:
+                break
+
+
 def list_book_pagination(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
-    page: int = 1,
     page_size: int = 5,
     filter_dict: dict = None,
     file_type: str = "ALL",
+    hint: list = None,
+    sort: str = query.DEFAULT_SORT,
+    after: tuple = None,
+    before: tuple = None,
+    count_cap: int = None,
+    from_summary: bool = False,
 ) -> tuple:
     """
-    get books data with pagination from the database
+    get a page of books data from the database, the page starts after the
+    last book of the page before (keyset pagination) so a deep page reads
+    no more index keys than the first one
 
     Args:
         session: session to connect to the database
         db: use in which database
-        page: current page
         page_size: number of books per page
         filter_dict: filter to apply to the books
         file_type: type of file to filter
-
-    Returns: metadata and data
-    """
-    filter_books = []
-    if filter_dict:
-        filter_books.append({"$match": filter_dict})
+        hint: index to use, None to let the server choose
+        sort: name of a sort order of query.SORT_ORDERS
+        after: sort values of the last book of the previous page, None for
+            the first page
+        before: sort values of the first book of the next page, to go back
+        count_cap: count at most this many books, None to count every match
+        from_summary: read the page from books_summary, the filter must only
+            have summary fields
+
+    Returns: metadata (total_count, more if there are more books than
+        total_count and has_next) and data
+    """
+    # one filter with file_type so a sharded cluster can target the shards
+    # that hold that file_type instead of asking every shard
+    match = filter_dict or {}
     if file_type != "ALL":
-        filter_books.append({"$match": {"file_type": file_type}})
-    filter_books.append(
-        {
-            "$facet": {
-                "metadata": [
-                    {"$count": "total_count"},
-                    {"$addFields": {"page": page}},
-                ],
-                "data": [
-                    {"$skip": (page - 1) * page_size},
-                    {"$limit": page_size},
-                ],
-            }
-        },
+        if match:
+            match = {"$and": [match, {"file_type": file_type}]}
+        else:
+            match = {"file_type": file_type}
+    sort_keys = query.SORT_ORDERS[sort]
+    position = after
+    if before is not None:
+        # read backwards from the first book of the next page
+        sort_keys = [(field, -direction) for field, direction in sort_keys]
+        position = before
+    page_filter = match
+    if position is not None:
+        keyset = query.keyset_filter(sort_keys, position)
+        page_filter = {"$and": [match, keyset]} if match else keyset
+    # a page only shows titles, with the sort fields for the next page
+    projection = summary.list_projection(sort_keys)
+    books = catalogue_reads(db).books
+    page_hint = hint
+    if from_summary:
+        # the summary index of the hint also has the title, so the page is
+        # read from the index without fetching any document, except for the
+        # multikey indexes of summary.ARRAY_FIELDS
+        books = catalogue_reads(db).books_summary
+        if hint is not None:
+            page_hint = summary.covering_index(hint)
+    # one book more than the page tells if there is a next page
+    cursor = (
+        books.find(page_filter, projection, session=session)
+        .sort(sort_keys)
+        .limit(page_size + 1)
     )
-    books = db.books.aggregate(
-        filter_books,
+    if page_hint is not None:
+        cursor = cursor.hint(page_hint)
+    data = list(cursor)
+    if not data:
+        return None, None
+    has_next = before is not None or len(data) > page_size
+    data = data[:page_size]
+    if before is not None:
+        data.reverse()
+    total_count, more = counts.count_books(
+        session=session, db=db, filter_dict=match, hint=hint, cap=count_cap
+    )
+    return {"total_count": total_count, "more": more, "has_next": has_next}, data
+
+
+def read_page(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    page_size: int,
+    plan: dict,
+    sort: str,
+    after: tuple,
+    before: tuple,
+    count_cap: int,
+    from_summary: bool,
+) -> tuple:
+    """
+    Read a page of books for print_books and the covers of the page into
+    the cover cache, the prefetch threads read pages with it
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        page_size: number of books per page
+        plan: plan of the query module with the filter and hint
+        sort: name of a sort order of query.SORT_ORDERS
+        after: sort values of the last book of the previous page
+        before: sort values of the first book of the next page
+        count_cap: count at most this many books, None to count every match
+        from_summary: read the page from books_summary
+
+    Returns: metadata and data of list_book_pagination
+    """
+    metadata, data = list_book_pagination(
         session=session,
+        db=db,
+        page_size=page_size,
+        filter_dict=plan["filter"],
+        hint=plan["hint"],
+        sort=sort,
+        after=after,
+        before=before,
+        count_cap=count_cap,
+        from_summary=from_summary,
     )
-    books_data = list(books)
-    if not books_data[0]["metadata"] or not books_data[0]["data"]:
-        return None, None
-    return books_data[0]["metadata"][0], books_data[0]["data"]
+    if data is not None:
+        covers.get_covers(
+            session=session, db=db, book_ids=[book["_id"] for book in data]
+        )
+    return metadata, data
+
+
+def ask_sort() -> str:
+    """
+    Ask the sort order of a list of books
+
+    Returns: name of a sort order of query.SORT_ORDERS
+    """
+    sort_names = list(query.SORT_ORDERS)
+    print("-" * 79)
+    print("Sort by")
+    print("-" * 79)
+    for i in range(len(sort_names)):
+        print(f"{i+1}. {sort_names[i].capitalize()}")
+    print("-" * 79)
+    choice = get_choice("Enter your choice: ", len(sort_names))
+    return sort_names[choice - 1]
 
 
 def print_books(
@@ -1208,8 +1847,10 @@ def print_books(
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
     title: str,
-    filter_dict: dict = None,
-    file_type: str = "ALL",
+    predicates: list = None,
+    suggest: tuple = None,
+    show_plan: bool = False,
+    count_cap: int = None,
 ):
     """
     print book with pagination and filter
@@ -1217,136 +1858,305 @@ def print_books(
         session: session to connect to the database
         db: use in which database
         title: title of this print
-        filter_dict: filter to apply with books
-        file_type: file type to filter books
+        predicates: predicates of the query module to filter books, None
+            for every book
+        suggest: (autocomplete field, search term) to suggest other terms
+            when nothing is found
+        show_plan: print the chosen index and the estimated matches
+        count_cap: count at most this many books, None to count every match
     """
     page = 1
     page_size = 5
-    while True:
-        print("-" * 79)
-        print(title)
-        print("-" * 79)
-        metadata, data = list_book_pagination(
-            session=session,
-            db=db,
-            page=page,
-            page_size=page_size,
-            filter_dict=filter_dict,
-            file_type=file_type,
-        )
-        if metadata is None:
-            print()
-            print("No books found")
-            print()
+    sort = query.DEFAULT_SORT
+    after = None
+    before = None
+    # the index depends on the sort order, plan once per sort order
+    plans = {}
+    from_summary = summary.can_answer(predicates or [])
+    # the prefetch threads stop when the user leaves the list
+    with prefetch.Prefetcher(db) as prefetcher:
+        while True:
+            if sort not in plans:
+                plans[sort] = query.plan_query(
+                    session=session,
+                    db=db,
+                    predicates=predicates or [],
+                    sort=sort,
+                    page_size=page_size,
+                )
+                if show_plan:
+                    print("-" * 79)
+                    for predicate, estimate in plans[sort]["estimates"]:
+                        print(f"{predicate['field']}: about {estimate} books")
+                    print(f"Index: {plans[sort]['index'] or 'chosen by the server'}")
+            plan = plans[sort]
             print("-" * 79)
-            print("1. Back to Main Menu")
+            print(title)
             print("-" * 79)
-            choice = get_choice("Enter your choice: ", 1)
-            if choice == 1:
-                break
-            continue
+            metadata, data = prefetcher.get(
+                (sort, after, before),
+                read_page,
+                session=session,
+                db=db,
+                page_size=page_size,
+                plan=plan,
+                sort=sort,
+                after=after,
+                before=before,
+                count_cap=count_cap,
+                from_summary=from_summary,
+            )
+            if metadata is None:
+                print()
+                print("No books found")
+                if suggest is not None:
+                    index = autocomplete.get_index(session=session, db=db)
+                    suggestions = index.did_you_mean(*suggest)
+                    if suggestions:
+                        print(f"Did you mean: {', '.join(suggestions)}")
+                print()
+                print("-" * 79)
+                print("1. Back to Main Menu")
+                print("-" * 79)
+                choice = get_choice("Enter your choice: ", 1)
+                if choice == 1:
+                    break
+                continue
 
-        if data is None:
-            print()
-            print("No books found")
-            print()
-            print("-" * 79)
-            print("1. Back to Main Menu")
+            total_page = metadata["total_count"] // page_size
+            if metadata["total_count"] % page_size != 0:
+                total_page += 1
+            if metadata["more"]:
+                print(f"Page {page} of more than {total_page}, sorted by {sort}")
+            else:
+                print(f"Page {page} of {total_page}, sorted by {sort}")
+
+            # one query for the covers of the page that are not cached
+            page_covers = covers.get_covers(
+                session=session, db=db, book_ids=[book["_id"] for book in data]
+            )
+            for i in range(len(data)):
+                cover = page_covers.get(data[i]["_id"])
+                if cover is not None and cover["width"]:
+                    size = f"{cover['width']}x{cover['height']}"
+                    print(f"{i+1}. {data[i]['title']} [cover {size}]")
+                elif cover is not None:
+                    print(f"{i+1}. {data[i]['title']} [cover]")
+                else:
+                    print(f"{i+1}. {data[i]['title']}")
+
+            # read the pages next to this one and the books on it while the
+            # user chooses, what is not used is cancelled
+            sort_keys = query.SORT_ORDERS[sort]
+            next_position = None
+            if metadata["has_next"]:
+                next_position = (query.sort_values(data[-1], sort_keys), None)
+            previous_position = None
+            if page > 2:
+                previous_position = (None, query.sort_values(data[0], sort_keys))
+            elif page == 2:
+                # the first page is read from the start, books added before
+                # the first book of the page are shown too
+                previous_position = (None, None)
+            positions = [
+                position
+                for position in [next_position, previous_position]
+                if position is not None
+            ]
+            book_keys = [("book", book["_id"]) for book in data]
+            prefetcher.keep([(sort, *position) for position in positions] + book_keys)
+            for position_after, position_before in positions:
+                prefetcher.submit(
+                    (sort, position_after, position_before),
+                    read_page,
+                    session=session,
+                    db=db,
+                    page_size=page_size,
+                    plan=plan,
+                    sort=sort,
+                    after=position_after,
+                    before=position_before,
+                    count_cap=count_cap,
+                    from_summary=from_summary,
+                )
+            for book in data:
+                prefetcher.submit(
+                    ("book", book["_id"]),
+                    get_book_data,
+                    session=session,
+                    db=db,
+                    book_id=book["_id"],
+                )
+
+            options = []
+            if metadata["has_next"]:
+                options.append("Next Page")
+            if page > 1:
+                options.append("Previous Page")
+            options.append("Change sort order")
+            options.append("Download all books")
+            options.append("Edit all books")
+            options.append("Export all books")
+            options.append("Back to Main Menu")
+            for i in range(len(options)):
+                print(f"{len(data)+i+1}. {options[i]}")
             print("-" * 79)
-            choice = get_choice("Enter your choice: ", 1)
-            if choice == 1:
-                break
-            continue
+            choice = get_choice("Enter your choice: ", len(data) + len(options))
+            if choice > len(data):
+                match options[choice - len(data) - 1]:
+                    case "Next Page":
+                        page += 1
+                        after, before = next_position
+                    case "Previous Page":
+                        page -= 1
+                        after, before = previous_position
+                    case "Change sort order":
+                        sort = ask_sort()
+                        page = 1
+                        after = None
+                        before = None
+                    case "Download all books":
+                        download_books_menu(
+                            session=session,
+                            db=db,
+                            filter_dict=plan["filter"],
+                        )
+                    case "Edit all books":
+                        edit_books_menu(
+                            session=session,
+                            db=db,
+                            filter_dict=plan["filter"],
+                        )
+                    case "Export all books":
+                        export_books_menu(
+                            session=session,
+                            db=db,
+                            filter_dict=plan["filter"],
+                        )
+                    case "Back to Main Menu":
+                        break
+                continue
+            book_id = data[choice - 1]["_id"]
+            book = prefetcher.get(
+                ("book", book_id),
+                get_book_data,
+                session=session,
+                db=db,
+                book_id=book_id,
+            )
+            # the book menu can edit books, what was read before can be stale
+            prefetcher.clear()
+            book_data_menu(session=session, db=db, book_id=book_id, book=book)
 
-        total_page = metadata["total_count"] // page_size
-        if metadata["total_count"] % page_size != 0:
-            total_page += 1
-        print(f"Page {page} of {total_page}")
 
-        for i in range(len(data)):
-            print(f"{i+1}. {data[i]['title']}")
+def ask_file_type() -> str:
+    """
+    Ask the file type to search
 
-        i = len(data)
-        if page < total_page:
-            print(f"{i+1}. Next Page")
+    Returns: "EPUB", "PDF" or "ALL"
+    """
+    while True:
+        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
+        if file_type not in ["EPUB", "PDF", "ALL"]:
+            print("Invalid input")
+            continue
+        break
+    return file_type
 
-        if page > 1:
-            if page == total_page:
-                print(f"{i+1}. Previous Page")
-                print(f"{i+2}. Back to Main Menu")
-                print("-" * 79)
-                choice = get_choice("Enter your choice: ", i + 2)
-                if choice == i + 1:
-                    page -= 1
-                    continue
-                elif choice == i + 2:
-                    break
-            else:
-                print(f"{i+2}. Previous Page")
-                print(f"{i+3}. Back to Main Menu")
-                print("-" * 79)
-                choice = get_choice("Enter your choice: ", i + 3)
-                if choice == i + 1:
-                    page += 1
-                    continue
-                elif choice == i + 2:
-                    page -= 1
-                    continue
-                elif choice == i + 3:
-                    break
-        else:
-            if page == total_page:
-                print(f"{i+1}. Back to Main Menu")
-                print("-" * 79)
-                choice = get_choice("Enter your choice: ", i + 1)
-                if choice == i + 1:
-                    break
-            else:
-                print(f"{i+2}. Back to Main Menu")
-                print("-" * 79)
-                choice = get_choice("Enter your choice: ", i + 2)
-                if choice == i + 1:
-                    page += 1
-                    continue
-                elif choice == i + 2:
-                    break
-        book_data_menu(session=session, db=db, book_id=data[choice - 1]["_id"])
+
+def search_books(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    title: str,
+    predicates: list,
+    file_type: str = "ALL",
+    suggest: tuple = None,
+    show_plan: bool = False,
+):
+    """
+    Search books with the predicates of the query module and print them
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        title: title of this print
+        predicates: list of predicates
+        file_type: "EPUB", "PDF" or "ALL"
+        suggest: (autocomplete field, search term) for "did you mean"
+        show_plan: print the chosen index and the estimated matches
+    """
+    if file_type != "ALL":
+        predicates = predicates + [query.equals("file_type", file_type)]
+    print_books(
+        session=session,
+        db=db,
+        title=title,
+        predicates=predicates,
+        suggest=suggest,
+        show_plan=show_plan,
+        count_cap=counts.COUNT_CAP,
+    )
 
 
-def search_books_by_title(
+def search_books_by_field(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
+    title: str,
+    field: str,
+    suggest_field: str = None,
 ):
     """
-    Search books by title
+    Search books by a term in one field
     Args:
         session: session to connect to the database
         db: use in which database
+        title: title of this search
+        field: path of the searched field
+        suggest_field: autocomplete field of the searched field, if any
     """
-    title = "Search by title"
     print("-" * 79)
     print(title)
     print("-" * 79)
     while True:
-        search = input("Enter the search term: ")
+        if suggest_field is not None:
+            search = autocomplete.prompt(
+                "Enter the search term: ", suggest_field, session=session, db=db
+            )
+        else:
+            search = input("Enter the search term: ")
         if search == "":
             print("Invalid input")
             continue
         break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"title": {"$regex": search, "$options": "i"}}
-    print_books(
+    file_type = ask_file_type()
+    search_books(
+        session=session,
+        db=db,
+        title=title,
+        predicates=[query.contains(field, search)],
+        file_type=file_type,
+        suggest=(suggest_field, search) if suggest_field is not None else None,
+    )
+
+
+def search_books_by_title(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+):
+    """
+    Search books by title
+    Args:
+        session: session to connect to the database
+        db: use in which database
+    """
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by title",
+        field="title",
+        suggest_field="title",
     )
 
 
@@ -1361,32 +2171,12 @@ def search_books_by_author_name(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by author name"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {
-        "author": {"$elemMatch": {"name": {"$regex": search, "$options": "i"}}}
-    }
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by author name",
+        field="author.name",
+        suggest_field="author",
     )
 
 
@@ -1401,31 +2191,12 @@ def search_books_by_author_pseudonym(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by author pseudonym"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {
-        "author": {"$elemMatch": {"pseudonym": {"$regex": search, "$options": "i"}}}
-    }
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by author pseudonym",
+        field="author.pseudonym",
+        suggest_field="pseudonym",
     )
 
 
@@ -1440,29 +2211,12 @@ def search_books_by_genre(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by genre"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"genres": {"$regex": search, "$options": "i"}}
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by genre",
+        field="genres",
+        suggest_field="genre",
     )
 
 
@@ -1472,34 +2226,17 @@ def search_books_by_sub_genre(
     db: pymongo.mongo_client.database.Database,
 ):
     """
-    Search books by sub genre
+    Search books by sub-genre
     Args:
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by sub-genre"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"sub_genres": {"$regex": search, "$options": "i"}}
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by sub-genre",
+        field="sub_genres",
+        suggest_field="sub_genre",
     )
 
 
@@ -1514,29 +2251,8 @@ def search_books_by_set_year(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by set year"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"set_year": {"$regex": search, "$options": "i"}}
-    print_books(
-        session=session,
-        db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+    search_books_by_field(
+        session=session, db=db, title="Search by set year", field="set_year"
     )
 
 
@@ -1551,29 +2267,11 @@ def search_books_by_set_main_location(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by set country"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"set_main_location": {"$regex": search, "$options": "i"}}
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by set main location",
+        field="set_main_location",
     )
 
 
@@ -1588,29 +2286,12 @@ def search_books_by_main_character(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by main character"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"main_characters": {"$regex": search, "$options": "i"}}
-    print_books(
+    search_books_by_field(
         session=session,
         db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+        title="Search by main character",
+        field="main_characters",
+        suggest_field="character",
     )
 
 
@@ -1625,29 +2306,8 @@ def search_books_by_language(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by language"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"language": {"$regex": search, "$options": "i"}}
-    print_books(
-        session=session,
-        db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
+    search_books_by_field(
+        session=session, db=db, title="Search by language", field="language"
     )
 
 
@@ -1662,112 +2322,155 @@ def search_books_by_isbn(
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by ISBN"
-    print("-" * 79)
-    print(title)
-    print("-" * 79)
+    search_books_by_field(session=session, db=db, title="Search by ISBN", field="ISBN")
+
+
+def search_books_by_copy_right(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+):
+    """
+    Search books by copy right
+    Args:
+        session: session to connect to the database
+        db: use in which database
+    """
+    search_books_by_field(
+        session=session, db=db, title="Search by copy right", field="copy_right"
+    )
+
+
+def ask_year(prompt: str) -> int | None:
+    """
+    Ask a year that can be left empty
+
+    Args:
+        prompt: Text to display to the user
+
+    Returns: The year or None
+    """
     while True:
-        search = input("Enter the search term: ")
-        if search == "":
+        year = input(prompt)
+        if year == "":
+            return None
+        if not year.isdigit() or not 1 <= int(year) <= 9998:
             print("Invalid input")
             continue
-        break
+        return int(year)
+
+
+def search_books_by_published_year(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+):
+    """
+    Search books by published year
+    Args:
+        session: session to connect to the database
+        db: use in which database
+    """
+    title = "Search by published year"
+    print("-" * 79)
+    print(title)
+    print("-" * 79)
     while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
+        year = ask_year("Enter the search term: ")
+        if year is None:
             print("Invalid input")
             continue
         break
-    filter_dict = {"ISBN": {"$regex": search, "$options": "i"}}
-    print_books(
+    file_type = ask_file_type()
+    search_books(
         session=session,
         db=db,
         title=title,
-        filter_dict=filter_dict,
+        predicates=[query.published_between(year, year)],
         file_type=file_type,
     )
 
 
-def search_books_by_copy_right(
+def search_books_combined(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
 ):
     """
-    Search books by copy right
+    Search books by several fields at once, empty answers are skipped
     Args:
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by ISBN"
+    title = "Combined search"
     print("-" * 79)
     print(title)
     print("-" * 79)
-    while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
-            print("Invalid input")
-            continue
-        break
-    filter_dict = {"copy_right": {"$regex": search, "$options": "i"}}
-    print_books(
+    predicates = []
+    for field, suggest_field, label in COMBINED_SEARCH_FIELDS:
+        search = autocomplete.prompt(
+            f"Enter the {label} (empty to skip): ",
+            suggest_field,
+            session=session,
+            db=db,
+        )
+        if search != "":
+            predicates.append(query.contains(field, search))
+    language = input("Enter the language (empty to skip): ")
+    if language != "":
+        predicates.append(query.equals("language", language))
+    first_year = ask_year("Published from year (empty to skip): ")
+    last_year = ask_year("Published until year (empty to skip): ")
+    if first_year is not None or last_year is not None:
+        predicates.append(query.published_between(first_year, last_year))
+    file_type = ask_file_type()
+    search_books(
         session=session,
         db=db,
         title=title,
-        filter_dict=filter_dict,
+        predicates=predicates,
         file_type=file_type,
+        show_plan=True,
     )
 
 
-def search_books_by_published_year(
+def search_books_content(
     *,
     session: pymongo.mongo_client.client_session,
     db: pymongo.mongo_client.database.Database,
 ):
     """
-    Search books by published year
+    Search a phrase inside the content of every book
     Args:
         session: session to connect to the database
         db: use in which database
     """
-    title = "Search by published year"
+    title = "Search inside books"
     print("-" * 79)
     print(title)
     print("-" * 79)
     while True:
-        search = input("Enter the search term: ")
-        if search == "":
-            print("Invalid input")
-            continue
-        if not search.isdigit():
-            print("Invalid input")
-            continue
-        break
-    while True:
-        file_type = input("Enter the file type (EPUB or PDF or ALL): ")
-        if file_type not in ["EPUB", "PDF", "ALL"]:
+        search = input("Enter the phrase: ")
+        if search.strip() == "":
             print("Invalid input")
             continue
         break
-    filter_dict = {
-        "$and": [
-            {"published_date": {"$gt": datetime.datetime(int(search), 1, 1)}},
-            {"published_date": {"$lt": datetime.datetime(int(search), 12, 31)}},
-        ]
-    }
-    print_books(
-        session=session,
-        db=db,
-        title=title,
-        filter_dict=filter_dict,
-        file_type=file_type,
-    )
+    hits = book_text.search_text(session=session, db=db, phrase=search)
+    print("-" * 79)
+    print(title)
+    print("-" * 79)
+    if not hits:
+        print()
+        print("No books found")
+        print()
+    for i in range(len(hits)):
+        print(f"{i+1:2d}. {hits[i]['title']} ({hits[i]['location']})")
+        print(f"    {hits[i]['snippet']}")
+    print(f"{len(hits)+1:2d}. Back to Main Menu")
+    print("-" * 79)
+    choice = get_choice("Enter your choice: ", len(hits) + 1)
+    if choice <= len(hits):
+        book_data_menu(session=session, db=db, book_id=hits[choice - 1]["book_id"])
 
 
 def search_books_menu(
@@ -1796,9 +2499,11 @@ def search_books_menu(
     print("10. Search by published year")
     print("11. Search by copy right")
     print("12. Search by ISBN")
-    print("13. Back to Main Menu")
+    print("13. Search inside books")
+    print("14. Combined search")
+    print("15. Back to Main Menu")
     print("-" * 79)
-    choice = get_choice("Enter your choice: ", 13)
+    choice = get_choice("Enter your choice: ", 15)
     match choice:
         case 1:
             search_books_by_title(session=session, db=db)
@@ -1825,6 +2530,10 @@ def search_books_menu(
         case 12:
             search_books_by_isbn(session=session, db=db)
         case 13:
+            search_books_content(session=session, db=db)
+        case 14:
+            search_books_combined(session=session, db=db)
+        case 15:
             pass
 
 
@@ -1840,9 +2549,10 @@ def main_menu():
     print("1. Add a book")
     print("2. List all books")
     print("3. Search for a book")
-    print("4. Exit")
+    print("4. Jobs")
+    print("5. Exit")
     print("-" * 79)
-    choice = get_choice("Enter your choice: ", 4)
+    choice = get_choice("Enter your choice: ", 5)
     return choice
 
 
@@ -1853,10 +2563,16 @@ def main():
     Returns: EXIT_SUCCESS or EXIT_FAILURE
     """
     with (
-        pymongo.MongoClient(URI) as client,
+        get_client("interactive") as client,
         client.start_session(causal_consistency=True) as session,
     ):
         db = client.get_database("books")
+        book_text.ensure_text_index(db=db)
+        query.ensure_indexes(session=session, db=db)
+        summary.ensure_summary(session=session, db=db)
+        blob_storage.ensure_storage(session=session, db=db)
+        # the jobs left queued by the last run start again
+        jobs.start(db=db, runners=JOB_RUNNERS)
 
         try:
             while True:
@@ -1868,16 +2584,44 @@ def main():
                 elif choice == 3:
                     search_books_menu(session=session, db=db)
                 elif choice == 4:
+                    jobs_menu(session=session, db=db)
+                elif choice == 5:
                     print("Goodbye!")
                     break
         except KeyboardInterrupt:
             print("")
             print("Goodbye!")
+        running = jobs.running_count()
+        if running:
+            print(f"Waiting for {running} running jobs, the queued ones run next time")
+        jobs.shutdown(wait=True)
+        # store the text of books that are still being extracted
+        book_text.shutdown(wait=True)
     return EXIT_SUCCESS
 
 
+COMBINED_SEARCH_FIELDS = [
+    ("title", "title", "title"),
+    ("author.name", "author", "author name"),
+    ("genres", "genre", "genre"),
+]
+# string fields that can be set on every book of a list
+BULK_EDIT_FIELDS = [
+    ("language", "language"),
+    ("set_year", "set year"),
+    ("set_main_location", "set main location"),
+    ("copy_right", "copy right"),
+]
+# functions that run the jobs of the jobs collection by kind
+JOB_RUNNERS = {
+    "add_book": run_add_book,
+    "change_file": run_change_file,
+    "download": run_download,
+    "bulk_edit": run_bulk_edit,
+    "export": run_export,
+    "gc": run_collect_garbage,
+}
 EXIT_SUCCESS = 0
 EXIT_FAILURE = 1
-URI = "mongodb://localhost:27017/"
 if __name__ == "__main__":
-    SystemExit(main())
+    sys.exit(main())
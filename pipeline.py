@@ -0,0 +1,408 @@
+import os
+import queue
+import threading
+import time
+import pymongo
+import blob_storage
+import book_text
+import bulk_loader
+import covers
+from book_storage import BadEpub
+from schema import BadBook, book_violations
+
+
+class StageStats:
+    """Time the threads of a stage spend working and waiting on the queues"""
+
+    def __init__(self, name: str, threads: int):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items: int = 0, busy=0.0, input_wait=0.0, output_wait=0.0):
+        """
+        Add the work of one step of a thread
+
+        Args:
+            items: number of books handled
+            busy: seconds of work
+            input_wait: seconds waiting for the stage before
+            output_wait: seconds waiting for the stage after (backpressure)
+        """
+        with self.lock:
+            self.items += items
+            self.busy += busy
+            self.input_wait += input_wait
+            self.output_wait += output_wait
+
+    def report(self, seconds: float) -> dict:
+        """
+        Get the utilization of the stage
+
+        Args:
+            seconds: wall time of the load
+
+        Returns: name, threads, items and the busy, starved and blocked
+            parts of the time of its threads
+        """
+        total = max(seconds * self.threads, 1e-9)
+        return {
+            "stage": self.name,
+            "threads": self.threads,
+            "items": self.items,
+            "busy": self.busy / total,
+            "starved": self.input_wait / total,
+            "blocked": self.output_wait / total,
+        }
+
+
+def timed_get(source: queue.Queue, stats: StageStats, timeout: float = None):
+    """
+    Take the next item of a queue and count the wait
+
+    Args:
+        source: the queue
+        stats: stats of the stage that waits
+        timeout: seconds to wait, None to wait until there is an item
+
+    Returns: The item
+    """
+    start = time.perf_counter()
+    try:
+        return source.get(timeout=timeout)
+    finally:
+        stats.add(input_wait=time.perf_counter() - start)
+
+
+def timed_put(target: queue.Queue, item, stats: StageStats) -> None:
+    """
+    Put an item in a bounded queue and count the wait, a full queue holds
+    the stage back until the next stage catches up
+
+    Args:
+        target: the queue
+        item: the item
+        stats: stats of the stage that waits
+    """
+    start = time.perf_counter()
+    target.put(item)
+    stats.add(output_wait=time.perf_counter() - start)
+
+
+def load_pipeline(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    books,
+    batch_size: int = 500,
+    uploaders: int = None,
+    queue_size: int = None,
+    on_error=None,
+) -> dict:
+    """
+    Add or update books like bulk_loader.add_books_incremental, with the
+    reads, hashes, uploads and metadata writes of different books running
+    at the same time. Each stage runs in its own threads and hands books to
+    the next one through a bounded queue, so a slow stage holds back the
+    stages before it instead of letting books pile up in memory:
+
+    reader -> hasher/validator -> uploader pool -> batched writer
+
+    The writer runs in this thread, the only one that uses session
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        books: iterable of books to add to the database
+        batch_size: number of books per upsert batch
+        uploaders: number of upload threads, PIPELINE_UPLOADERS if
+            None
+        queue_size: number of books each queue holds, PIPELINE_QUEUE_SIZE
+            if None
+        on_error: function(book, error_message) called for books that are
+            invalid or whose file can not be stored, the error is raised if
+            not given
+
+    Returns: number of books skipped, updated, uploaded and rejected and
+        the utilization of every stage
+    """
+    uploaders = uploaders or PIPELINE_UPLOADERS
+    queue_size = queue_size or PIPELINE_QUEUE_SIZE
+    bulk_loader.ensure_natural_key_index(session=session, db=db)
+    stats = {"skipped": 0, "updated": 0, "uploaded": 0, "rejected": 0}
+    stats_lock = threading.Lock()
+    read_queue = queue.Queue(maxsize=queue_size)
+    upload_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    read_stats = StageStats("reader", 1)
+    hash_stats = StageStats("hasher/validator", 1)
+    upload_stats = StageStats("uploader", uploaders)
+    write_stats = StageStats("writer", 1)
+    # set by the first error that stops the load, the stages keep draining
+    # their queues without working so no stage blocks on a full queue
+    stop = threading.Event()
+    errors = []
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+
+    def reject(book, error_message):
+        if on_error is None:
+            errors.append(error_message)
+            stop.set()
+            return
+        with stats_lock:
+            stats["rejected"] += 1
+            on_error(book, error_message)
+
+    def read():
+        try:
+            iterator = iter(books)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    book = next(iterator)
+                except StopIteration:
+                    break
+                try:
+                    stat = os.stat(book["file_path"])
+                except FileNotFoundError:
+                    stat = None
+                read_stats.add(items=1, busy=time.perf_counter() - start)
+                timed_put(read_queue, (book, stat), read_stats)
+        except Exception as error_message:
+            errors.append(error_message)
+            stop.set()
+        finally:
+            timed_put(read_queue, _DONE, read_stats)
+
+    def check(items):
+        valid = []
+        for book, stat in items:
+            violations = book_violations(book)
+            if violations:
+                reject(book, BadBook(violations))
+                continue
+            if stat is None:
+                reject(
+                    book,
+                    BadEpub(f'specified file "{book["file_path"]}" does not exist.'),
+                )
+                continue
+            book["natural_key"] = bulk_loader.natural_key(book)
+            valid.append((book, stat))
+        # a row repeated in the batch is loaded once, with its last values
+        unique = bulk_loader.last_by_natural_key(valid, lambda item: item[0])
+        for _ in range(len(valid) - len(unique)):
+            count("skipped")
+        valid = unique
+        # one query for the checkpoint of every book that is waiting
+        checkpoint = bulk_loader.load_checkpoint(
+            session=None, db=db, keys=[book["natural_key"] for book, _ in valid]
+        )
+        stored_files = blob_storage.existing_files(
+            db=db, documents=list(checkpoint.values())
+        )
+        routed = []
+        for book, stat in valid:
+            entry = checkpoint.get(book["natural_key"])
+            if (
+                entry is not None
+                and entry["size"] == stat.st_size
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["metadata_hash"] == bulk_loader.metadata_hash(book)
+            ):
+                count("skipped")
+                continue
+            book["file_hash"] = bulk_loader.file_hash(book["file_path"])
+            if (
+                entry is not None
+                and entry["file_hash"] == book["file_hash"]
+                and blob_storage.file_key(entry) in stored_files
+            ):
+                book.update(blob_storage.file_fields(entry))
+                count("updated")
+                routed.append((write_queue, (book, stat, False)))
+            else:
+                routed.append((upload_queue, (book, stat)))
+        return routed
+
+    def hash_books():
+        try:
+            done = False
+            while not done:
+                items = [timed_get(read_queue, hash_stats)]
+                # take every book that is already waiting, up to a batch
+                while len(items) < batch_size:
+                    try:
+                        items.append(read_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if _DONE in items:
+                    items.remove(_DONE)
+                    done = True
+                if stop.is_set() or not items:
+                    continue
+                start = time.perf_counter()
+                try:
+                    routed = check(items)
+                except Exception as error_message:
+                    errors.append(error_message)
+                    stop.set()
+                    continue
+                hash_stats.add(items=len(items), busy=time.perf_counter() - start)
+                for target, item in routed:
+                    timed_put(target, item, hash_stats)
+        finally:
+            for _ in range(uploaders):
+                timed_put(upload_queue, _DONE, hash_stats)
+            timed_put(write_queue, _DONE, hash_stats)
+
+    def upload():
+        try:
+            while True:
+                item = timed_get(upload_queue, upload_stats)
+                if item is _DONE:
+                    break
+                if stop.is_set():
+                    continue
+                book, stat = item
+                start = time.perf_counter()
+                try:
+                    book.update(
+                        blob_storage.save_file(
+                            db=db,
+                            session=None,
+                            file_name=book["file_name"],
+                            file_path=book["file_path"],
+                        )
+                    )
+                except BadEpub as error_message:
+                    reject(book, error_message)
+                    continue
+                except Exception as error_message:
+                    errors.append(error_message)
+                    stop.set()
+                    continue
+                finally:
+                    upload_stats.add(items=1, busy=time.perf_counter() - start)
+                count("uploaded")
+                timed_put(write_queue, (book, stat, True), upload_stats)
+        finally:
+            timed_put(write_queue, _DONE, upload_stats)
+
+    def flush(batch):
+        if not batch or stop.is_set():
+            return
+        start = time.perf_counter()
+        # two check batches can both have a row of the same book
+        batch = bulk_loader.last_by_natural_key(batch, lambda item: item[0])
+        for book, _, _ in batch:
+            if book["file_path"][-5:] == ".epub":
+                book["file_type"] = "EPUB"
+            elif book["file_path"][-4:] == ".pdf":
+                book["file_type"] = "PDF"
+        try:
+            bulk_loader.write_batch(
+                session=session,
+                db=db,
+                batch=[
+                    (book, bulk_loader.checkpoint_entry(book, stat))
+                    for book, stat, _ in batch
+                ],
+            )
+        except Exception as error_message:
+            errors.append(error_message)
+            stop.set()
+            return
+        # write_batch sets the _id of every book in the batch
+        for book, _, uploaded in batch:
+            if uploaded:
+                book_text.schedule_extraction(
+                    db=db, book_id=book["_id"], file_path=book["file_path"]
+                )
+                covers.schedule_cover(
+                    db=db, book_id=book["_id"], file_path=book["file_path"]
+                )
+        write_stats.add(items=len(batch), busy=time.perf_counter() - start)
+
+    threads = [threading.Thread(target=read), threading.Thread(target=hash_books)]
+    threads += [threading.Thread(target=upload) for _ in range(uploaders)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    # one end marker from the hasher and one from every uploader
+    producers = 1 + uploaders
+    batch = []
+    while producers > 0:
+        try:
+            item = timed_get(write_queue, write_stats, timeout=FLUSH_SECONDS)
+        except queue.Empty:
+            # write what is waiting while the other stages are slow
+            flush(batch)
+            batch = []
+            continue
+        if item is _DONE:
+            producers -= 1
+            continue
+        if stop.is_set():
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    stats["seconds"] = seconds
+    stats["stages"] = [
+        stage.report(seconds)
+        for stage in [read_stats, hash_stats, upload_stats, write_stats]
+    ]
+    return stats
+
+
+def print_stages(stats: dict) -> None:
+    """
+    Print the utilization of the stages of a load, the stage that is busy
+    the most is the bottleneck and the stages before it are blocked
+
+    Args:
+        stats: result of load_pipeline
+
+    Returns: None
+    """
+    print("-" * 79)
+    print(
+        f"{'stage':<18} {'threads':>7} {'books':>8} {'busy':>6} "
+        f"{'starved':>8} {'blocked':>8}"
+    )
+    print("-" * 79)
+    for stage in stats["stages"]:
+        print(
+            f"{stage['stage']:<18} {stage['threads']:>7} {stage['items']:>8} "
+            f"{stage['busy']:>6.0%} {stage['starved']:>8.0%} {stage['blocked']:>8.0%}"
+        )
+    print("-" * 79)
+    rate = sum(stats[key] for key in ["skipped", "updated", "uploaded"]) / max(
+        stats["seconds"], 1e-9
+    )
+    print(f"{rate:.0f} books/s")
+    return
+
+
+# GridFS uploads wait on the network and the disk, not on the GIL
+PIPELINE_UPLOADERS = 4
+# books in flight between two stages, bounds the memory of the load
+PIPELINE_QUEUE_SIZE = 64
+# the writer writes a partial batch after waiting this long for a book
+FLUSH_SECONDS = 1.0
+_DONE = object()
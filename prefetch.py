@@ -0,0 +1,110 @@
+import concurrent.futures
+import pymongo
+
+
+class Prefetcher:
+    """Read what the user will likely ask for next in background threads"""
+
+    def __init__(
+        self, db: pymongo.mongo_client.database.Database, workers: int = None
+    ):
+        self.client = db.client
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or PREFETCH_WORKERS, thread_name_prefix="prefetch"
+        )
+        self.futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(
+        self,
+        key,
+        function,
+        *,
+        session: pymongo.mongo_client.client_session,
+        **kwargs,
+    ) -> None:
+        """
+        Start function(session=..., **kwargs) in a worker thread unless key
+        is already started. A session can not be shared between threads, the
+        worker uses its own causal session that has seen every write of
+        session so it reads the user's own edits
+
+        Args:
+            key: what is read, a hashable value
+            function: function to read it
+            session: session of the user
+            kwargs: arguments of function
+        """
+        if key in self.futures:
+            return
+        cluster_time = session.cluster_time
+        operation_time = session.operation_time
+
+        def run():
+            with self.client.start_session(causal_consistency=True) as worker_session:
+                if cluster_time is not None:
+                    worker_session.advance_cluster_time(cluster_time)
+                if operation_time is not None:
+                    worker_session.advance_operation_time(operation_time)
+                return function(session=worker_session, **kwargs)
+
+        self.futures[key] = self.executor.submit(run)
+
+    def get(
+        self,
+        key,
+        function,
+        *,
+        session: pymongo.mongo_client.client_session,
+        **kwargs,
+    ):
+        """
+        Get what was prefetched for key, waiting if it is still being read,
+        or read it now with session if it was not prefetched or failed
+
+        Args:
+            key: what is read
+            function: function to read it
+            session: session of the user
+            kwargs: arguments of function
+
+        Returns: The result of function
+        """
+        future = self.futures.pop(key, None)
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except pymongo.errors.PyMongoError:
+                # read it again below so the error is shown to the user
+                pass
+        return function(session=session, **kwargs)
+
+    def keep(self, keys) -> None:
+        """
+        Cancel the prefetches that are not in keys, what was prefetched for
+        a page the user left is not needed anymore
+
+        Args:
+            keys: keys to keep
+        """
+        keys = set(keys)
+        for key in list(self.futures):
+            if key not in keys:
+                self.futures.pop(key).cancel()
+
+    def clear(self) -> None:
+        """Cancel every prefetch, after a write what was read can be stale"""
+        self.keep([])
+
+    def close(self) -> None:
+        """Cancel every prefetch and stop the threads without waiting"""
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+PREFETCH_WORKERS = 2
@@ -0,0 +1,451 @@
+import datetime
+import re
+import time
+import pymongo
+from connection import catalogue_reads
+from schema import BOOKS_INDEXES
+
+
+def contains(field: str, term: str) -> dict:
+    """
+    Predicate for a field that contains a term, ignoring case, the term is
+    a regular expression like in the search menu
+
+    Args:
+        field: path of the field, "author.name" for the names of the authors
+        term: the term
+
+    Returns: The predicate
+    """
+    return {"field": field, "op": "contains", "value": term}
+
+
+def equals(field: str, value) -> dict:
+    """
+    Predicate for a field equal to a value, for a list any item can be equal
+
+    Args:
+        field: path of the field
+        value: the value
+
+    Returns: The predicate
+    """
+    return {"field": field, "op": "equals", "value": value}
+
+
+def between(field: str, lower=None, upper=None) -> dict:
+    """
+    Predicate for a field in [lower, upper)
+
+    Args:
+        field: path of the field
+        lower: lowest value, None for no lower bound
+        upper: value after the range, None for no upper bound
+
+    Returns: The predicate
+    """
+    return {"field": field, "op": "between", "value": (lower, upper)}
+
+
+def published_between(first_year: int = None, last_year: int = None) -> dict:
+    """
+    Predicate for books published from first_year to last_year
+
+    Args:
+        first_year: first year, None for no lower bound
+        last_year: last year included, None for no upper bound
+
+    Returns: The predicate
+    """
+    lower = datetime.datetime(first_year, 1, 1) if first_year is not None else None
+    upper = datetime.datetime(last_year + 1, 1, 1) if last_year is not None else None
+    return between("published_date", lower, upper)
+
+
+def to_filter(predicate: dict) -> dict:
+    """
+    Get the MongoDB filter of a predicate
+
+    Args:
+        predicate: the predicate
+
+    Returns: The filter
+    """
+    field = predicate["field"]
+    match predicate["op"]:
+        case "contains":
+            return {field: {"$regex": predicate["value"], "$options": "i"}}
+        case "equals":
+            return {field: predicate["value"]}
+        case "between":
+            lower, upper = predicate["value"]
+            bounds = {}
+            if lower is not None:
+                bounds["$gte"] = lower
+            if upper is not None:
+                bounds["$lt"] = upper
+            return {field: bounds}
+    raise ValueError(f"Unknown predicate {predicate['op']}")
+
+
+def field_values(book: dict, path: str) -> list:
+    """
+    Get the values of a dotted path in a book, through lists like MongoDB
+
+    Args:
+        book: the book
+        path: path of the field
+
+    Returns: list of the values
+    """
+    values = [book]
+    for part in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                value_list = value
+            else:
+                value_list = [value]
+            for item in value_list:
+                if isinstance(item, dict) and part in item:
+                    next_values.append(item[part])
+        values = next_values
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return flat
+
+
+def in_range(value, lower, upper) -> bool:
+    """
+    Check if a value is in [lower, upper), values of another type are not
+
+    Args:
+        value: the value
+        lower: lowest value, None for no lower bound
+        upper: value after the range, None for no upper bound
+
+    Returns: True if the value is in the range
+    """
+    try:
+        return (lower is None or value >= lower) and (upper is None or value < upper)
+    except TypeError:
+        return False
+
+
+def compile_predicate(predicate: dict):
+    """
+    Compile a predicate into a python check for the sample of books
+
+    Args:
+        predicate: the predicate
+
+    Returns: function(book) returning True if the book matches
+    """
+    field = predicate["field"]
+    match predicate["op"]:
+        case "contains":
+            try:
+                pattern = re.compile(predicate["value"], re.IGNORECASE)
+            except re.error:
+                # the server regex is not python regex, assume nothing is filtered
+                return lambda book: True
+            return lambda book: any(
+                isinstance(value, str) and pattern.search(value)
+                for value in field_values(book, field)
+            )
+        case "equals":
+            return lambda book: predicate["value"] in field_values(book, field)
+        case "between":
+            lower, upper = predicate["value"]
+            return lambda book: any(
+                in_range(value, lower, upper) for value in field_values(book, field)
+            )
+    raise ValueError(f"Unknown predicate {predicate['op']}")
+
+
+def get_sample(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> list:
+    """
+    Get a random sample of books to estimate how selective predicates are,
+    the sample is kept for SAMPLE_SECONDS
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: list of books with the searched fields
+    """
+    global _SAMPLE, _SAMPLE_TIME
+    if _SAMPLE is None or time.monotonic() - _SAMPLE_TIME > SAMPLE_SECONDS:
+        _SAMPLE = list(
+            catalogue_reads(db).books.aggregate(
+                [
+                    {"$sample": {"size": SAMPLE_SIZE}},
+                    {"$project": {field: 1 for field in SAMPLE_FIELDS}},
+                ],
+                session=session,
+            )
+        )
+        _SAMPLE_TIME = time.monotonic()
+    return _SAMPLE
+
+
+def index_for(field: str) -> list | None:
+    """
+    Get the index of BOOKS_INDEXES that starts with a field
+
+    Args:
+        field: path of the field
+
+    Returns: key pattern of the index or None
+    """
+    for index in BOOKS_INDEXES:
+        if index[0][0] == field:
+            return index
+    return None
+
+
+def index_name(index: list) -> str:
+    """
+    Get the name MongoDB gives an index
+
+    Args:
+        index: key pattern of the index
+
+    Returns: The name, "title_1" for [("title", 1)]
+    """
+    return "_".join(f"{key}_{direction}" for key, direction in index)
+
+
+def scan_cost(predicate: dict, selectivity: float, total: int) -> float:
+    """
+    Estimate the cost of answering a query from the index of a predicate,
+    in documents read. A range or equality reads only the matching keys, a
+    regex that ignores case reads every key of the index but keys are much
+    cheaper to read than documents
+
+    Args:
+        predicate: the predicate
+        selectivity: estimated part of the books that match it
+        total: number of books
+
+    Returns: The cost, total is the cost of a collection scan
+    """
+    if predicate["op"] == "contains":
+        return total * KEY_COST + selectivity * total
+    return selectivity * total * (1 + KEY_COST)
+
+
+def sort_index(sort_keys: list, equality_fields: list) -> tuple:
+    """
+    Find the index that returns books in a sort order, it can start with
+    fields that are filtered by equality (ESR: equality, sort, range)
+
+    Args:
+        sort_keys: sort order from SORT_ORDERS
+        equality_fields: fields filtered by equality
+
+    Returns: (key pattern, equality fields of its prefix) with the longest
+        prefix, (None, []) if no index has the sort order
+    """
+    reverse = [(field, -direction) for field, direction in sort_keys]
+    best = (None, [])
+    for index in BOOKS_INDEXES + [[("_id", 1)]]:
+        prefix = []
+        for field, _ in index:
+            if field not in equality_fields or field in prefix:
+                break
+            prefix.append(field)
+        # the sort can also start on an equality field, language then title
+        for length in range(len(prefix), -1, -1):
+            if index[length:] in [sort_keys, reverse]:
+                if best[0] is None or length > len(best[1]):
+                    best = (index, prefix[:length])
+                break
+    return best
+
+
+def sort_values(book: dict, sort_keys: list) -> tuple:
+    """
+    Get the values of the sort fields of a book, the position of the book
+    for keyset pagination
+
+    Args:
+        book: the book
+        sort_keys: sort order from SORT_ORDERS
+
+    Returns: tuple of the values
+    """
+    return tuple(book.get(field) for field, _ in sort_keys)
+
+
+def keyset_filter(sort_keys: list, values: tuple) -> dict:
+    """
+    Filter for the books after a position in a sort order, the next page
+    starts there without skipping over the books of the pages before
+
+    Args:
+        sort_keys: sort order, reversed to get the books before the position
+        values: sort_values of the book at the position
+
+    Returns: The filter
+    """
+    branches = []
+    for i, (field, direction) in enumerate(sort_keys):
+        branch = {
+            previous: value for (previous, _), value in zip(sort_keys[:i], values)
+        }
+        branch[field] = {"$gt" if direction == 1 else "$lt": values[i]}
+        branches.append(branch)
+    first_field, first_direction = sort_keys[0]
+    # a bound on the first field so the index scan starts at the position
+    bound = {first_field: {"$gte" if first_direction == 1 else "$lte": values[0]}}
+    return {"$and": [bound, {"$or": branches}]}
+
+
+def plan_query(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    predicates: list,
+    sort: str = None,
+    page_size: int = 5,
+) -> dict:
+    """
+    Build one filter from predicates, most selective first, and pick the
+    index hint with the lowest estimated cost from a sample of the books.
+    With a sort order the index of the sort order is a candidate too, it
+    reads books in order and stops when a page is full, the other indexes
+    have to read and sort every match
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        predicates: list of predicates
+        sort: name of a sort order of SORT_ORDERS, None for no order
+        page_size: number of books per page
+
+    Returns: filter, hint (None to let the server choose), index name and
+        the predicates with their estimated selectivity
+    """
+    sort_keys = SORT_ORDERS[sort] if sort is not None else None
+    if not predicates:
+        hint = sort_index(sort_keys, [])[0] if sort_keys is not None else None
+        return {
+            "filter": {},
+            "hint": hint,
+            "index": index_name(hint) if hint is not None else None,
+            "estimates": [],
+        }
+    sample = get_sample(session=session, db=db)
+    total = max(db.books.estimated_document_count(), 1)
+    estimates = []
+    for predicate in predicates:
+        check = compile_predicate(predicate)
+        matches = sum(1 for book in sample if check(book))
+        # smoothed so a predicate that matches nothing in the sample is not free
+        selectivity = (matches + 0.5) / (len(sample) + 1)
+        estimates.append((selectivity, predicate))
+    estimates.sort(key=lambda estimate: estimate[0])
+    # the predicates are assumed to be independent
+    matching = total
+    for selectivity, _ in estimates:
+        matching *= selectivity
+    sort_cost = matching * SORT_COST if sort_keys is not None else 0
+
+    hint = None
+    best_cost = total + sort_cost
+    for selectivity, predicate in estimates:
+        index = index_for(predicate["field"])
+        if index is None:
+            continue
+        cost = scan_cost(predicate, selectivity, total) + sort_cost
+        if cost < best_cost:
+            hint = index
+            best_cost = cost
+    if sort_keys is not None:
+        equality_fields = [
+            predicate["field"]
+            for _, predicate in estimates
+            if predicate["op"] == "equals"
+        ]
+        index, prefix = sort_index(sort_keys, equality_fields)
+        if index is not None:
+            prefix_part = 1.0
+            for selectivity, predicate in estimates:
+                if predicate["op"] == "equals" and predicate["field"] in prefix:
+                    prefix_part *= selectivity
+            # books read in order until a page of matches is found
+            prefix_books = prefix_part * total
+            read = min(page_size * prefix_books / max(matching, 1), prefix_books)
+            cost = read * (1 + KEY_COST)
+            if cost < best_cost:
+                hint = index
+                best_cost = cost
+
+    filters = [to_filter(predicate) for _, predicate in estimates]
+    return {
+        "filter": filters[0] if len(filters) == 1 else {"$and": filters},
+        "hint": hint,
+        "index": index_name(hint) if hint is not None else None,
+        "estimates": [
+            (predicate, round(selectivity * total))
+            for selectivity, predicate in estimates
+        ],
+    }
+
+
+def ensure_indexes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Create the indexes of BOOKS_INDEXES that the query planner can hint
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    db.books.create_indexes(
+        [pymongo.IndexModel(index) for index in BOOKS_INDEXES], session=session
+    )
+    return
+
+
+SAMPLE_FIELDS = [
+    "title",
+    "author",
+    "genres",
+    "sub_genres",
+    "main_characters",
+    "set_year",
+    "set_main_location",
+    "language",
+    "published_date",
+    "copy_right",
+    "ISBN",
+    "file_type",
+]
+SAMPLE_SIZE = 1000
+SAMPLE_SECONDS = 300
+# name in the menu: sort keys, _id last so the order is total and stable
+SORT_ORDERS = {
+    "title": [("title", 1), ("_id", 1)],
+    "published date": [("published_date", 1), ("_id", 1)],
+    "language": [("language", 1), ("title", 1), ("_id", 1)],
+    "recently added": [("_id", -1)],
+}
+DEFAULT_SORT = "title"
+# reading an index key costs about this part of reading a document
+KEY_COST = 0.05
+# sorting a document in memory costs about this part of reading it
+SORT_COST = 0.2
+_SAMPLE = None
+_SAMPLE_TIME = 0.0
@@ -0,0 +1,310 @@
+import datetime
+import bson
+
+
+class BadBook(Exception):
+    """Book is invalid"""
+
+    def __init__(self, violations: list):
+        super().__init__("Invalid book: " + "; ".join(violations))
+        self.violations = violations
+
+
+def _join(path: str, field: str) -> str:
+    """
+    Join a dotted path for violation messages
+
+    Args:
+        path: path of the parent
+        field: field name or array index
+
+    Returns: The dotted path
+    """
+    return f"{path}.{field}" if path else str(field)
+
+
+def compile_schema(schema: dict, ignore_required: tuple = ()):
+    """
+    Compile a $jsonSchema into a client side validator, the schema is walked
+    once here so validating a document is only a few isinstance calls and
+    dict lookups. Supports bsonType, required, properties, items, enum,
+    minLength, maxLength and minItems, "minimum" only applies to numbers like
+    on the server.
+
+    Args:
+        schema: the $jsonSchema
+        ignore_required: top level required fields that are added later,
+            like file_id which only exists after the upload
+
+    Returns: function(document, path="") returning the list of all violations
+    """
+    checks = []
+
+    bson_type = schema.get("bsonType")
+    if bson_type is not None:
+        bson_types = [bson_type] if isinstance(bson_type, str) else bson_type
+        python_types = tuple(BSON_TYPES[name] for name in bson_types)
+        type_name = " or ".join(bson_types)
+
+        def check_type(value, path):
+            if isinstance(value, python_types) and not (
+                isinstance(value, bool) and bool not in python_types
+            ):
+                return True, []
+            return False, [f"{path or 'document'} must be {type_name}"]
+
+    else:
+
+        def check_type(value, path):
+            return True, []
+
+    required = tuple(
+        field for field in schema.get("required", []) if field not in ignore_required
+    )
+    if required:
+
+        def check_required(value, path):
+            if not isinstance(value, dict):
+                return []
+            return [
+                f"{_join(path, field)} is required"
+                for field in required
+                if field not in value
+            ]
+
+        checks.append(check_required)
+
+    properties = tuple(
+        (field, compile_schema(sub_schema))
+        for field, sub_schema in schema.get("properties", {}).items()
+    )
+    if properties:
+
+        def check_properties(value, path):
+            if not isinstance(value, dict):
+                return []
+            violations = []
+            for field, validate in properties:
+                if field in value:
+                    violations.extend(validate(value[field], _join(path, field)))
+            return violations
+
+        checks.append(check_properties)
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"])
+
+        def check_items(value, path):
+            if not isinstance(value, list):
+                return []
+            violations = []
+            for i, item in enumerate(value):
+                violations.extend(validate_item(item, _join(path, i)))
+            return violations
+
+        checks.append(check_items)
+
+    if "enum" in schema:
+        enum = schema["enum"]
+
+        def check_enum(value, path):
+            if value in enum:
+                return []
+            return [f"{path or 'document'} must be one of {enum}"]
+
+        checks.append(check_enum)
+
+    for keyword, python_type, compare, message in LENGTH_KEYWORDS:
+        if keyword in schema:
+            limit = schema[keyword]
+
+            def check_length(
+                value,
+                path,
+                limit=limit,
+                python_type=python_type,
+                compare=compare,
+                message=message,
+            ):
+                if isinstance(value, python_type) and not compare(len(value), limit):
+                    return [f"{path or 'document'} {message} {limit}"]
+                return []
+
+            checks.append(check_length)
+
+    checks = tuple(checks)
+
+    def validate(value, path: str = "") -> list:
+        valid_type, violations = check_type(value, path)
+        if not valid_type:
+            return violations
+        for check in checks:
+            violations.extend(check(value, path))
+        return violations
+
+    return validate
+
+
+def book_violations(book: dict) -> list:
+    """
+    Check a book against BOOKS_SCHEMA before it is uploaded, file_id is not
+    required because it is set by the upload
+
+    Args:
+        book: the book document
+
+    Returns: list of all violations, empty if the book is valid
+    """
+    return _BOOK_VALIDATOR(book)
+
+
+def validate_book(book: dict) -> None:
+    """
+    Check a book against BOOKS_SCHEMA before any database or GridFS work
+
+    Args:
+        book: the book document
+
+    Returns: None
+    """
+    violations = _BOOK_VALIDATOR(book)
+    if violations:
+        raise BadBook(violations)
+    return
+
+
+BSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "date": datetime.datetime,
+    "objectId": bson.ObjectId,
+    "bool": bool,
+    "int": int,
+    "long": int,
+    "double": float,
+}
+LENGTH_KEYWORDS = [
+    ("minLength", str, lambda length, limit: length >= limit, "must be at least"),
+    ("maxLength", str, lambda length, limit: length <= limit, "must be at most"),
+    ("minItems", list, lambda length, limit: length >= limit, "must have at least"),
+]
+BOOKS_SCHEMA = {
+    "$jsonSchema": {
+        "bsonType": "object",
+        "required": [
+            "title",
+            "author",
+            "language",
+            "ISBN",
+            "published_date",
+            "genres",
+            "sub_genres",
+            "main_characters",
+            "file_name",
+        ],
+        # the file of a book is in GridFS (file_id) or in another storage
+        # backend of blob_storage.py (storage_uri)
+        "anyOf": [{"required": ["file_id"]}, {"required": ["storage_uri"]}],
+        "properties": {
+            "title": {
+                "bsonType": "string",
+                "minimum": 1,
+                "description": "Title of the book",
+            },
+            "author": {
+                "bsonType": "array",
+                "items": {
+                    "bsonType": "object",
+                    "required": ["name"],
+                    "properties": {
+                        "name": {
+                            "bsonType": "string",
+                            "minimum": 1,
+                            "description": "Name of the author",
+                        },
+                        "pseudonym": {
+                            "bsonType": "string",
+                            "description": "Pseudonym of the author",
+                        },
+                    },
+                },
+                "description": "Authors of the book",
+            },
+            "language": {"bsonType": "string", "description": "Language of the book"},
+            "published_date": {
+                "bsonType": "date",
+                "description": "Published date of the book",
+            },
+            "genres": {
+                "bsonType": "array",
+                "items": {"bsonType": "string", "description": "Genre of the book"},
+                "description": "Genres of the book",
+            },
+            "sub_genres": {
+                "bsonType": "array",
+                "items": {"bsonType": "string", "description": "Sub-genre of the book"},
+                "description": "Sub-genres of the book",
+            },
+            "set_year": {
+                "bsonType": "string",
+                "minimum": 1,
+                "description": "Set year of the book",
+            },
+            "set_main_location": {
+                "bsonType": "string",
+                "description": "Set country of the book",
+            },
+            "copy_right": {
+                "bsonType": "string",
+                "description": "Copy-right of the book",
+            },
+            "ISBN": {
+                "bsonType": "string",
+                "description": "ISBN of the book",
+            },
+            "main_characters": {
+                "bsonType": "array",
+                "items": {
+                    "bsonType": "string",
+                    "description": "Main characters of the book",
+                },
+                "description": "Main characters of the book",
+            },
+            "file_type": {
+                "bsonType": "string",
+                "description": "File type of the book",
+            },
+            "file_name": {
+                "bsonType": "string",
+                "description": "File name of the book",
+            },
+            "file_id": {
+                "bsonType": "objectId",
+                "description": "File id of the book",
+            },
+            "storage_uri": {
+                "bsonType": "string",
+                "description": "Storage uri of the file of the book",
+            },
+        },
+    }
+}
+# secondary indexes of books, the ones the query planner can hint, the
+# natural_key index of the loader and the text index are not in this list.
+# The indexes that end with a sort order of query.SORT_ORDERS return a page
+# in order, the ones that start with file_type do it for one file type
+BOOKS_INDEXES = [
+    [("file_type", 1), ("_id", 1)],
+    [("file_type", 1), ("title", 1), ("_id", 1)],
+    [("file_type", 1), ("published_date", 1), ("_id", 1)],
+    [("title", 1), ("_id", 1)],
+    [("author.name", 1)],
+    [("genres", 1)],
+    [("language", 1), ("title", 1), ("_id", 1)],
+    [("published_date", 1), ("_id", 1)],
+    [("ISBN", 1)],
+]
+_BOOK_VALIDATOR = compile_schema(
+    BOOKS_SCHEMA["$jsonSchema"], ignore_required=("file_id",)
+)
@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+import argparse
+import sys
+import pymongo
+import bulk_loader
+from connection import get_client
+
+
+def shard_key(
+    *,
+    db: pymongo.mongo_client.database.Database,
+    collection_name: str,
+) -> dict | None:
+    """
+    Get the shard key of a collection
+
+    Args:
+        db: use in which database
+        collection_name: name of the collection
+
+    Returns: The shard key or None if the collection is not sharded
+    """
+    if not db.client.is_mongos:
+        return None
+    collection = db.client.get_database("config").collections.find_one(
+        {"_id": f"{db.name}.{collection_name}", "dropped": {"$ne": True}}
+    )
+    if collection is None:
+        return None
+    return collection["key"]
+
+
+def shard_books(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Shard the books collection on BOOKS_SHARD_KEY, the collection is created
+    with its validator if it does not exist
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    bulk_loader.initialize_database(session=session, db=db)
+    if shard_key(db=db, collection_name="books") is not None:
+        return
+    # a unique index has to start with the shard key, the loader keeps
+    # natural_key unique with its own lookups
+    indexes = db.books.index_information(session=session)
+    if indexes.get("natural_key_1", {}).get("unique"):
+        db.books.drop_index("natural_key_1", session=session)
+        db.books.create_index("natural_key", session=session)
+    db.books.create_index(list(BOOKS_SHARD_KEY.items()), session=session)
+    db.client.admin.command(
+        "shardCollection", f"{db.name}.books", key=BOOKS_SHARD_KEY, session=session
+    )
+    return
+
+
+def shard_chunks(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Shard fs.chunks on a hash of files_id, the chunks of a file stay on one
+    shard and new files, whose ObjectId always grows, spread over every
+    shard instead of all landing in the last chunk range
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    if shard_key(db=db, collection_name="fs.chunks") is not None:
+        return
+    db.fs.chunks.create_index(list(CHUNKS_SHARD_KEY.items()), session=session)
+    db.client.admin.command(
+        "shardCollection", f"{db.name}.fs.chunks", key=CHUNKS_SHARD_KEY, session=session
+    )
+    return
+
+
+def setup(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Prepare the database for a sharded cluster, safe to run again
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    if not db.client.is_mongos:
+        raise RuntimeError("Sharding needs a connection to mongos")
+    db.client.admin.command("enableSharding", db.name, session=session)
+    shard_books(session=session, db=db)
+    shard_chunks(session=session, db=db)
+    return
+
+
+def print_status(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Print the shard key and the documents per shard of the sharded
+    collections and how many shards a page of books by file type reads
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    for collection_name in ["books", "fs.chunks"]:
+        print("-" * 79)
+        key = shard_key(db=db, collection_name=collection_name)
+        print(f"{collection_name}: shard key {key}")
+        if key is None:
+            continue
+        stats = db.get_collection(collection_name).aggregate(
+            [{"$collStats": {"count": {}}}], session=session
+        )
+        for shard in stats:
+            print(f"    {shard['shard']}: {shard['count']} documents")
+    print("-" * 79)
+    for file_type in ["EPUB", "PDF"]:
+        explain = db.command(
+            "explain",
+            {
+                "aggregate": "books",
+                "pipeline": [{"$match": {"file_type": file_type}}, {"$limit": 5}],
+                "cursor": {},
+            },
+            session=session,
+        )
+        shards = len(explain.get("shards", {}))
+        print(f"page of {file_type} books reads {shards} shards")
+    return
+
+
+def main():
+    """
+    Main function to set up sharding or show its status
+
+    Returns: EXIT_SUCCESS or EXIT_FAILURE
+    """
+    parser = argparse.ArgumentParser(description="Shard the books database")
+    parser.add_argument("command", choices=["setup", "status"])
+    args = parser.parse_args()
+
+    with (
+        get_client("bulk_load") as client,
+        client.start_session(causal_consistency=True) as session,
+    ):
+        db = client.get_database("books")
+        try:
+            if args.command == "setup":
+                setup(session=session, db=db)
+                print("Sharding is set up")
+            print_status(session=session, db=db)
+        except (RuntimeError, pymongo.errors.OperationFailure) as error_message:
+            print(error_message)
+            return EXIT_FAILURE
+    return EXIT_SUCCESS
+
+
+# file_type first so a search by file type only reads the shards that
+# hold it, then a hash of _id: an ObjectId always grows, on a range every
+# insert of a file type would go to its last chunk and one shard
+BOOKS_SHARD_KEY = {"file_type": 1, "_id": "hashed"}
+CHUNKS_SHARD_KEY = {"files_id": "hashed"}
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import pymongo
+from schema import BOOKS_INDEXES
+
+
+def summarize(book: dict) -> dict:
+    """
+    Get the summary document of a book, the fields the lists and most
+    searches need without the long text fields and the file fields
+
+    Args:
+        book: the book
+
+    Returns: The summary document, keyed by the _id of the book
+    """
+    summary = {"_id": book["_id"]}
+    for field in SUMMARY_FIELDS:
+        if field == "author" and "author" in book:
+            summary["author"] = [
+                {key: author[key] for key in ["name", "pseudonym"] if key in author}
+                for author in book["author"]
+            ]
+        elif field in book:
+            summary[field] = book[field]
+    return summary
+
+
+def covering_index(index: list) -> list:
+    """
+    Get the books_summary index for an index of the books collection, title
+    is added at the end so a page of titles is read from the index alone.
+    An index on an array field (ARRAY_FIELDS) is multikey and MongoDB never
+    covers a query with it, those pages still fetch the small summaries
+
+    Args:
+        index: key pattern of BOOKS_INDEXES or the _id index
+
+    Returns: key pattern of the summary index
+    """
+    if any(field == "title" for field, _ in index):
+        return index
+    return index + [("title", 1)]
+
+
+def summary_indexes() -> list:
+    """
+    Get the indexes of books_summary, one for every index of BOOKS_INDEXES
+    and the _id index that only has summary fields
+
+    Returns: list of key patterns
+    """
+    return [
+        covering_index(index)
+        for index in BOOKS_INDEXES + [[("_id", 1)]]
+        if all(field.split(".")[0] in SUMMARY_FIELDS + ["_id"] for field, _ in index)
+    ]
+
+
+def can_answer(predicates: list) -> bool:
+    """
+    Check if a search can be answered from books_summary
+
+    Args:
+        predicates: predicates of the query module
+
+    Returns: True if every predicate is on a summary field
+    """
+    return all(
+        predicate["field"].split(".")[0] in SUMMARY_FIELDS for predicate in predicates
+    )
+
+
+def list_projection(sort_keys: list) -> dict:
+    """
+    Get the projection of a page of a list, the title and the sort fields
+    for the next page, covered by the summary index of the sort order when
+    it is not on an array field
+
+    Args:
+        sort_keys: sort order of query.SORT_ORDERS
+
+    Returns: The projection
+    """
+    projection = {"title": 1}
+    for field, _ in sort_keys:
+        projection[field] = 1
+    return projection
+
+
+def ensure_indexes(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Create the indexes of books_summary
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    db.books_summary.create_indexes(
+        [pymongo.IndexModel(index) for index in summary_indexes()], session=session
+    )
+    return
+
+
+def backfill(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> int:
+    """
+    Rebuild books_summary from the books collection on the server with one
+    $merge, no book is sent to the client
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: number of summary documents
+    """
+    db.drop_collection("books_summary", session=session)
+    ensure_indexes(session=session, db=db)
+    projection = {field: 1 for field in SUMMARY_FIELDS if field != "author"}
+    projection["author.name"] = 1
+    projection["author.pseudonym"] = 1
+    db.books.aggregate(
+        [
+            {"$project": projection},
+            {
+                "$merge": {
+                    "into": "books_summary",
+                    "on": "_id",
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert",
+                }
+            },
+        ],
+        session=session,
+    )
+    return db.books_summary.count_documents({}, session=session)
+
+
+def ensure_summary(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+) -> None:
+    """
+    Backfill books_summary if it does not have a summary of every book, the
+    write paths keep it up to date after that
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+
+    Returns: None
+    """
+    books = db.books.estimated_document_count()
+    if db.books_summary.estimated_document_count() != books:
+        backfill(session=session, db=db)
+    return
+
+
+def write_requests(books: list) -> list:
+    """
+    Get the bulk_write requests that store the summaries of books
+
+    Args:
+        books: the books, with their _id
+
+    Returns: list of ReplaceOne upserts
+    """
+    return [
+        pymongo.ReplaceOne({"_id": book["_id"]}, summarize(book), upsert=True)
+        for book in books
+    ]
+
+
+def book_saved(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book: dict,
+) -> None:
+    """
+    Store the summary of an added or edited book, called by the write paths
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book: the book as it is stored
+
+    Returns: None
+    """
+    db.books_summary.replace_one(
+        {"_id": book["_id"]}, summarize(book), upsert=True, session=session
+    )
+    return
+
+
+def book_deleted(
+    *,
+    session: pymongo.mongo_client.client_session,
+    db: pymongo.mongo_client.database.Database,
+    book_id,
+) -> None:
+    """
+    Delete the summary of a deleted book, called by the write paths
+
+    Args:
+        session: session to connect to the database
+        db: use in which database
+        book_id: id of the book
+
+    Returns: None
+    """
+    db.books_summary.delete_one({"_id": book_id}, session=session)
+    return
+
+
+# ISBN is short and searched often, copy_right, the places and characters
+# and the file fields are only read by the book menu
+SUMMARY_FIELDS = [
+    "title",
+    "file_type",
+    "language",
+    "published_date",
+    "author",
+    "genres",
+    "ISBN",
+]
+# fields that hold arrays, their indexes are multikey and can not cover a query
+ARRAY_FIELDS = ["author", "genres"]
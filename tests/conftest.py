@@ -0,0 +1,20 @@
+import os
+import sys
+import mongomock
+import mongomock.gridfs
+import pytest
+
+# the modules of the project are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+mongomock.gridfs.enable_gridfs_integration()
+
+import book_text  # noqa: E402
+import covers  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory books database, the text and covers are not extracted"""
+    monkeypatch.setattr(book_text, "schedule_extraction", lambda **kwargs: None)
+    monkeypatch.setattr(covers, "schedule_cover", lambda **kwargs: None)
+    return mongomock.MongoClient().get_database("books")
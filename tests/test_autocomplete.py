@@ -0,0 +1,57 @@
+import autocomplete
+
+
+def make_index(titles: dict) -> autocomplete.SuggestionIndex:
+    index = autocomplete.SuggestionIndex()
+    index.load(
+        {"title": title} for title, count in titles.items() for _ in range(count)
+    )
+    return index
+
+
+def test_normalize():
+    assert (
+        autocomplete.normalize("  Le  Fantôme de l'OPÉRA ") == "le fantome de l'opera"
+    )
+
+
+def test_complete_ranks_every_value_of_the_prefix():
+    titles = {f"Dracula part {i:04d}": 1 for i in range(500)}
+    titles["Dracula's Guest"] = 5
+    titles["Dracula"] = 3
+    titles["Frankenstein"] = 9
+    index = make_index(titles)
+    assert index.complete("title", "drac", limit=2) == ["Dracula's Guest", "Dracula"]
+    assert index.complete("title", "DRÁC", limit=1) == ["Dracula's Guest"]
+    assert index.complete("title", "x") == []
+    assert len(index.complete("title", "dracula part", limit=50)) == 50
+
+
+def test_complete_sees_changed_values():
+    index = make_index({"Dracula": 2, "Dracula's Guest": 1})
+    assert index.complete("title", "dra", limit=1) == ["Dracula"]
+    for _ in range(3):
+        index.add_book({"title": "Dracula's Guest"})
+    assert index.complete("title", "dra", limit=1) == ["Dracula's Guest"]
+    for _ in range(4):
+        index.remove_book({"title": "Dracula's Guest"})
+    assert index.complete("title", "dra") == ["Dracula"]
+
+
+def test_did_you_mean():
+    index = make_index({"Frankenstein": 1, "Dracula": 1, "Carmilla": 1})
+    assert index.did_you_mean("title", "Frankenstien") == ["Frankenstein"]
+    assert index.did_you_mean("title", "zzz") == []
+    assert index.did_you_mean("title", "") == []
+
+
+def test_values_of_a_book():
+    book = {
+        "title": "Dracula",
+        "author": [{"name": "Bram Stoker", "pseudonym": "B. S."}, {"name": "X"}],
+        "genres": ["Horror"],
+    }
+    assert autocomplete.title_values(book) == ["Dracula"]
+    assert autocomplete.author_values(book) == ["Bram Stoker", "X"]
+    assert autocomplete.pseudonym_values(book) == ["B. S."]
+    assert autocomplete.list_values("genres")(book) == ["Horror"]
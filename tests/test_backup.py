@@ -0,0 +1,42 @@
+import zlib
+from unittest import mock
+import bson
+import mongomock
+import pytest
+import backup
+import history
+
+
+def test_clear_derived_resets_the_collections_made_from_the_books():
+    db = mongomock.MongoClient().get_database("books")
+    for name in backup.DERIVED_COLLECTIONS:
+        db.get_collection(name).insert_one({"book_id": bson.ObjectId()})
+    db.create_collection("books_history_2024_05")
+    history._PARTITIONS.add("books_history_2024_05")
+
+    # mongomock has no $merge
+    with mock.patch("summary.backfill") as backfill:
+        backup.clear_derived(session=None, db=db)
+    backfill.assert_called_once_with(session=None, db=db)
+
+    names = db.list_collection_names()
+    for name in backup.DERIVED_COLLECTIONS:
+        assert name not in names
+    assert history.list_partitions(db) == []
+    assert history._PARTITIONS == set()
+
+
+def test_iter_part_rejects_a_corrupt_length(tmp_path):
+    path = tmp_path / "part.bson"
+    path.write_bytes(zlib.compress(bson.encode({"a": 1}) + b"\x01\x00\x00\x00\x00"))
+    with pytest.raises(ValueError):
+        list(backup.iter_part(str(path), "zlib"))
+
+
+def test_iter_part_reads_every_document(tmp_path):
+    documents = [{"_id": i, "title": "x" * i} for i in range(50)]
+    path = tmp_path / "part.bson"
+    path.write_bytes(zlib.compress(b"".join(bson.encode(d) for d in documents)))
+    assert [
+        bson.decode(document.raw) for document in backup.iter_part(str(path), "zlib")
+    ] == documents
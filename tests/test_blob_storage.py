@@ -0,0 +1,39 @@
+import hashlib
+import mongomock
+import pytest
+import blob_storage
+import book_storage
+
+
+def test_blob_backend_is_abstract():
+    with pytest.raises(TypeError):
+        blob_storage.BlobBackend()
+
+
+def test_gridfs_keeps_the_files_of_books_with_the_same_name(tmp_path):
+    db = mongomock.MongoClient().get_database("books")
+    first = tmp_path / "first.epub"
+    second = tmp_path / "second.epub"
+    first.write_bytes(b"first book " * 1000)
+    second.write_bytes(b"second book " * 1000)
+    first_id = book_storage.save_file_gridfs(
+        session=None, db=db, file_name="book.epub", file_path=str(first)
+    )
+    second_id = book_storage.save_file_gridfs(
+        session=None, db=db, file_name="book.epub", file_path=str(second)
+    )
+    assert first_id != second_id
+    for file_id, path in [(first_id, first), (second_id, second)]:
+        content = b"".join(
+            book_storage.iter_file_gridfs(session=None, db=db, file_id=file_id)
+        )
+        assert content == path.read_bytes()
+
+
+def test_filesystem_file_info_has_the_sha256(tmp_path):
+    backend = blob_storage.FileSystemBackend(str(tmp_path))
+    data = b"some pdf content"
+    fields = backend.save_blocks([data], ".pdf")
+    info = backend.file_info(db=None, books=[fields])
+    assert info[fields["storage_uri"]]["sha256"] == hashlib.sha256(data).hexdigest()
+    assert info[fields["storage_uri"]]["length"] == len(data)
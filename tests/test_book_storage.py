@@ -0,0 +1,73 @@
+import io
+import os
+import pytest
+import book_storage
+from connection import DEFAULT_GRIDFS_CHUNK_SIZES
+
+MB = 1024 * 1024
+
+
+def test_sample_codec_keeps_a_codec_that_compresses():
+    infile = io.BytesIO(b"the same sentence again and again " * 10000)
+    assert book_storage.sample_codec(infile, "zlib") == "zlib"
+    assert infile.tell() == 0
+
+
+def test_sample_codec_stores_random_data_as_is():
+    infile = io.BytesIO(os.urandom(256 * 1024))
+    assert book_storage.sample_codec(infile, "zlib") is None
+    assert infile.tell() == 0
+
+
+def test_sample_codec_only_reads_the_sample():
+    # compressible start, random rest: the start decides
+    data = b"a" * book_storage.SAMPLE_SIZE + os.urandom(1024 * 1024)
+    assert book_storage.sample_codec(io.BytesIO(data), "zlib") == "zlib"
+
+
+def test_sample_codec_without_codec_and_empty_file():
+    assert book_storage.sample_codec(io.BytesIO(b"abc"), None) is None
+    assert book_storage.sample_codec(io.BytesIO(b""), "zlib") is None
+
+
+def test_get_codec():
+    assert book_storage.get_codec("application/pdf", "none") is None
+    assert book_storage.get_codec("application/pdf", "zlib") == "zlib"
+    with pytest.raises(ValueError):
+        book_storage.get_codec("application/pdf", "lzma")
+
+
+def test_chunk_size_for_picks_the_size_class():
+    chunk_sizes = [
+        {"max_mb": 1, "chunk_kb": 255},
+        {"max_mb": 64, "chunk_kb": 1024},
+        {"max_mb": None, "chunk_kb": 1024 * 1024},
+    ]
+    assert book_storage.chunk_size_for(0, chunk_sizes) == 255 * 1024
+    assert book_storage.chunk_size_for(MB, chunk_sizes) == 255 * 1024
+    assert book_storage.chunk_size_for(MB + 1, chunk_sizes) == 1024 * 1024
+    # a chunk is one document and has to fit in 16 MB
+    assert (
+        book_storage.chunk_size_for(100 * MB, chunk_sizes)
+        == book_storage.MAX_CHUNK_SIZE
+    )
+
+
+def test_chunk_size_for_default_classes_grow_with_the_file():
+    sizes = [0, MB, 64 * MB, 1024 * MB]
+    chunk_sizes = [
+        book_storage.chunk_size_for(size, DEFAULT_GRIDFS_CHUNK_SIZES) for size in sizes
+    ]
+    assert chunk_sizes == sorted(chunk_sizes)
+    assert all(0 < size <= book_storage.MAX_CHUNK_SIZE for size in chunk_sizes)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_compressor_round_trip(codec):
+    if codec == "zstd" and book_storage.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    data = b"chapter one " * 50000
+    compressor = book_storage.new_compressor(codec)
+    compressed = compressor.compress(data) + compressor.flush()
+    decompressor = book_storage.new_decompressor(codec)
+    assert decompressor.decompress(compressed) == data
@@ -0,0 +1,21 @@
+import book_text
+
+
+def test_split_passages_keeps_every_line():
+    text = "\n".join(f"line {i}" for i in range(100))
+    passages = book_text.split_passages(text, 50)
+    assert "\n".join(passages) == text
+    assert all(len(passage) < 50 + len("line 99") + 1 for passage in passages)
+    assert len(passages) > 1
+
+
+def test_split_passages_short_text():
+    assert book_text.split_passages("one line", 1000) == ["one line"]
+    assert book_text.split_passages("", 1000) == [""]
+
+
+def test_snippet_shows_the_match():
+    text = "a" * 200 + " the phrase " + "b" * 200
+    snippet = book_text.snippet(text, "phrase", width=20)
+    assert "phrase" in snippet
+    assert len(snippet) < 100
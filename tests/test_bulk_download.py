@@ -0,0 +1,73 @@
+import hashlib
+import tarfile
+import zipfile
+import pytest
+import bulk_download
+
+
+@pytest.mark.parametrize(
+    "file_name, expected",
+    [
+        ("book.epub", "book.epub"),
+        ("../../etc/book.epub", "book.epub"),
+        ("/abs/book.pdf", "book.pdf"),
+        ("..\\windows\\book.pdf", "book.pdf"),
+        ("..", "42"),
+        ("dir/", "42"),
+    ],
+)
+def test_safe_file_name(file_name, expected):
+    assert bulk_download.safe_file_name({"_id": 42, "file_name": file_name}) == expected
+
+
+@pytest.mark.parametrize("archive_name", ["books.tar", "books.zip"])
+def test_archives_only_have_safe_names(tmp_path, monkeypatch, archive_name):
+    data = b"epub content"
+
+    def fake_download(*, db, book, output_file):
+        output_file.write(data)
+        return len(data)
+
+    monkeypatch.setattr(bulk_download, "download_to_file", fake_download)
+    monkeypatch.setattr(
+        bulk_download,
+        "iter_books_with_files",
+        lambda **kwargs: iter([{"_id": 1, "file_name": "../x.epub"}]),
+    )
+    archive_path = str(tmp_path / archive_name)
+    bulk_download.download_books(
+        db=None, filter_dict={}, output_dir=str(tmp_path), archive_path=archive_path
+    )
+    if archive_name.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            assert archive.namelist() == ["x.epub"]
+    else:
+        with tarfile.open(archive_path) as archive:
+            assert archive.getnames() == ["x.epub"]
+
+
+def test_download_skips_only_unchanged_files(tmp_path, monkeypatch):
+    data = b"hello world"
+    calls = []
+
+    def fake_download(*, db, book, output_file):
+        calls.append(book["file_name"])
+        output_file.write(data)
+        return len(data)
+
+    monkeypatch.setattr(bulk_download, "download_to_file", fake_download)
+    book = {
+        "_id": 1,
+        "file_name": "../book.pdf",
+        "grid_file": {"length": len(data), "sha256": hashlib.sha256(data).hexdigest()},
+    }
+    assert bulk_download.download_to_directory(
+        db=None, book=book, output_dir=str(tmp_path)
+    ) == len(data)
+    assert bulk_download.download_to_directory(
+        db=None, book=book, output_dir=str(tmp_path)
+    ) is None
+    (tmp_path / "book.pdf").write_bytes(b"hello worlD")
+    bulk_download.download_to_directory(db=None, book=book, output_dir=str(tmp_path))
+    assert len(calls) == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["book.pdf"]
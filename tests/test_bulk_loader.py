@@ -0,0 +1,80 @@
+import gridfs
+import bulk_loader
+from test_pipeline import make_books
+
+
+def load(db, books) -> dict:
+    return bulk_loader.add_books_incremental(
+        session=None, db=db, books=[dict(book) for book in books]
+    )
+
+
+def test_incremental_load_skips_reuses_and_uploads(db, tmp_path):
+    books = make_books(tmp_path, 3)
+    assert load(db, books) == {
+        "skipped": 0,
+        "updated": 0,
+        "uploaded": 3,
+        "rejected": 0,
+    }
+    assert load(db, books)["skipped"] == 3
+
+    # new metadata, same file: the stored file is reused
+    books[0]["language"] = "French"
+    file_id = db.books.find_one({"ISBN": "isbn-0"})["file_id"]
+    assert load(db, books[:1])["updated"] == 1
+    book = db.books.find_one({"ISBN": "isbn-0"})
+    assert book["language"] == "French"
+    assert book["file_id"] == file_id
+
+    # the stored file was deleted: it is uploaded again
+    gridfs.GridFS(db).delete(file_id)
+    books[0]["language"] = "German"
+    assert load(db, books[:1])["uploaded"] == 1
+    assert db.books.find_one({"ISBN": "isbn-0"})["file_id"] != file_id
+    assert db.books.count_documents({}) == 3
+
+
+def test_incremental_load_keeps_the_last_repeated_row(db, tmp_path):
+    books = make_books(tmp_path, 2)
+    stats = load(db, books + [dict(books[0], language="French")])
+    assert stats["skipped"] == 1
+    assert db.books.count_documents({}) == 2
+    assert db.books.find_one({"ISBN": "isbn-0"})["language"] == "French"
+
+
+def test_delete_checkpoint(db, tmp_path):
+    books = make_books(tmp_path, 1)
+    load(db, books)
+    book = db.books.find_one()
+    bulk_loader.delete_checkpoint(session=None, db=db, book=book)
+    assert db.bulk_load_checkpoint.count_documents({}) == 0
+    assert load(db, books)["uploaded"] == 1
+
+
+def test_last_by_natural_key():
+    books = [
+        {"natural_key": "a", "v": 1},
+        {"natural_key": "b", "v": 2},
+        {"natural_key": "a", "v": 3},
+    ]
+    assert bulk_loader.last_by_natural_key(books) == [
+        {"natural_key": "a", "v": 3},
+        {"natural_key": "b", "v": 2},
+    ]
+    items = [(book, None) for book in books]
+    assert bulk_loader.last_by_natural_key(items, lambda item: item[0]) == [
+        items[2],
+        items[1],
+    ]
+
+
+def test_natural_key_and_metadata_hash():
+    book = {"ISBN": "1", "title": "Dracula", "language": "English"}
+    assert bulk_loader.natural_key(book) == "1|Dracula"
+    # the stored file does not change the metadata hash
+    stored = dict(book, file_hash="abc", natural_key="1|Dracula")
+    assert bulk_loader.metadata_hash(stored) == bulk_loader.metadata_hash(book)
+    assert bulk_loader.metadata_hash(dict(book, language="French")) != (
+        bulk_loader.metadata_hash(book)
+    )
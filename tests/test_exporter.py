@@ -0,0 +1,105 @@
+import datetime
+import io
+import json
+from unittest import mock
+import bson
+import catalogue
+import exporter
+from schema import book_violations
+
+
+def make_book() -> dict:
+    return {
+        "_id": bson.ObjectId(),
+        "title": "The Hobbit",
+        "author": [{"name": "J. R. R. Tolkien", "pseudonym": "Oxymore"}],
+        "language": "English",
+        "published_date": datetime.datetime(1937, 9, 21),
+        "genres": ["Fantasy"],
+        "sub_genres": ["High fantasy", "Adventure"],
+        "main_characters": ["Bilbo Baggins", "Gandalf"],
+        "set_year": "2941",
+        "set_main_location": "Middle-earth",
+        "copy_right": "Allen & Unwin",
+        "ISBN": "978-0-261-10221-7",
+        "file_name": "the_hobbit.epub",
+        "file_type": "EPUB",
+        "file_id": bson.ObjectId(),
+    }
+
+
+def test_csv_export_loads_back(tmp_path):
+    book = make_book()
+    csv_path = str(tmp_path / "books.csv")
+    assert exporter.write_csv([book], csv_path, exporter.EXPORT_FIELDS) == 1
+
+    rejects = io.StringIO()
+    rows = catalogue.read_manifest(csv_path)
+    books = catalogue.parse_rows(rows, csv_path, rejects)
+    loaded = list(catalogue.validate_rows(books, csv_path, rejects, book_violations))
+
+    assert rejects.getvalue() == ""
+    assert len(loaded) == 1
+    for field in exporter.STORAGE_FIELDS:
+        assert field not in loaded[0]
+    assert loaded[0]["file_path"] == str(tmp_path / "the_hobbit.epub")
+    for field in exporter.EXPORT_FIELDS:
+        if field not in exporter.STORAGE_FIELDS:
+            assert loaded[0][field] == book[field], field
+
+
+def test_csv_value():
+    assert exporter.csv_value("title", None) == ""
+    assert exporter.csv_value("genres", ["a", "b"]) == "a; b"
+    assert (
+        exporter.csv_value("author", [{"name": "A"}, {"name": "B", "pseudonym": "C"}])
+        == "A; B (C)"
+    )
+    assert (
+        exporter.csv_value("published_date", datetime.datetime(2001, 2, 3))
+        == "2001/02/03"
+    )
+
+
+def test_jsonl_export_writes_only_the_fields(tmp_path):
+    jsonl_path = str(tmp_path / "books.jsonl")
+    exporter.write_jsonl([make_book()], jsonl_path, ["title", "ISBN"])
+    with open(jsonl_path, encoding="utf-8") as infile:
+        rows = [json.loads(line) for line in infile]
+    assert rows == [{"title": "The Hobbit", "ISBN": "978-0-261-10221-7"}]
+
+
+def test_iter_books_hints_only_split_ranges():
+    db = mock.MagicMock()
+    cursor = db.books.find.return_value.sort.return_value
+    list(exporter.iter_books(db=db, filter_dict={"ISBN": "1"}, fields=["title"]))
+    cursor.hint.assert_not_called()
+    list(
+        exporter.iter_books(
+            db=db, filter_dict={"ISBN": "1"}, fields=["title"], lower=1, upper=5
+        )
+    )
+    cursor.hint.assert_called_once_with([("_id", 1)])
+    assert db.books.find.call_args[0][0] == {
+        "$and": [{"ISBN": "1"}, {"_id": {"$gte": 1, "$lt": 5}}]
+    }
+
+
+def test_split_id_ranges():
+    db = mock.MagicMock()
+    db.books.aggregate.return_value = [{"_id": i} for i in range(0, 100)]
+    ranges = exporter.split_id_ranges(db=db, filter_dict={}, parts=4)
+    assert ranges == [(None, 25), (25, 50), (50, 75), (75, None)]
+    assert exporter.split_id_ranges(db=db, filter_dict={}, parts=1) == [(None, None)]
+    # too few books to split
+    db.books.aggregate.return_value = [{"_id": 1}]
+    assert exporter.split_id_ranges(db=db, filter_dict={}, parts=4) == [(None, None)]
+
+
+def test_split_id_ranges_drops_repeated_bounds():
+    db = mock.MagicMock()
+    db.books.aggregate.return_value = [{"_id": 7}] * 10
+    assert exporter.split_id_ranges(db=db, filter_dict={}, parts=4) == [
+        (None, 7),
+        (7, None),
+    ]
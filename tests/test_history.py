@@ -0,0 +1,149 @@
+import datetime
+import mongomock
+import history
+
+
+def make_db():
+    history._PARTITIONS.clear()
+    return mongomock.MongoClient().get_database("books")
+
+
+def test_prune_keeps_the_retention():
+    db = make_db()
+    for month in range(1, 13):
+        db.create_collection(f"books_history_2024_{month:02d}")
+    dropped = history.prune(db=db, now=datetime.datetime(2024, 12, 15), months=3)
+    assert sorted(dropped) == [
+        f"books_history_2024_{month:02d}" for month in range(1, 10)
+    ]
+    assert [name for _, name in history.list_partitions(db)] == [
+        "books_history_2024_12",
+        "books_history_2024_11",
+        "books_history_2024_10",
+    ]
+
+
+def test_prune_zero_months_keeps_nothing():
+    db = make_db()
+    db.create_collection("books_history_2024_12")
+    dropped = history.prune(db=db, now=datetime.datetime(2024, 12, 15), months=0)
+    assert dropped == ["books_history_2024_12"]
+
+
+def test_prune_default_retention():
+    db = make_db()
+    db.create_collection("books_history_2023_01")
+    db.create_collection("books_history_2022_12")
+    dropped = history.prune(db=db, now=datetime.datetime(2024, 12, 15))
+    assert dropped == ["books_history_2022_12"]
+
+
+def test_diff():
+    old = {"_id": 1, "title": "Old", "ISBN": "1", "genres": ["a"]}
+    new = {"_id": 1, "title": "New", "ISBN": "1", "language": "English"}
+    assert history.diff(old, new) == {
+        "title": {"old": "Old", "new": "New"},
+        "genres": {"old": ["a"]},
+        "language": {"new": "English"},
+    }
+    assert history.diff(old, old) == {}
+    assert history.diff(old, None) == {
+        "title": {"old": "Old"},
+        "ISBN": {"old": "1"},
+        "genres": {"old": ["a"]},
+    }
+
+
+def test_book_at_undoes_the_later_changes():
+    db = make_db()
+    partition = db.get_collection("books_history_2024_05")
+    db.books.insert_one({"_id": 1, "title": "Third", "language": "English"})
+    partition.insert_many(
+        [
+            {
+                "book_id": 1,
+                "time": datetime.datetime(2024, 5, 1),
+                "action": "add",
+                "changes": {},
+            },
+            {
+                "book_id": 1,
+                "time": datetime.datetime(2024, 5, 10),
+                "action": "edit",
+                "changes": {"title": {"old": "First", "new": "Second"}},
+            },
+            {
+                "book_id": 1,
+                "time": datetime.datetime(2024, 5, 20),
+                "action": "edit",
+                "changes": {
+                    "title": {"old": "Second", "new": "Third"},
+                    "language": {"new": "English"},
+                },
+            },
+        ]
+    )
+
+    def book_at(day):
+        return history.book_at(
+            session=None, db=db, book_id=1, when=datetime.datetime(2024, 5, day)
+        )
+
+    assert book_at(25) == {"_id": 1, "title": "Third", "language": "English"}
+    assert book_at(15) == {"_id": 1, "title": "Second"}
+    assert book_at(5) == {"_id": 1, "title": "First"}
+    assert book_at(1) == {"_id": 1, "title": "First"}
+    # before it was added
+    assert history.book_at(
+        session=None, db=db, book_id=1, when=datetime.datetime(2024, 4, 30)
+    ) is None
+
+
+def test_write_paths_record_the_changes(monkeypatch):
+    db = make_db()
+    monkeypatch.setattr(history, "supports_transactions", lambda client: False)
+    book = {"title": "Dracula", "ISBN": "1"}
+    history.insert_book(session=None, db=db, book=book)
+    history.update_book(
+        session=None,
+        db=db,
+        book_filter={"_id": book["_id"]},
+        update={"$set": {"title": "Dracula's Guest"}},
+    )
+    # an update that changes nothing is not recorded
+    history.update_book(
+        session=None,
+        db=db,
+        book_filter={"_id": book["_id"]},
+        update={"$set": {"ISBN": "1"}},
+    )
+    history.delete_book(session=None, db=db, book_filter={"_id": book["_id"]})
+    records = list(history.iter_changes(session=None, db=db, book_id=book["_id"]))
+    assert [record["action"] for record in records] == ["delete", "edit", "add"]
+    assert records[1]["changes"] == {
+        "title": {"old": "Dracula", "new": "Dracula's Guest"}
+    }
+    assert records[0]["changes"]["ISBN"] == {"old": "1"}
+
+
+def test_record_changes_skips_edits_without_a_change():
+    db = make_db()
+    old = {"_id": 1, "title": "Carmilla"}
+    history.record_changes(
+        session=None,
+        db=db,
+        changes=[
+            ("add", None, {"_id": 2, "title": "Dracula"}),
+            ("edit", old, dict(old)),
+            ("edit", old, {"_id": 1, "title": "Camilla"}),
+        ],
+    )
+    records = [
+        record
+        for _, name in history.list_partitions(db)
+        for record in db.get_collection(name).find()
+    ]
+    assert sorted((record["book_id"], record["action"]) for record in records) == [
+        (1, "edit"),
+        (2, "add"),
+    ]
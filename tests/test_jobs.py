@@ -0,0 +1,66 @@
+import contextlib
+import datetime
+import mongomock
+import jobs
+from schema import BadBook
+
+
+def running_job(db, attempts: int, heartbeat_age: int):
+    return db.jobs.insert_one(
+        {
+            "kind": "test",
+            "status": "running",
+            "attempts": attempts,
+            "max_attempts": jobs.MAX_ATTEMPTS,
+            "heartbeat": jobs.now_utc() - datetime.timedelta(seconds=heartbeat_age),
+        }
+    ).inserted_id
+
+
+def test_recover_requeues_stale_jobs_with_attempts_left():
+    db = mongomock.MongoClient().get_database("books")
+    stale = running_job(db, 1, jobs.STALE_SECONDS + 10)
+    alive = running_job(db, 1, 1)
+    assert jobs.recover(db=db) == 1
+    assert db.jobs.find_one({"_id": stale})["status"] == "queued"
+    assert db.jobs.find_one({"_id": alive})["status"] == "running"
+
+
+def test_recover_fails_stale_jobs_without_attempts_left():
+    db = mongomock.MongoClient().get_database("books")
+    job_id = running_job(db, jobs.MAX_ATTEMPTS, jobs.STALE_SECONDS + 10)
+    assert jobs.recover(db=db) == 0
+    job = db.jobs.find_one({"_id": job_id})
+    assert job["status"] == "failed"
+    assert "error" in job
+
+
+def run_failing_job(monkeypatch, error) -> dict:
+    db = mongomock.MongoClient().get_database("books")
+    # mongomock has no sessions
+    monkeypatch.setattr(
+        db.client, "start_session", lambda **kwargs: contextlib.nullcontext()
+    )
+    queue = jobs.JobQueue.__new__(jobs.JobQueue)
+    queue.db = db
+
+    def fail(**kwargs):
+        raise error
+
+    queue.runners = {"test": fail}
+    job_id = db.jobs.insert_one(
+        {"kind": "test", "args": "{}", "attempts": 1, "max_attempts": 3}
+    ).inserted_id
+    queue.run(db.jobs.find_one({"_id": job_id}))
+    return db.jobs.find_one({"_id": job_id})
+
+
+def test_run_retries_errors_that_are_not_permanent(monkeypatch):
+    job = run_failing_job(monkeypatch, KeyError("missing"))
+    assert job["status"] == "queued"
+    assert job["error"] == "KeyError: 'missing'"
+
+
+def test_run_fails_on_invalid_books(monkeypatch):
+    job = run_failing_job(monkeypatch, BadBook(["title is required"]))
+    assert job["status"] == "failed"
@@ -0,0 +1,103 @@
+import datetime
+import threading
+import bulk_loader
+import pipeline
+
+
+def make_books(tmp_path, count: int) -> list:
+    books = []
+    for i in range(count):
+        path = tmp_path / f"book{i}.epub"
+        path.write_bytes(f"content of book {i} ".encode() * 100)
+        books.append(
+            {
+                "title": f"Book {i}",
+                "author": [{"name": "Author"}],
+                "language": "English",
+                "ISBN": f"isbn-{i}",
+                "published_date": datetime.datetime(2000, 1, 1),
+                "genres": ["Horror"],
+                "sub_genres": ["Gothic"],
+                "main_characters": ["Someone"],
+                "file_name": path.name,
+                "file_path": str(path),
+            }
+        )
+    return books
+
+
+def run_with_timeout(function, seconds: float = 30):
+    result = {}
+
+    def target():
+        try:
+            result["value"] = function()
+        except Exception as error_message:
+            result["error"] = error_message
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "the pipeline did not stop"
+    return result
+
+
+def test_pipeline_loads_a_repeated_book_once(db, tmp_path):
+    books = make_books(tmp_path, 5)
+    repeated = dict(books[0], language="French")
+    result = run_with_timeout(
+        lambda: pipeline.load_pipeline(
+            session=None, db=db, books=books + [repeated], uploaders=2
+        )
+    )
+    assert "error" not in result, result.get("error")
+    assert db.books.count_documents({}) == 5
+    assert db.books.find_one({"ISBN": "isbn-0"})["language"] == "French"
+    assert db.bulk_load_checkpoint.count_documents({}) == 5
+
+
+def test_pipeline_stops_on_a_reader_error(db, tmp_path):
+    def books():
+        yield from make_books(tmp_path, 3)
+        raise OSError("manifest is unreadable")
+
+    result = run_with_timeout(
+        lambda: pipeline.load_pipeline(session=None, db=db, books=books(), uploaders=2)
+    )
+    assert isinstance(result["error"], OSError)
+
+
+def test_pipeline_stops_on_a_writer_error(db, tmp_path, monkeypatch):
+    def fail(**kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(bulk_loader, "write_batch", fail)
+    result = run_with_timeout(
+        lambda: pipeline.load_pipeline(
+            session=None,
+            db=db,
+            books=make_books(tmp_path, 200),
+            batch_size=10,
+            uploaders=2,
+            queue_size=4,
+        )
+    )
+    assert isinstance(result["error"], RuntimeError)
+
+
+def test_pipeline_rejects_invalid_books(db, tmp_path):
+    books = make_books(tmp_path, 2)
+    del books[1]["title"]
+    rejected = []
+    result = run_with_timeout(
+        lambda: pipeline.load_pipeline(
+            session=None,
+            db=db,
+            books=books,
+            uploaders=1,
+            on_error=lambda book, error_message: rejected.append(book),
+        )
+    )
+    assert result["value"]["rejected"] == 1
+    assert result["value"]["uploaded"] == 1
+    assert rejected == [books[1]]